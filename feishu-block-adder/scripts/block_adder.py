@@ -6,13 +6,35 @@
 输出：add_result.json
 """
 
+import os
 import sys
 import json
 import time
 import re
+import uuid
+import random
+import mmap
+import zlib
+import mimetypes
+import threading
+import contextvars
 from pathlib import Path
 from datetime import datetime
-import requests
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+# 添加公共模块路径
+COMMON_SCRIPT_DIR = Path(__file__).parent.parent.parent / "feishu-common" / "scripts"
+if str(COMMON_SCRIPT_DIR) not in sys.path:
+    sys.path.insert(0, str(COMMON_SCRIPT_DIR))
+
+import feishu_client
+import http_metrics
+import rate_limiter
+import token_cache
+import docx_blocks
+
+import image_cache
+import progress_journal
 
 
 def load_config():
@@ -33,62 +55,59 @@ def load_config():
 
 
 def get_access_token(config, use_user_token=False):
-    """获取访问令牌"""
-    url = f"{config['FEISHU_API_DOMAIN']}/open-apis/auth/v3/tenant_access_token/internal"
-    headers = {"Content-Type": "application/json"}
-    payload = {
-        "app_id": config['FEISHU_APP_ID'],
-        "app_secret": config['FEISHU_APP_SECRET']
-    }
-    response = requests.post(url, json=payload, headers=headers)
-    result = response.json()
-    if result.get("code") == 0:
-        return result["tenant_access_token"]
-    else:
-        raise Exception(f"获取 token 失败: {result}")
+    """获取访问令牌（tenant_access_token，跨进程缓存，过期前自动刷新）"""
+    return token_cache.get_tenant_access_token(config)
+
+
+# 零宽字符：零宽空格、零宽非连字符、零宽连字符、零宽非断空格
+ZERO_WIDTH_TABLE = str.maketrans('', '', '\u200b\u200c\u200d\ufeff')
 
 
 def clean_cell_content(content):
     """清理单元格内容"""
     if not content:
         return ""
-    content = str(content).strip()
-    content = content.replace('\u200b', '')
-    content = content.replace('\u200c', '')
-    content = content.replace('\u200d', '')
-    content = content.replace('\ufeff', '')
+    content = str(content).strip().translate(ZERO_WIDTH_TABLE)
     content = re.sub(r'\*\*(.+?)\*\*', r'\1', content)
     if '\n' in content:
         content = content.split('\n')[0].strip()
     return content
 
 
-def create_table_with_style(token, config, document_id, rows_data):
-    """
-    创建表格并填充内容 - 使用 descendant API
+def new_temp_block_id(prefix):
+    """生成 /descendant 接口使用的临时 block_id"""
+    return f"{prefix}_{uuid.uuid4().hex[:16]}"
 
-    根据飞书官方规范，使用 /descendant 端点一次性创建表格和所有单元格
 
-    关键点：
-    1. children_id 只包含直接添加到文档的块（table_id）
-    2. descendants 包含所有块的详细信息（表格、单元格、单元格内容）
-    3. 表格的 children 引用单元格的 block_id
-    4. 单元格的 children 引用内容块的 block_id
+def payload_size(obj):
+    """计算对象序列化为 JSON 后的字节数，用于控制单次请求体大小"""
+    return len(json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+
+def build_table_descendants(rows_data, cell_elements=None):
     """
-    import uuid
+    构建表格的 descendants 子树
+
+    关键点：
+    1. 表格的 children 引用单元格的 block_id
+    2. 单元格的 children 引用内容块的 block_id
+    3. 行长度不一致时按第一行的列数补齐或截断，保证每个单元格都有对应的块
+    4. 有 cell_elements（解析器生成的行内格式）时使用它，否则使用清理后的纯文本
 
+    返回：(table_id, descendants)
+    """
     row_size = len(rows_data)
     col_size = len(rows_data[0]) if rows_data else 0
 
     # 生成唯一的 block_id
-    table_id = f"table_{uuid.uuid4().hex[:16]}"
+    table_id = new_temp_block_id("table")
 
     # 生成所有单元格和内容块的 block_id
     cell_ids = []
     cell_content_ids = []
     for i in range(row_size * col_size):
-        cell_ids.append(f"cell_{uuid.uuid4().hex[:16]}")
-        cell_content_ids.append(f"cellcontent_{uuid.uuid4().hex[:16]}")
+        cell_ids.append(new_temp_block_id("cell"))
+        cell_content_ids.append(new_temp_block_id("cellcontent"))
 
     # 构建完整的 descendants 列表
     descendants = []
@@ -109,13 +128,16 @@ def create_table_with_style(token, config, document_id, rows_data):
 
     # 2. 添加所有单元格块和内容块
     for row_idx, row in enumerate(rows_data):
+        row = (list(row) + [""] * col_size)[:col_size]
+        row_elements = list(cell_elements[row_idx]) if cell_elements and row_idx < len(cell_elements) else []
+        row_elements = (row_elements + [None] * col_size)[:col_size]
         for col_idx, cell_content in enumerate(row):
             cell_index = row_idx * col_size + col_idx
             cell_id = cell_ids[cell_index]
             cell_content_id = cell_content_ids[cell_index]
 
-            # 清理单元格内容
-            cell_content = clean_cell_content(cell_content)
+            # 单元格内容：优先使用带样式的元素，否则清理纯文本
+            elements = row_elements[col_idx] or [{"text_run": {"content": clean_cell_content(cell_content)}}]
 
             # 单元格块
             descendants.append({
@@ -130,28 +152,145 @@ def create_table_with_style(token, config, document_id, rows_data):
                 "block_id": cell_content_id,
                 "block_type": 2,
                 "text": {
-                    "elements": [{"text_run": {"content": cell_content}}],
+                    "elements": elements,
                     "style": {}
                 },
                 "children": []
             })
 
-    # 发送请求 - children_id 只包含 table_id
+    return table_id, descendants
+
+
+def split_elements_by_line(elements):
+    """把 text_run 元素按内容中的换行拆分为多行，每行是一组元素（空行为一个空文本）"""
+    lines = [[]]
+    for element in elements:
+        text_run = element.get("text_run")
+        if text_run is None:
+            lines[-1].append(element)
+            continue
+        for idx, part in enumerate(text_run.get("content", "").split('\n')):
+            if idx:
+                lines.append([])
+            if part:
+                lines[-1].append({"text_run": {**text_run, "content": part}})
+    return [line or [{"text_run": {"content": ""}}] for line in lines]
+
+
+def build_callout_descendants(block):
+    """
+    构建高亮块的 descendants 子树
+
+    在 /descendant 接口中 callout 是容器块：样式字段直接放在 callout 对象下，
+    文本内容作为子文本块（每行一个），而不是 callout.elements。
+
+    返回：(callout_id, descendants)
+    """
+    callout = dict(block.get("callout", {}))
+    elements = callout.pop("elements", [])
+
+    # 内容按行拆分为多个文本块，每行保留原有的行内样式
+    children_elements = split_elements_by_line(elements)
+
+    callout_id = new_temp_block_id("callout")
+    child_ids = [new_temp_block_id("calloutcontent") for _ in children_elements]
+
+    descendants = [{
+        "block_id": callout_id,
+        "block_type": 19,
+        "callout": callout,
+        "children": child_ids
+    }]
+    for child_id, child_elements in zip(child_ids, children_elements):
+        descendants.append({
+            "block_id": child_id,
+            "block_type": 2,
+            "text": {"elements": child_elements, "style": {}},
+            "children": []
+        })
+
+    return callout_id, descendants
+
+
+def build_block_tree(block):
+    """
+    将 blocks.json 中的一个块转换为 descendants 子树
+
+    - 表格：表格 + 单元格 + 单元格内容
+    - 高亮块：callout + 子文本块
+    - 图片：空图片块占位，创建后再上传素材
+    - 其他普通块：单个块
+
+    返回：(root_id, descendants)，不支持的块返回 None
+    """
+    if block.get("type") == "table":
+        return build_table_descendants(block["data"], block.get("cell_elements"))
+    if is_image_block(block):
+        image_id = new_temp_block_id("image")
+        return image_id, [{"block_id": image_id, "block_type": 27, "image": {}, "children": []}]
+    if block.get("block_type") == 19:
+        return build_callout_descendants(block)
+    if block.get("block_type") in BATCHABLE_BLOCK_TYPES:
+        block_id = new_temp_block_id("block")
+        node = strip_block(block)
+        node["block_id"] = block_id
+        node.setdefault("children", [])
+        return block_id, [node]
+    return None
+
+
+def create_descendants(token, config, document_id, children_id, descendants, index=-1, client_token=None):
+    """
+    调用 /descendant 接口一次性创建多棵子树
+
+    children_id 只包含直接添加到文档的块，descendants 包含所有块的详细信息；
+    client_token 相同的请求飞书只执行一次（重试不会重复创建）
+    返回响应中的 data（包含 children 和 block_id_relations）
+    """
     url = f"{config['FEISHU_API_DOMAIN']}/open-apis/docx/v1/documents/{document_id}/blocks/{document_id}/descendant?document_revision_id=-1"
+    if client_token:
+        url += f"&client_token={client_token}"
     headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json; charset=utf-8"}
 
     payload = {
-        "index": -1,
-        "children_id": [table_id],
+        "index": index,
+        "children_id": children_id,
         "descendants": descendants
     }
 
-    response = requests.post(url, json=payload, headers=headers)
-    result = response.json()
+    response = feishu_client.post(url, json=payload, headers=headers)
+    result = feishu_client.check_response(response, "创建嵌套块失败")
 
-    if result.get("code") != 0:
-        raise Exception(f"创建表格失败: {result}")
+    return result.get("data", {})
+
+
+def create_table_with_style(token, config, document_id, rows_data, cell_elements=None, client_token=None,
+                            index=-1):
+    """
+    创建表格并填充内容 - 使用 descendant API
+
+    根据飞书官方规范，使用 /descendant 端点一次性创建表格和所有单元格
+
+    关键点：
+    1. children_id 只包含直接添加到文档的块（table_id）
+    2. descendants 包含所有块的详细信息（表格、单元格、单元格内容）
+    3. 表格的 children 引用单元格的 block_id
+    4. 单元格的 children 引用内容块的 block_id
+
+    返回表格的真实 block_id
+    """
+    table_id, descendants = build_table_descendants(rows_data, cell_elements)
 
+    # 发送请求 - children_id 只包含 table_id
+    try:
+        data = create_descendants(token, config, document_id, [table_id], descendants, index=index,
+                                  client_token=client_token)
+    except feishu_client.APIError as e:
+        raise feishu_client.APIError(f"创建表格失败: {e}", e.status_code, e.code)
+
+    for relation in data.get("block_id_relations", []):
+        if relation.get("temporary_block_id") == table_id:
+            return relation["block_id"]
     return table_id
 
 
@@ -192,7 +331,7 @@ def create_callout_with_children(token, config, document_id, callout_style, call
         "index": -1
     }
 
-    response = requests.post(url, json=payload, headers=headers)
+    response = feishu_client.post(url, json=payload, headers=headers)
     result = response.json()
 
     if result.get("code") != 0:
@@ -206,9 +345,11 @@ def create_callout_with_children(token, config, document_id, callout_style, call
     return result["data"]["children"][0]["block_id"]
 
 
-def add_children_to_block(token, config, document_id, parent_block_id, children):
-    """添加子块到指定块"""
+def add_children_to_block(token, config, document_id, parent_block_id, children, client_token=None, index=-1):
+    """添加子块到指定块的 index 位置（-1 为末尾，client_token 用于幂等重试）"""
     url = f"{config['FEISHU_API_DOMAIN']}/open-apis/docx/v1/documents/{document_id}/blocks/{parent_block_id}/children"
+    if client_token:
+        url += f"?client_token={client_token}"
     headers = {
         "Authorization": f"Bearer {token}",
         "Content-Type": "application/json"
@@ -216,19 +357,59 @@ def add_children_to_block(token, config, document_id, parent_block_id, children)
 
     payload = {
         "children": children,
-        "index": -1
+        "index": index
     }
 
-    response = requests.post(url, json=payload, headers=headers)
-    result = response.json()
+    response = feishu_client.post(url, json=payload, headers=headers)
+    return feishu_client.check_response(response, "添加子块失败")
 
-    if result.get("code") != 0:
-        raise Exception(f"添加子块失败: {result}")
 
-    return result
+# 超过该大小（MB）的文件使用分片上传，可通过环境变量 FEISHU_MULTIPART_THRESHOLD_MB 修改
+DEFAULT_MULTIPART_THRESHOLD_MB = 20
+
+# 分片并发上传数
+MULTIPART_WORKERS = 4
+
+# 单个分片失败后的最大重试次数（指数退避）
+MAX_PART_RETRIES = 3
+
+# 素材上传的超时：(连接超时, 读取超时)，单位秒
+UPLOAD_TIMEOUT = (5, 120)
+
+
+def get_multipart_threshold():
+    """分片上传的大小阈值（字节）"""
+    try:
+        threshold_mb = float(os.environ.get("FEISHU_MULTIPART_THRESHOLD_MB", DEFAULT_MULTIPART_THRESHOLD_MB))
+    except ValueError:
+        threshold_mb = DEFAULT_MULTIPART_THRESHOLD_MB
+    return int(threshold_mb * 1024 * 1024)
+
+
+def guess_mime_type(file_name):
+    """按扩展名推断 MIME 类型"""
+    return mimetypes.guess_type(file_name)[0] or "application/octet-stream"
 
 
-def upload_image_file(token, config, image_block_id, image_path):
+def parse_media_response(response, action):
+    """
+    解析素材接口的响应，失败时抛出 APIError
+
+    异常带有 HTTP 状态码和业务 code，由 feishu_client.is_transient_error 判断能否重试
+    """
+    if response.status_code != 200:
+        raise feishu_client.APIError(f"{action}失败: HTTP {response.status_code}\n{response.text[:500]}",
+                                     response.status_code)
+    try:
+        result = response.json()
+    except ValueError as e:
+        raise feishu_client.APIError(f"解析响应失败: {e}\n响应内容: {response.text[:500]}", response.status_code)
+    if result.get("code") != 0:
+        raise feishu_client.APIError(f"{action}失败: {result}", response.status_code, result.get("code"))
+    return result.get("data", {})
+
+
+def upload_image_file(token, config, image_block_id, image_path, count_request=None):
     """
     上传图片文件到图片块
 
@@ -236,19 +417,28 @@ def upload_image_file(token, config, image_block_id, image_path):
     1. 创建图片 Block (已完成)
     2. 上传图片素材
     3. 设置图片 Block 的 token
+
+    文件超过分片阈值时使用分片上传（upload_prepare / upload_part / upload_finish），
+    否则使用 upload_all 一次上传。count_request(n) 用于统计实际发出的请求数。
     """
     if not Path(image_path).exists():
         raise Exception(f"图片文件不存在: {image_path}")
 
     file_size = Path(image_path).stat().st_size
     file_name = Path(image_path).name
+    count_request = count_request or (lambda count: None)
+
+    if file_size > get_multipart_threshold():
+        file_token = upload_media_multipart(token, config, image_block_id, image_path, count_request)
+        print(f"  [OK] 图片分片上传成功: {file_token}")
+        return file_token
 
     # 正确的 API 端点
     url = f"{config['FEISHU_API_DOMAIN']}/open-apis/drive/v1/medias/upload_all"
 
     with open(image_path, 'rb') as f:
         files = {
-            'file': (file_name, f, 'image/png')
+            'file': (file_name, f, guess_mime_type(file_name))
         }
         data = {
             'file_name': file_name,
@@ -258,25 +448,105 @@ def upload_image_file(token, config, image_block_id, image_path):
         }
         headers = {"Authorization": f"Bearer {token}"}
 
-        response = requests.post(url, headers=headers, files=files, data=data)
+        count_request(1)
+        response = feishu_client.post(url, headers=headers, files=files, data=data, timeout=UPLOAD_TIMEOUT)
+        file_token = parse_media_response(response, "上传图片")["file_token"]
+        print(f"  [OK] 图片上传成功: {file_token}")
+        return file_token
+
 
-        if response.status_code != 200:
-            raise Exception(f"上传图片失败: HTTP {response.status_code}\n{response.text[:500]}")
+def upload_media_part(token, config, upload_id, seq, mapped, block_size, count_request):
+    """
+    上传一个分片，临时错误（超时、5xx、限流）按指数退避重试（只重试这一个分片）
+
+    分片内容在这里才从内存映射中切出，同一时间内存中只有正在上传的分片。
+    非临时错误（参数、校验和、权限错误）重试也不会成功，立即抛出
+    """
+    url = f"{config['FEISHU_API_DOMAIN']}/open-apis/drive/v1/medias/upload_part"
+    headers = {"Authorization": f"Bearer {token}"}
+    chunk = mapped[seq * block_size:(seq + 1) * block_size]
+    data = {
+        'upload_id': upload_id,
+        'seq': str(seq),
+        'size': str(len(chunk)),
+        'checksum': str(zlib.adler32(chunk))
+    }
 
+    for attempt in range(MAX_PART_RETRIES + 1):
         try:
-            result = response.json()
+            count_request(1)
+            with http_metrics.retry_attempt(attempt > 0):
+                response = feishu_client.post(url, headers=headers, data=data,
+                                              files={'file': (f"part{seq}", chunk, "application/octet-stream")},
+                                              timeout=UPLOAD_TIMEOUT)
+            parse_media_response(response, f"上传分片 {seq}")
+            return
         except Exception as e:
-            raise Exception(f"解析响应失败: {e}\n响应内容: {response.text[:500]}")
+            if attempt == MAX_PART_RETRIES or not feishu_client.is_transient_error(e):
+                raise
+            delay = 2 ** attempt
+            print(f"  [WARN] 分片 {seq} 上传失败，{delay}s 后重试: {str(e)[:80]}")
+            time.sleep(delay)
 
-        if result.get("code") != 0:
-            raise Exception(f"上传图片失败: {result}")
 
-        file_token = result["data"]["file_token"]
-        print(f"  [OK] 图片上传成功: {file_token}")
-        return file_token
+def upload_media_multipart(token, config, image_block_id, image_path, count_request):
+    """
+    分片上传素材，返回 file_token
+
+    1. upload_prepare：得到 upload_id、分片大小和分片数
+    2. upload_part：按 mmap 切片读取各分片，线程池并发上传，每个分片单独重试
+    3. upload_finish：所有分片完成后合并，得到 file_token
+
+    文件通过内存映射按需读取，任何时候内存中只有正在上传的分片。
+    """
+    file_size = Path(image_path).stat().st_size
+    file_name = Path(image_path).name
+    base_url = f"{config['FEISHU_API_DOMAIN']}/open-apis/drive/v1/medias"
+    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json; charset=utf-8"}
+
+    count_request(1)
+    response = feishu_client.post(f"{base_url}/upload_prepare", headers=headers, json={
+        "file_name": file_name,
+        "parent_type": "docx_image",
+        "parent_node": image_block_id,
+        "size": file_size
+    })
+    prepare = parse_media_response(response, "分片上传准备")
+    upload_id = prepare["upload_id"]
+    block_size = prepare["block_size"]
+    block_num = prepare["block_num"]
+    print(f"  [INFO] 分片上传: {file_size / 1024 / 1024:.1f} MB, {block_num} 个分片")
+
+    with open(image_path, 'rb') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped, \
+            ThreadPoolExecutor(max_workers=MULTIPART_WORKERS) as executor:
+        futures = [
+            executor.submit(contextvars.copy_context().run, upload_media_part,
+                            token, config, upload_id, seq, mapped, block_size, count_request)
+            for seq in range(block_num)
+        ]
+        for future in futures:
+            future.result()
+
+    count_request(1)
+    response = feishu_client.post(f"{base_url}/upload_finish", headers=headers, json={
+        "upload_id": upload_id,
+        "block_num": block_num
+    })
+    return parse_media_response(response, "分片上传完成")["file_token"]
 
 
-def update_image_block_token(token, config, document_id, image_block_id, file_token):
+def replace_image_payload(file_token, block=None):
+    """replace_image 操作的内容：素材 token，图片预处理写入了宽高时一并设置"""
+    payload = {"token": file_token}
+    image = (block or {}).get("image", {})
+    if image.get("width") and image.get("height"):
+        payload["width"] = image["width"]
+        payload["height"] = image["height"]
+    return payload
+
+
+def update_image_block_token(token, config, document_id, image_block_id, file_token, block=None):
     """
     设置图片 Block 的素材 token
 
@@ -286,12 +556,10 @@ def update_image_block_token(token, config, document_id, image_block_id, file_to
     headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
 
     payload = {
-        "replace_image": {
-            "token": file_token
-        }
+        "replace_image": replace_image_payload(file_token, block)
     }
 
-    response = requests.patch(url, json=payload, headers=headers)
+    response = feishu_client.patch(url, json=payload, headers=headers)
     result = response.json()
 
     if result.get("code") != 0:
@@ -301,154 +569,866 @@ def update_image_block_token(token, config, document_id, image_block_id, file_to
     return result
 
 
-def main():
+# 批量更新块接口单次最多 200 个更新
+MAX_UPDATE_REQUESTS = 200
+
+# 默认图片上传并发数，可通过环境变量 FEISHU_IMAGE_UPLOAD_WORKERS 修改
+DEFAULT_IMAGE_UPLOAD_WORKERS = 4
+
+# 插入块的过程中，已上传完成的图片累积到该数量时先批量设置一次 token
+IMAGE_TOKEN_BATCH_SIZE = 20
+
+
+def batch_update_blocks(token, config, document_id, requests):
+    """批量更新块（每个元素为 {"block_id", "update_text_elements" | "replace_image" ...}）"""
+    url = f"{config['FEISHU_API_DOMAIN']}/open-apis/docx/v1/documents/{document_id}/blocks/batch_update?document_revision_id=-1"
+    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json; charset=utf-8"}
+
+    response = feishu_client.patch(url, json={"requests": requests}, headers=headers)
+    result = response.json()
+
+    if result.get("code") != 0:
+        raise Exception(f"批量更新块失败: {result}")
+
+    return result.get("data", {})
+
+
+def image_placeholder():
+    """空图片块，创建后再上传素材并设置 token"""
+    return {"block_type": 27, "image": {}}
+
+
+def upload_image_source(token, config, image_block_id, block, label, count_request=None):
+    """
+    上传图片块对应的本地图片文件，返回 file_token
+
+    没有本地文件（网络图片 URL 或文件不存在）时不上传，返回 None
     """
-    主函数 - 修复版本
+    image_path = block.get("local_path")
+    if image_path and Path(image_path).exists():
+        print(f"  {label} Uploading image file: {image_path}")
+        return upload_image_file(token, config, image_block_id, image_path, count_request)
+
+    image_url = block.get("image", {}).get("token", "")
+    if image_url:
+        print(f"  {label} [SKIP] Network image URL: {image_url} (not uploaded)")
+    else:
+        print(f"  {label} [WARN] No valid image source found")
+    return None
+
 
-    修复问题：块的顺序问题
-    原因：表格单独创建（使用专门API），其他块批量添加，导致顺序混乱
+def get_image_upload_workers():
+    """图片上传并发数"""
+    return max(int(os.environ.get("FEISHU_IMAGE_UPLOAD_WORKERS", DEFAULT_IMAGE_UPLOAD_WORKERS)), 1)
 
-    解决方案：改为顺序添加，每个块（包括表格）都按顺序添加到文档末尾
+
+class ImageUploadPipeline:
     """
-    if len(sys.argv) < 3:
-        print("Usage: python block_adder.py <blocks.json> <doc_info.json> [output_dir]")
-        sys.exit(1)
+    图片上传流水线
 
-    blocks_file = Path(sys.argv[1])
-    doc_info_file = Path(sys.argv[2])
+    图片占位块随其他块按文档顺序插入，拿到真实 block_id 后立即把上传任务提交到
+    有界线程池，主流程继续插入后面的块，不再等待每个图片上传完成。
+    上传完成的素材 token 累积起来，用批量更新块接口（replace_image）一次设置多个图片块，
+    批量更新失败时逐个设置。总耗时接近最慢的一次上传，而不是所有上传耗时之和。
 
-    if len(sys.argv) >= 4:
-        output_dir = Path(sys.argv[3])
-    else:
-        output_dir = Path("output")
+    上传前按图片内容（sha256）查找素材缓存（image_cache），同一文档中已上传过的图片直接复用 token；
+    本次运行中内容相同的图片只上传一次。复用的 token 设置失败时从缓存删除并重新上传。
+    on_image_set(block_id, file_token) 在图片块的素材设置成功后调用（用于记录进度）。
+    """
 
-    output_dir.mkdir(parents=True, exist_ok=True)
+    def __init__(self, token, config, document_id, workers=None, cache=None, on_image_set=None):
+        self.token = token
+        self.config = config
+        self.document_id = document_id
+        self.cache = cache or image_cache.ImageCache(config, document_id)
+        self.executor = ThreadPoolExecutor(max_workers=workers or get_image_upload_workers())
+        self.futures = []
+        self.lock = threading.Lock()
+        self.inflight = {}
+        self.ready = []
+        self.request_count = 0
+        self.uploaded = 0
+        self.failed = 0
+        self.on_image_set = on_image_set
+
+    def submit(self, image_block_id, block, label, retry=False):
+        """提交一个图片块的上传任务（上传在线程池中进行，子技能输出仍归属当前上下文）"""
+        future = self.executor.submit(contextvars.copy_context().run,
+                                      self._upload, image_block_id, block, label, retry)
+        self.futures.append(future)
+
+    def _upload(self, image_block_id, block, label, retry):
+        image_path = block.get("local_path")
+        if not image_path or not Path(image_path).exists():
+            # 网络图片或文件不存在：只打印提示
+            upload_image_source(self.token, self.config, image_block_id, block, label)
+            return
 
-    # 加载块数据
-    print(f"[feishu-block-adder] Loading blocks from: {blocks_file}")
-    with open(blocks_file, 'r', encoding='utf-8') as f:
-        blocks_data = json.load(f)
-    blocks = blocks_data["blocks"]
-    metadata = blocks_data.get("metadata", {})
+        try:
+            sha256 = docx_blocks.hash_file(image_path)
+            file_token = self._resolve(sha256, image_block_id, block, label)
+        except Exception as e:
+            print(f"  {label} FAIL: {str(e)[:80]}")
+            with self.lock:
+                self.failed += 1
+            return
+        with self.lock:
+            self.ready.append({
+                "block_id": image_block_id, "file_token": file_token, "block": block,
+                "label": label, "sha256": sha256, "retry": retry
+            })
 
-    # 加载文档信息
-    print(f"[feishu-block-adder] Loading doc info from: {doc_info_file}")
-    with open(doc_info_file, 'r', encoding='utf-8') as f:
-        doc_info = json.load(f)
-    doc_id = doc_info["document_id"]
+    def _resolve(self, sha256, image_block_id, block, label):
+        """
+        取得图片内容对应的 file_token
+
+        依次尝试：本次运行中正在或已经上传的相同内容 → 素材缓存 → 上传
+        """
+        with self.lock:
+            pending = self.inflight.get(sha256)
+            file_token = None if pending else self.cache.lookup(sha256)
+            owner = pending is None and file_token is None
+            if owner:
+                pending = self.inflight[sha256] = Future()
+
+        if file_token:
+            self.cache.count("hits")
+            print(f"  {label} [CACHE] Reusing uploaded image: {file_token}")
+            return file_token
+        if not owner:
+            file_token = pending.result()
+            self.cache.count("deduplicated")
+            print(f"  {label} [CACHE] Same image already uploaded in this run: {file_token}")
+            return file_token
 
-    # 加载配置
-    config = load_config()
-    token = get_access_token(config, use_user_token=False)
+        try:
+            self.cache.count("misses")
+            file_token = upload_image_source(self.token, self.config, image_block_id, block, label,
+                                             self._count_requests)
+        except Exception as e:
+            with self.lock:
+                del self.inflight[sha256]
+            pending.set_exception(e)
+            raise
+        self.cache.add(sha256, file_token, Path(block["local_path"]).stat().st_size)
+        pending.set_result(file_token)
+        return file_token
 
-    print(f"[feishu-block-adder] Document ID: {doc_id}")
-    print(f"[feishu-block-adder] Total blocks: {len(blocks)}")
-    print(f"[feishu-block-adder] Mode: Sequential (逐块添加，保持顺序)")
+    def _forget(self, sha256, file_token):
+        """token 设置失败：从缓存和本次运行的上传记录中删除，之后的图片重新上传"""
+        self.cache.invalidate(sha256, file_token)
+        with self.lock:
+            pending = self.inflight.get(sha256)
+            if pending and pending.done() and pending.exception() is None and pending.result() == file_token:
+                del self.inflight[sha256]
+
+    def _count_requests(self, count):
+        with self.lock:
+            self.request_count += count
+
+    def apply_ready(self, min_count=1):
+        """把已上传完成的素材 token 设置到图片块，不足 min_count 个时暂不提交"""
+        with self.lock:
+            if not self.ready or len(self.ready) < min_count:
+                return
+            ready, self.ready = self.ready, []
+
+        for offset in range(0, len(ready), MAX_UPDATE_REQUESTS):
+            chunk = ready[offset:offset + MAX_UPDATE_REQUESTS]
+            requests = [{"block_id": item["block_id"],
+                         "replace_image": replace_image_payload(item["file_token"], item["block"])}
+                        for item in chunk]
+            self._count_requests(1)
+            try:
+                batch_update_blocks(self.token, self.config, self.document_id, requests)
+                done = chunk
+                print(f"  [OK] Image tokens set: {len(chunk)}")
+            except Exception as e:
+                print(f"  [WARN] Batch image token update failed, setting one by one: {str(e)[:80]}")
+                done = []
+                for item in chunk:
+                    self._count_requests(1)
+                    try:
+                        update_image_block_token(self.token, self.config, self.document_id,
+                                                 item["block_id"], item["file_token"], item["block"])
+                        done.append(item)
+                    except Exception as e:
+                        self._forget(item["sha256"], item["file_token"])
+                        if not item["retry"]:
+                            # 缓存的 token 可能已失效：重新上传一次
+                            print(f"  {item['label']} [WARN] Image token rejected, uploading again")
+                            self.submit(item["block_id"], item["block"], item["label"], retry=True)
+                            continue
+                        print(f"  [FAIL] Image {item['block_id']}: {str(e)[:80]}")
+                        with self.lock:
+                            self.failed += 1
+
+            with self.lock:
+                self.uploaded += len(done)
+            if self.on_image_set:
+                for item in done:
+                    self.on_image_set(item["block_id"], item["file_token"])
+
+    def drain(self):
+        """等待已提交的上传全部完成，边完成边批量设置 token"""
+        while True:
+            pending = [future for future in self.futures if not future.done()]
+            if pending:
+                wait(pending, timeout=1)
+                self.apply_ready(IMAGE_TOKEN_BATCH_SIZE)
+                continue
+            self.apply_ready()
+            # 复用的 token 失效时会重新提交上传，需要再等一轮
+            with self.lock:
+                idle = not self.ready
+            if idle and all(future.done() for future in self.futures):
+                break
+        self.futures = []
+
+    def finish(self):
+        """等待所有上传完成并设置剩余的 token，保存素材缓存，然后关闭线程池"""
+        self.drain()
+        self.executor.shutdown(wait=True)
+        self.cache.save()
+
+    def record(self, stats):
+        """把上传统计累加到块添加的统计数据中"""
+        stats["request_count"] += self.request_count
+        stats["images_uploaded"] += self.uploaded
+        stats["images_failed"] += self.failed
+        for name, count in self.cache.stats.items():
+            stats["image_cache"][name] += count
+
+
+# 可以合并到同一个 /children 请求中的块类型
+# 图片以空占位块参与批次，素材由上传流水线设置；表格（需要 /descendant 接口）会打断批次，以保持文档顺序
+BATCHABLE_BLOCK_TYPES = {
+    2, 3, 4, 5, 6, 7, 8, 9, 10, 11,  # text, heading1-9
+    12, 13, 17,                      # bullet, ordered, todo
+    14, 15, 19, 22,                  # code, quote, callout, divider
+    27,                              # image（占位块）
+    34, 35                           # quote_container, task
+}
+
+# 飞书 /children 接口单次最多创建 50 个子块
+MAX_CHILDREN_PER_REQUEST = 50
+
+BLOCK_TYPE_NAMES = {
+    2: "文本", 3: "H1", 4: "H2", 5: "H3", 6: "H4",
+    12: "列表", 13: "有序列表", 14: "代码", 15: "引用",
+    17: "待办", 19: "高亮", 22: "分割线", 27: "图片"
+}
+
+
+def is_image_block(block):
+    """判断是否为图片块"""
+    return block.get("type") == "image" or block.get("block_type") == 27
+
+
+def is_batchable_block(block):
+    """判断块是否可以与相邻的块合并为一次请求（图片以占位块参与）"""
+    return block.get("type") != "table" and (is_image_block(block) or block.get("block_type") in BATCHABLE_BLOCK_TYPES)
+
+
+def is_supported_block(block):
+    """判断块能否添加（表格，或普通块、图片）"""
+    return block.get("type") == "table" or is_batchable_block(block)
+
+
+def group_blocks(blocks, batch_size=MAX_CHILDREN_PER_REQUEST):
+    """
+    将块列表切分为按顺序执行的分组
 
-    # 统计变量
-    table_count = 0
-    callout_count = 0
-    regular_blocks = 0
-    start_time = time.time()
+    - 连续的普通块和图片占位块合并为一组，每组最多 batch_size 个
+    - 表格以及不支持的块各自单独成组，打断批次以保持文档顺序
 
-    # ========== 修复：改为顺序添加，保持块的原始顺序 ==========
-    # 每个块都按顺序添加到文档末尾，使用 index=-1
+    返回：[[(index, block), ...], ...]
+    """
+    groups = []
+    current = []
     for i, block in enumerate(blocks):
+        if is_batchable_block(block):
+            current.append((i, block))
+            if len(current) >= batch_size:
+                groups.append(current)
+                current = []
+        else:
+            if current:
+                groups.append(current)
+                current = []
+            groups.append([(i, block)])
+    if current:
+        groups.append(current)
+    return groups
+
+
+def strip_block(block):
+    """
+    去掉解析器附加的内部字段，得到可直接提交给 API 的块
+
+    待办块的完成状态在 blocks.json 中位于顶层 "done"，API 要求放在 todo.style.done
+    """
+    payload = {k: v for k, v in block.items() if k not in ("type", "done")}
+    if block.get("block_type") == 17 and "done" in block:
+        todo = payload.get("todo", {})
+        payload["todo"] = {**todo, "style": {**todo.get("style", {}), "done": bool(block["done"])}}
+    return payload
+
+
+# /descendant 接口单次请求的上限：块数量和请求体大小
+MAX_DESCENDANTS_PER_REQUEST = 1000
+MAX_DESCENDANT_PAYLOAD_BYTES = 1024 * 1024
+
+# 插入请求遇到临时错误（超时、5xx、限流）时的原地重试次数，以及指数退避的基准等待时间（秒）
+MAX_INSERT_RETRIES = 3
+RETRY_BASE_DELAY = 0.5
+
+
+def new_stats():
+    """创建添加块的统计数据"""
+    return {
+        "tables_created": 0,
+        "callouts_created": 0,
+        "regular_blocks": 0,
+        "images_uploaded": 0,
+        "images_failed": 0,
+        "image_cache": {"hits": 0, "deduplicated": 0, "misses": 0},
+        "resumed_blocks": 0,
+        "retries": 0,
+        "reinserted_blocks": 0,
+        "failed_blocks": [],
+        "request_count": 0
+    }
+
+
+def call_with_retries(request, label, stats):
+    """
+    发送插入请求，临时错误按带抖动的指数退避原地重试
+
+    重试使用同一个 client_token，请求实际已成功时不会重复创建块。
+    重试发出的请求在 http_metrics 中记为 retries。
+    非临时错误或重试次数用完时抛出最后一次的异常
+    """
+    attempt = 0
+    while True:
+        stats["request_count"] += 1
         try:
-            if block.get("type") == "table":
-                # 表格块：使用专门的创建函数
-                print(f"  [{i+1}/{len(blocks)}] Creating table with {len(block['data'])} rows...")
-                create_table_with_style(token, config, doc_id, block["data"])
-                table_count += 1
-                print(f"  [OK] Table created")
-            elif block.get("type") == "image" or block.get("block_type") == 27:
-                # 图片块：需要三步流程
-                # 第一步：创建空的图片块
-                print(f"  [{i+1}/{len(blocks)}] Creating image block...")
-                image_block_response = add_children_to_block(token, config, doc_id, doc_id, [{
-                    "block_type": 27,
-                    "image": {}
-                }])
-                image_block_id = image_block_response["data"]["children"][0]["block_id"]
-                print(f"  [OK] Image block created: {image_block_id}")
-
-                # 第二步：上传图片文件（如果有本地路径）
-                image_path = block.get("local_path")
-                if image_path and Path(image_path).exists():
-                    print(f"  [{i+1}/{len(blocks)}] Uploading image file: {image_path}")
-                    file_token = upload_image_file(token, config, image_block_id, image_path)
-
-                    # 第三步：设置图片 token
-                    print(f"  [{i+1}/{len(blocks)}] Setting image token...")
-                    update_image_block_token(token, config, doc_id, image_block_id, file_token)
-                    print(f"  [OK] Image upload completed")
+            with http_metrics.retry_attempt(attempt > 0):
+                return request()
+        except Exception as e:
+            if attempt >= MAX_INSERT_RETRIES or not feishu_client.is_transient_error(e):
+                raise
+            attempt += 1
+            stats["retries"] += 1
+            delay = RETRY_BASE_DELAY * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+            print(f"  {label} [WARN] 临时错误，{delay:.1f}s 后重试 ({attempt}/{MAX_INSERT_RETRIES}): {str(e)[:60]}")
+            time.sleep(delay)
+
+
+def start_pipeline(token, config, doc_id, blocks, journal, workers=None):
+    """
+    创建图片上传流水线，素材设置成功后写入进度日志
+
+    续传时把上次已插入但还没有设置素材的图片块重新提交上传
+    """
+    pipeline = ImageUploadPipeline(token, config, doc_id, workers=workers, on_image_set=journal.record_image)
+    for index, block_id in journal.pending_images(blocks, is_image_block):
+        pipeline.submit(block_id, blocks[index], f"[{index+1}/{len(blocks)}] [RESUME]")
+    return pipeline
+
+
+def skip_confirmed(journal, indices, stats):
+    """
+    续传时跳过最后一个确认的块之前的分组
+
+    已确认的块计入 resumed_blocks。返回 "skip"（已确认）、"defer"（上次运行中失败，
+    交给最后的补插）或 None（需要插入）
+    """
+    if indices[-1] >= journal.resume_point():
+        return None
+    if journal.is_confirmed(indices):
+        stats["resumed_blocks"] += len(indices)
+        return "skip"
+    return "defer"
+
+
+def unit_label(unit, total):
+    """分组的进度标签：[序号/总数] 或 [起始-结束/总数]"""
+    if len(unit) == 1:
+        return f"[{unit[0][0]+1}/{total}]"
+    return f"[{unit[0][0]+1}-{unit[-1][0]+1}/{total}]"
+
+
+def insert_group(token, config, doc_id, group, journal, pipeline, stats, total, index=-1):
+    """
+    插入一组块（表格单独一组）到文档一级块的 index 位置，成功后写入进度日志
+
+    返回新块的 block_id 列表（按组内顺序），失败时抛出异常
+    """
+    first_block = group[0][1]
+    label = unit_label(group, total)
+    indices = [i for i, _ in group]
+    client_token = journal.client_token(indices)
+
+    if first_block.get("type") == "table":
+        # 表格块：使用专门的创建函数
+        print(f"  {label} Creating table with {len(first_block['data'])} rows...")
+        table_id = call_with_retries(
+            lambda: create_table_with_style(token, config, doc_id, first_block["data"],
+                                            first_block.get("cell_elements"), client_token, index=index),
+            label, stats)
+        journal.record_insert(indices, [table_id])
+        stats["tables_created"] += 1
+        print(f"  [OK] Table created")
+        return [table_id]
+
+    # 普通块和图片占位块：整组一次请求
+    children = [image_placeholder() if is_image_block(block) else strip_block(block)
+                for _, block in group]
+    response = call_with_retries(
+        lambda: add_children_to_block(token, config, doc_id, doc_id, children, client_token, index=index),
+        label, stats)
+    stats["callouts_created"] += sum(1 for child in children if child.get("block_type") == 19)
+    stats["regular_blocks"] += len(children)
+
+    created = response.get("data", {}).get("children", [])
+    block_ids = ([child.get("block_id") for child in created] + [None] * len(indices))[:len(indices)]
+    journal.record_insert(indices, block_ids)
+    for (i, block), child in zip(group, created):
+        if is_image_block(block):
+            pipeline.submit(child["block_id"], block, f"[{i+1}/{total}]")
+
+    if len(children) == 1:
+        block_type = children[0].get("block_type", "unknown")
+        type_name = BLOCK_TYPE_NAMES.get(block_type, f"类型{block_type}")
+        print(f"  {label} Added {type_name}")
+    else:
+        print(f"  {label} Added {len(children)} blocks")
+    return block_ids
+
+
+def reinsert_deferred(token, config, doc_id, deferred, journal, insert, stats, total):
+    """
+    补插失败的分组：插入到文档中下一个已确认的块之前，保持与 blocks.json 相同的顺序
+
+    deferred 为失败的分组 [[(下标, ...), ...], ...]，insert(分组, index) 插入一组并返回新块的 block_id。
+    从文档末尾向前处理；多个块的分组因非临时错误失败时拆成单个块重试，只放弃出错的块。
+    最终仍失败的块记入 stats["failed_blocks"]
+    """
+    print(f"\n[feishu-block-adder] Final pass: re-inserting {sum(len(unit) for unit in deferred)} blocks "
+          f"from {len(deferred)} failed requests")
+    try:
+        root = call_with_retries(lambda: docx_blocks.get_block(token, config, doc_id, doc_id), "[root]", stats)
+        children = list(root.get("children", []))
+    except Exception as e:
+        print(f"  [FAIL] 无法读取文档结构，放弃补插: {str(e)[:80]}")
+        for unit in deferred:
+            record_failures(unit, e, stats)
+        return
+
+    def position_of(last_index):
+        # 下一个已确认并且仍在文档中的块的位置；没有时追加到末尾
+        for index in sorted(i for i in journal.confirmed if i > last_index):
+            block_id = journal.confirmed[index]
+            if block_id in children:
+                return children.index(block_id)
+        return -1
+
+    def process(unit):
+        confirmed = [item for item in unit if item[0] in journal.confirmed]
+        if confirmed:
+            # 续传时组内部分块已在上次的补插中确认，只补插其余连续的块
+            stats["resumed_blocks"] += len(confirmed)
+            runs = []
+            for item in unit:
+                if item[0] in journal.confirmed:
+                    continue
+                if runs and runs[-1][-1][0] == item[0] - 1:
+                    runs[-1].append(item)
                 else:
-                    # 没有本地文件，可能是网络图片 URL，直接设置
-                    image_url = image_data.get("url", "")
-                    if image_url:
-                        print(f"  [SKIP] Network image URL: {image_url} (not uploaded)")
-                    else:
-                        print(f"  [WARN] No valid image source found")
-
-                regular_blocks += 1
-                print(f"  [{i+1}/{len(blocks)}] Added image")
-            else:
-                # 其他块：添加到文档末尾
-                block_copy = {k: v for k, v in block.items() if k != "type"}
-
-                # 支持的块类型：25 种飞书文档块
-                if block_copy.get("block_type") in [
-                    2, 3, 4, 5, 6, 7, 8, 9, 10, 11,  # text, heading1-9
-                    12, 13, 17,                             # bullet, ordered, todo
-                    14, 15, 19, 22,                         # code, quote, callout, divider
-                    27,                                     # image (created above, don't create again)
-                    34, 35                                  # quote_container, task
-                ]:
-                    add_children_to_block(token, config, doc_id, doc_id, [block_copy])
-                    if block_copy.get("block_type") == 19:
-                        callout_count += 1
-                    regular_blocks += 1
-
-                    block_type = block_copy.get("block_type", "unknown")
-                    type_name = {
-                        2: "文本", 3: "H1", 4: "H2", 5: "H3", 6: "H4",
-                        12: "列表", 13: "有序列表", 14: "代码", 15: "引用",
-                        17: "待办", 19: "高亮", 22: "分割线", 27: "图片"
-                    }.get(block_type, f"类型{block_type}")
-                    print(f"  [{i+1}/{len(blocks)}] Added {type_name}")
+                    runs.append([item])
+            for run in reversed(runs):
+                process(run)
+            return
 
+        label = unit_label(unit, total)
+        position = position_of(unit[-1][0])
+        try:
+            block_ids = insert(unit, position)
         except Exception as e:
-            print(f"  [{i+1}/{len(blocks)}] FAIL: {str(e)[:80]}")
+            if len(unit) > 1 and not feishu_client.is_transient_error(e):
+                # 对半拆分后重试，只放弃出错的块；后半部分先插入，前半部分的位置才能确定
+                print(f"  {label} [WARN] 整组失败，拆分后重试")
+                middle = len(unit) // 2
+                process(unit[middle:])
+                process(unit[:middle])
+                return
+            print(f"  {label} [FAIL] {str(e)[:80]}")
+            record_failures(unit, e, stats)
+            return
+        stats["reinserted_blocks"] += len(unit)
+        new_ids = [block_id for block_id in block_ids if block_id]
+        if position == -1:
+            children.extend(new_ids)
+        else:
+            children[position:position] = new_ids
+
+    for unit in sorted(deferred, key=lambda unit: unit[0][0], reverse=True):
+        process(unit)
+    stats["failed_blocks"].sort(key=lambda failure: failure["index"])
+
+
+def record_failures(unit, error, stats):
+    """记录最终插入失败的块"""
+    for item in unit:
+        block = item[1]
+        stats["failed_blocks"].append({
+            "index": item[0],
+            "block_type": "table" if block.get("type") == "table" else block.get("block_type"),
+            "error": str(error)[:500]
+        })
+
+
+def add_blocks_grouped(token, config, doc_id, blocks, journal, sequential=False):
+    """
+    批量/逐块模式添加块
+
+    连续的普通块和图片占位块合并为一次 /children 请求，表格单独处理并打断批次；
+    sequential=True 时每个块一次请求、图片逐个上传。所有分组都追加到文档末尾（index=-1）。
+    图片占位块创建后交给上传流水线，素材上传与后续块的插入同时进行。
+    每组插入成功后写入进度日志；续传时跳过已确认的分组。
+    临时错误原地重试；仍然失败的分组在最后补插到正确位置。
+    """
+    stats = new_stats()
+    groups = group_blocks(blocks, batch_size=1 if sequential else MAX_CHILDREN_PER_REQUEST)
+    total = len(blocks)
+    pipeline = start_pipeline(token, config, doc_id, blocks, journal, workers=1 if sequential else None)
+    deferred = []
+
+    if sequential:
+        print(f"[feishu-block-adder] Mode: Sequential (逐块添加，保持顺序)")
+    else:
+        print(f"[feishu-block-adder] Mode: Batched (连续普通块合并请求，{len(groups)} 组)")
+
+    def insert(group, index=-1):
+        return insert_group(token, config, doc_id, group, journal, pipeline, stats, total, index)
+
+    try:
+        for group in groups:
+            if not is_supported_block(group[0][1]):
+                first_index, first_block = group[0]
+                print(f"  [{first_index+1}/{total}] [SKIP] Unsupported block type: {first_block.get('block_type')}")
+                continue
+            state = skip_confirmed(journal, [i for i, _ in group], stats)
+            if state == "skip":
+                continue
+            if state == "defer":
+                deferred.append(group)
+                continue
+
+            try:
+                insert(group)
+            except Exception as e:
+                print(f"  {unit_label(group, total)} FAIL: {str(e)[:80]}，稍后补插")
+                deferred.append(group)
+
+            if sequential:
+                pipeline.drain()
+            else:
+                pipeline.apply_ready(IMAGE_TOKEN_BATCH_SIZE)
+
+        if deferred:
+            reinsert_deferred(token, config, doc_id, deferred, journal, insert, stats, total)
+    finally:
+        pipeline.finish()
+        pipeline.record(stats)
+
+    return stats
 
-        # 控制请求速率，避免触发限流
-        time.sleep(0.05)
 
+def pack_descendant_trees(trees, max_blocks=MAX_DESCENDANTS_PER_REQUEST,
+                          max_bytes=MAX_DESCENDANT_PAYLOAD_BYTES):
+    """
+    按块数量和请求体大小预算，把按文档顺序排列的子树装入尽量少的请求
+
+    trees: [(index, block, root_id, descendants), ...]
+    超过预算的单棵子树独占一个请求。
+    返回：[[tree, ...], ...]
+    """
+    packs = []
+    current = []
+    current_blocks = 0
+    current_bytes = 0
+    for tree in trees:
+        tree_blocks = len(tree[3])
+        tree_bytes = payload_size(tree[3])
+        if current and (current_blocks + tree_blocks > max_blocks or current_bytes + tree_bytes > max_bytes):
+            packs.append(current)
+            current = []
+            current_blocks = 0
+            current_bytes = 0
+        current.append(tree)
+        current_blocks += tree_blocks
+        current_bytes += tree_bytes
+    if current:
+        packs.append(current)
+    return packs
+
+
+def insert_pack(token, config, doc_id, pack, journal, pipeline, stats, total, index=-1):
+    """
+    用一次 /descendant 请求把一组子树插入到文档一级块的 index 位置，成功后写入进度日志
+
+    pack: [(index, block, root_id, descendants), ...]
+    返回一级块的 block_id 列表（按组内顺序），失败时抛出异常
+    """
+    label = unit_label(pack, total)
+    indices = [i for i, _, _, _ in pack]
+    children_id = [root_id for _, _, root_id, _ in pack]
+    descendants = [node for _, _, _, nodes in pack for node in nodes]
+    client_token = journal.client_token(indices)
+
+    data = call_with_retries(
+        lambda: create_descendants(token, config, doc_id, children_id, descendants,
+                                   index=index, client_token=client_token),
+        label, stats)
+
+    relations = {
+        relation["temporary_block_id"]: relation["block_id"]
+        for relation in data.get("block_id_relations", [])
+    }
+    block_ids = [relations.get(root_id) for root_id in children_id]
+    journal.record_insert(indices, block_ids)
+
+    for i, block, root_id, _ in pack:
+        if block.get("type") == "table":
+            stats["tables_created"] += 1
+            continue
+        stats["regular_blocks"] += 1
+        if block.get("block_type") == 19:
+            stats["callouts_created"] += 1
+        elif is_image_block(block):
+            image_label = f"[{i+1}/{total}]"
+            image_block_id = relations.get(root_id)
+            if not image_block_id:
+                print(f"  {image_label} [WARN] Image block id not returned, skip upload")
+                continue
+            pipeline.submit(image_block_id, block, image_label)
+
+    print(f"  {label} Added {len(pack)} blocks ({len(descendants)} descendants)")
+    return block_ids
+
+
+def add_blocks_descendant(token, config, doc_id, blocks, journal):
+    """
+    整文档嵌套块模式添加块
+
+    把 blocks.json 中的每个块转换为 descendants 子树（普通块、表格、带子块的高亮块、
+    图片占位块），按大小预算装入尽量少的 /descendant 请求，请求数从 O(块数)
+    降为 O(请求体大小 / 上限)。图片块创建后根据 block_id_relations 找到真实
+    block_id，交给上传流水线上传素材并设置 token。每个请求成功后写入进度日志。
+    临时错误原地重试；仍然失败的请求在最后补插到正确位置。
+    """
+    stats = new_stats()
+    total = len(blocks)
+
+    trees = []
+    for i, block in enumerate(blocks):
+        tree = build_block_tree(block)
+        if tree is None:
+            print(f"  [{i+1}/{total}] [SKIP] Unsupported block type: {block.get('block_type', block.get('type'))}")
+            continue
+        trees.append((i, block, tree[0], tree[1]))
+
+    packs = pack_descendant_trees(trees)
+    print(f"[feishu-block-adder] Mode: Descendant (整文档嵌套块，{len(packs)} 个请求)")
+
+    pipeline = start_pipeline(token, config, doc_id, blocks, journal)
+    deferred = []
+
+    def insert(pack, index=-1):
+        return insert_pack(token, config, doc_id, pack, journal, pipeline, stats, total, index)
+
+    try:
+        for pack in packs:
+            state = skip_confirmed(journal, [i for i, _, _, _ in pack], stats)
+            if state == "skip":
+                continue
+            if state == "defer":
+                deferred.append(pack)
+                continue
+
+            try:
+                insert(pack)
+            except Exception as e:
+                print(f"  {unit_label(pack, total)} FAIL: {str(e)[:80]}，稍后补插")
+                deferred.append(pack)
+                continue
+            pipeline.apply_ready(IMAGE_TOKEN_BATCH_SIZE)
+
+        if deferred:
+            reinsert_deferred(token, config, doc_id, deferred, journal, insert, stats, total)
+    finally:
+        pipeline.finish()
+        pipeline.record(stats)
+
+    return stats
+
+
+def add_blocks(blocks, doc_id, config=None, mode="batched", journal_path=None, resume=False):
+    """
+    将块列表添加到文档，供编排器在进程内直接调用
+
+    mode: batched（默认）/ sequential / descendant
+    journal_path: 进度日志 progress.jsonl 的路径，为 None 时不写日志；
+    resume=True 时从日志中最后一个确认的块之后继续
+    返回 add_result.json 的内容
+    """
+    if config is None:
+        config = load_config()
+    token = get_access_token(config, use_user_token=False)
+
+    print(f"[feishu-block-adder] Document ID: {doc_id}")
+    print(f"[feishu-block-adder] Total blocks: {len(blocks)}")
+
+    journal = progress_journal.ProgressJournal(journal_path, doc_id, blocks, mode, resume=resume)
+    if journal.resumed:
+        print(f"[feishu-block-adder] Resuming: {len(journal.confirmed)} blocks confirmed, "
+              f"continuing from block {journal.resume_point() + 1}")
+
+    start_time = time.time()
+    with http_metrics.collect() as metrics:
+        try:
+            if mode == "descendant":
+                stats = add_blocks_descendant(token, config, doc_id, blocks, journal)
+            else:
+                stats = add_blocks_grouped(token, config, doc_id, blocks, journal, sequential=(mode == "sequential"))
+            journal.finish()
+        finally:
+            journal.close()
     duration = time.time() - start_time
 
-    # 保存结果
     result = {
-        "success": True,
+        "success": not stats["failed_blocks"],
         "document_id": doc_id,
         "total_blocks": len(blocks),
-        "tables_created": table_count,
-        "callouts_created": callout_count,
-        "regular_blocks": regular_blocks,
-        "mode": "sequential",  # 新增：标识使用顺序模式
+        "tables_created": stats["tables_created"],
+        "callouts_created": stats["callouts_created"],
+        "regular_blocks": stats["regular_blocks"],
+        "images_uploaded": stats["images_uploaded"],
+        "images_failed": stats["images_failed"],
+        "image_cache": stats["image_cache"],
+        "resumed": journal.resumed,
+        "resumed_blocks": stats["resumed_blocks"],
+        "retries": stats["retries"],
+        "reinserted_blocks": stats["reinserted_blocks"],
+        "failed_blocks": stats["failed_blocks"],
+        "mode": mode,
         "duration_seconds": round(duration, 2),
+        "request_count": stats["request_count"],
+        "http_connections": feishu_client.connection_stats(),
+        "http_metrics": metrics.snapshot(),
+        "rate_limits": rate_limiter.limiter_stats(),
         "completed_at": datetime.now().isoformat()
     }
 
+    print(f"\n[feishu-block-adder] Completed in {duration:.2f}s ({stats['request_count']} requests)")
+    print(f"[feishu-block-adder] Tables created: {stats['tables_created']}")
+    print(f"[feishu-block-adder] Callouts created: {stats['callouts_created']}")
+    print(f"[feishu-block-adder] Regular blocks: {stats['regular_blocks']}")
+    print(f"[feishu-block-adder] Images uploaded: {stats['images_uploaded']} (failed {stats['images_failed']})")
+    if journal.resumed:
+        print(f"[feishu-block-adder] Resumed: {stats['resumed_blocks']} blocks already added in previous run")
+    if stats["retries"] or stats["reinserted_blocks"]:
+        print(f"[feishu-block-adder] Retries: {stats['retries']}, re-inserted in final pass: {stats['reinserted_blocks']} blocks")
+    if stats["failed_blocks"]:
+        print(f"[feishu-block-adder] [FAIL] {len(stats['failed_blocks'])} blocks could not be added:")
+        for failure in stats["failed_blocks"]:
+            print(f"  block {failure['index'] + 1} ({failure['block_type']}): {failure['error'][:80]}")
+    cache_stats = stats["image_cache"]
+    if any(cache_stats.values()):
+        print(f"[feishu-block-adder] Image cache: {cache_stats['hits']} hits, "
+              f"{cache_stats['deduplicated']} deduplicated, {cache_stats['misses']} uploaded")
+    for name, limit in result["rate_limits"].items():
+        print(f"[feishu-block-adder] Rate limit {name}: {limit['rate']}/s, throttled {limit['throttled']} times")
+    for host, conn in result["http_connections"].items():
+        print(f"[feishu-block-adder] Connections to {host}: {conn['connections']} opened, {conn['reused']} requests reused")
+    http_metrics.print_summary(result["http_metrics"], "[feishu-block-adder]")
+
+    return result
+
+
+def save_add_result(result, output_dir):
+    """保存结果到 add_result.json，返回文件路径"""
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
     result_file = output_dir / "add_result.json"
     with open(result_file, 'w', encoding='utf-8') as f:
         json.dump(result, f, ensure_ascii=False, indent=2)
+    return result_file
 
-    print(f"\n[feishu-block-adder] Completed in {duration:.2f}s")
-    print(f"[feishu-block-adder] Tables created: {table_count}")
-    print(f"[feishu-block-adder] Callouts created: {callout_count}")
-    print(f"[feishu-block-adder] Regular blocks: {regular_blocks}")
+
+def main():
+    """
+    主函数
+
+    块按原始顺序追加到文档末尾，支持三种模式：
+        默认          批量模式：连续的普通块合并为一次 /children 请求，表格和图片打断批次
+        --sequential  逐块模式：每个块一次请求，用于排查问题
+        --descendant  嵌套块模式：整文档转换为 descendants 子树，按大小预算用最少的 /descendant 请求创建
+
+    进度写入 output_dir/progress.jsonl；--resume 时从上次中断处继续（同一文档、同一 blocks.json、同一模式）
+    """
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    if len(args) < 2:
+        print("Usage: python block_adder.py <blocks.json> <doc_info.json> [output_dir] [--sequential | --descendant] [--resume]")
+        sys.exit(1)
+
+    blocks_file = Path(args[0])
+    doc_info_file = Path(args[1])
+
+    if len(args) >= 3:
+        output_dir = Path(args[2])
+    else:
+        output_dir = Path("output")
+
+    if "--descendant" in sys.argv:
+        mode = "descendant"
+    elif "--sequential" in sys.argv:
+        mode = "sequential"
+    else:
+        mode = "batched"
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    # 加载块数据
+    print(f"[feishu-block-adder] Loading blocks from: {blocks_file}")
+    with open(blocks_file, 'r', encoding='utf-8') as f:
+        blocks_data = json.load(f)
+    blocks = blocks_data["blocks"]
+
+    # 加载文档信息
+    print(f"[feishu-block-adder] Loading doc info from: {doc_info_file}")
+    with open(doc_info_file, 'r', encoding='utf-8') as f:
+        doc_info = json.load(f)
+    doc_id = doc_info["document_id"]
+
+    journal_path = output_dir / progress_journal.JOURNAL_FILE_NAME
+    try:
+        result = add_blocks(blocks, doc_id, mode=mode, journal_path=journal_path, resume="--resume" in sys.argv)
+    except Exception as e:
+        print(f"[feishu-block-adder] [FAIL] {e}")
+        print(f"[feishu-block-adder] 进度日志: {journal_path}（修复问题后可使用 --resume 继续）")
+        sys.exit(1)
+
+    # 保存结果
+    result_file = save_add_result(result, output_dir)
     print(f"[feishu-block-adder] Output: {result_file}")
     print(f"\n[OUTPUT] {result_file}")
 
+    if not result["success"]:
+        sys.exit(1)
+
 
 if __name__ == "__main__":
     main()
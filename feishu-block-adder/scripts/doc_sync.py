@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+文档增量同步 - 块添加子技能的同步模式
+把 blocks.json 同步到已有的飞书文档：读取文档当前的一级块，按块指纹计算最小编辑脚本，
+只执行其中的插入、删除和文字更新，而不是新建文档后重新添加所有块
+输出：sync_result.json
+"""
+
+import sys
+import json
+import time
+from pathlib import Path
+from datetime import datetime
+from difflib import SequenceMatcher
+
+# 添加公共模块路径
+COMMON_SCRIPT_DIR = Path(__file__).parent.parent.parent / "feishu-common" / "scripts"
+if str(COMMON_SCRIPT_DIR) not in sys.path:
+    sys.path.insert(0, str(COMMON_SCRIPT_DIR))
+
+import feishu_client
+import rate_limiter
+import docx_blocks
+
+import block_adder
+import image_cache
+
+
+def plan_sync(remote, local):
+    """
+    计算把远端一级块序列变成本地块序列的编辑脚本
+
+    remote / local 为 BlockFingerprint 列表。先用 difflib 按指纹找出未变化的块，
+    对每个变化区域：成对的块能只改文字时原地更新，其余连续的块删除后在原位置重建，
+    区域中多出的远端块删除、多出的本地块插入。
+
+    返回 (edits, patches)：
+        edits   [{"op": "delete", "start", "end"} | {"op": "insert", "index", "local": [本地下标]}]
+                按从文档末尾到开头的顺序排列，依次执行时前面的下标不受影响
+        patches [(远端下标, 本地下标)]，只修改文字，不改变下标，可以一次批量提交
+    """
+    matcher = SequenceMatcher(None, [fp.key for fp in remote], [fp.key for fp in local], autojunk=False)
+    edits = []
+    patches = []
+
+    for tag, i1, i2, j1, j2 in reversed(matcher.get_opcodes()):
+        if tag == "equal":
+            continue
+
+        # 区域内按文档顺序切分为段：原地更新的块，或需要重建的连续范围 [a, b) -> [c, d)
+        paired = min(i2 - i1, j2 - j1)
+        rebuilds = []
+        for k in range(paired):
+            if remote[i1 + k].patchable_to(local[j1 + k]):
+                patches.append((i1 + k, j1 + k))
+            elif rebuilds and rebuilds[-1][1] == i1 + k:
+                rebuilds[-1][1] += 1
+                rebuilds[-1][3] += 1
+            else:
+                rebuilds.append([i1 + k, i1 + k + 1, j1 + k, j1 + k + 1])
+
+        if i2 - i1 > paired or j2 - j1 > paired:
+            if rebuilds and rebuilds[-1][1] == i1 + paired:
+                rebuilds[-1][1] = i2
+                rebuilds[-1][3] = j2
+            else:
+                rebuilds.append([i1 + paired, i2, j1 + paired, j2])
+
+        for a, b, c, d in reversed(rebuilds):
+            if b > a:
+                edits.append({"op": "delete", "start": a, "end": b})
+            if d > c:
+                edits.append({"op": "insert", "index": a, "local": list(range(c, d))})
+
+    return edits, patches
+
+
+def delete_children(token, config, document_id, start_index, end_index):
+    """删除文档一级块中 [start_index, end_index) 范围内的块"""
+    url = f"{config['FEISHU_API_DOMAIN']}/open-apis/docx/v1/documents/{document_id}/blocks/{document_id}/children/batch_delete?document_revision_id=-1"
+    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json; charset=utf-8"}
+
+    response = feishu_client.delete(url, json={"start_index": start_index, "end_index": end_index}, headers=headers)
+    result = response.json()
+
+    if result.get("code") != 0:
+        raise Exception(f"删除块失败: {result}")
+
+    return result.get("data", {})
+
+
+def insert_blocks(token, config, document_id, index, blocks, pipeline, stats):
+    """
+    在文档一级块的 index 位置插入块（/descendant 接口，按大小预算分成尽量少的请求）
+
+    新建的图片块交给上传流水线
+    """
+    trees = []
+    for i, block in enumerate(blocks):
+        tree = block_adder.build_block_tree(block)
+        if tree is not None:
+            trees.append((i, block, tree[0], tree[1]))
+
+    for pack in block_adder.pack_descendant_trees(trees):
+        children_id = [root_id for _, _, root_id, _ in pack]
+        descendants = [node for _, _, _, nodes in pack for node in nodes]
+
+        stats["request_count"] += 1
+        data = block_adder.create_descendants(token, config, document_id, children_id, descendants, index=index)
+        index += len(pack)
+
+        relations = {
+            relation["temporary_block_id"]: relation["block_id"]
+            for relation in data.get("block_id_relations", [])
+        }
+        for _, block, root_id, _ in pack:
+            if not block_adder.is_image_block(block):
+                continue
+            image_block_id = relations.get(root_id)
+            if not image_block_id:
+                print(f"  [WARN] Image block id not returned, skip upload")
+                continue
+            pipeline.submit(image_block_id, block, "[image]")
+
+
+def sync_blocks(blocks, document_id, config=None, dry_run=False):
+    """
+    把块列表同步到已有文档，供编排器或其他脚本在进程内直接调用
+
+    dry_run=True 时只计算并打印编辑脚本，不修改文档
+    返回 sync_result.json 的内容
+    """
+    if config is None:
+        config = block_adder.load_config()
+    token = block_adder.get_access_token(config)
+
+    start_time = time.time()
+    stats = block_adder.new_stats()
+    errors = []
+
+    print(f"[feishu-doc-sync] Document ID: {document_id}")
+
+    # 第一步：读取文档当前的块
+    items = []
+    for page in docx_blocks.iter_block_pages(token, config, document_id):
+        stats["request_count"] += 1
+        items.extend(page)
+    by_id = docx_blocks.index_blocks(items)
+    remote_blocks = docx_blocks.top_level_blocks(document_id, by_id)
+
+    # 第二步：计算两边的块指纹和编辑脚本
+    # 远端图片块只有素材 token，通过图片素材缓存对应回图片内容
+    cache = image_cache.ImageCache(config, document_id)
+    image_sources = cache.sources_by_token()
+    remote = [docx_blocks.remote_fingerprint(block, by_id, image_sources) for block in remote_blocks]
+    local_blocks = [block for block in blocks if block_adder.build_block_tree(block) is not None]
+    local = [docx_blocks.local_fingerprint(block) for block in local_blocks]
+
+    edits, patches = plan_sync(remote, local)
+    deleted = sum(edit["end"] - edit["start"] for edit in edits if edit["op"] == "delete")
+    inserted = sum(len(edit["local"]) for edit in edits if edit["op"] == "insert")
+    unchanged = len(remote) - deleted - len(patches)
+
+    print(f"[feishu-doc-sync] Remote blocks: {len(remote)}, local blocks: {len(local)}")
+    print(f"[feishu-doc-sync] Plan: {unchanged} unchanged, {len(patches)} patched, "
+          f"{deleted} deleted, {inserted} inserted")
+    for edit in edits:
+        if edit["op"] == "delete":
+            print(f"  delete [{edit['start']}, {edit['end']})")
+        else:
+            print(f"  insert {len(edit['local'])} blocks at {edit['index']}")
+    for remote_index, local_index in patches:
+        print(f"  patch text of block {remote_index}")
+
+    # 第三步：从文档末尾到开头执行插入和删除，最后批量更新文字
+    if not dry_run:
+        pipeline = block_adder.ImageUploadPipeline(token, config, document_id, cache=cache)
+        try:
+            for edit in edits:
+                try:
+                    if edit["op"] == "delete":
+                        stats["request_count"] += 1
+                        delete_children(token, config, document_id, edit["start"], edit["end"])
+                    else:
+                        insert_blocks(token, config, document_id, edit["index"],
+                                      [local_blocks[j] for j in edit["local"]], pipeline, stats)
+                except Exception as e:
+                    errors.append(str(e))
+                    print(f"  [FAIL] {edit['op']}: {str(e)[:80]}")
+        finally:
+            pipeline.finish()
+            pipeline.record(stats)
+        if pipeline.failed:
+            errors.append(f"{pipeline.failed} 个图片上传失败")
+
+        update_requests = [{
+            "block_id": remote_blocks[remote_index]["block_id"],
+            "update_text_elements": {"elements": docx_blocks.block_elements(local_blocks[local_index])}
+        } for remote_index, local_index in sorted(patches)]
+        for offset in range(0, len(update_requests), block_adder.MAX_UPDATE_REQUESTS):
+            chunk = update_requests[offset:offset + block_adder.MAX_UPDATE_REQUESTS]
+            try:
+                stats["request_count"] += 1
+                block_adder.batch_update_blocks(token, config, document_id, chunk)
+            except Exception as e:
+                errors.append(str(e))
+                print(f"  [FAIL] batch_update: {str(e)[:80]}")
+
+    duration = time.time() - start_time
+
+    result = {
+        "success": not errors,
+        "document_id": document_id,
+        "dry_run": dry_run,
+        "remote_blocks": len(remote),
+        "local_blocks": len(local),
+        "unchanged": unchanged,
+        "patched": len(patches),
+        "deleted": deleted,
+        "inserted": inserted,
+        "images_uploaded": stats["images_uploaded"],
+        "images_failed": stats["images_failed"],
+        "image_cache": stats["image_cache"],
+        "edits": edits,
+        "errors": errors,
+        "duration_seconds": round(duration, 2),
+        "request_count": stats["request_count"],
+        "http_connections": feishu_client.connection_stats(),
+        "rate_limits": rate_limiter.limiter_stats(),
+        "completed_at": datetime.now().isoformat()
+    }
+
+    print(f"\n[feishu-doc-sync] Completed in {duration:.2f}s ({stats['request_count']} requests)")
+    if errors:
+        print(f"[feishu-doc-sync] [WARN] {len(errors)} operations failed")
+
+    return result
+
+
+def load_document_id(arg):
+    """参数可以是 document_id，也可以是 doc_info.json 文件"""
+    path = Path(arg)
+    if path.suffix == ".json" and path.exists():
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)["document_id"]
+    return arg
+
+
+def main():
+    """
+    主函数
+
+    读取已有文档的块，与 blocks.json 比较后只提交差异：
+        未变化的块       不发请求
+        只有文字变化     批量更新文字（batch_update，每次最多 200 个）
+        其他变化         删除后在原位置插入（/descendant）
+    """
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    if len(args) < 2:
+        print("Usage: python doc_sync.py <blocks.json> <document_id | doc_info.json> [output_dir] [--dry-run]")
+        sys.exit(1)
+
+    blocks_file = Path(args[0])
+    document_id = load_document_id(args[1])
+    output_dir = Path(args[2]) if len(args) >= 3 else Path("output")
+    dry_run = "--dry-run" in sys.argv
+
+    print(f"[feishu-doc-sync] Loading blocks from: {blocks_file}")
+    with open(blocks_file, 'r', encoding='utf-8') as f:
+        blocks = json.load(f)["blocks"]
+
+    result = sync_blocks(blocks, document_id, dry_run=dry_run)
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    result_file = output_dir / "sync_result.json"
+    with open(result_file, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"[feishu-doc-sync] Output: {result_file}")
+    print(f"\n[OUTPUT] {result_file}")
+
+    if not result["success"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
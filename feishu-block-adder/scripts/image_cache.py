@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+图片素材缓存
+按图片内容（sha256）记录已上传素材的 file_token，同一图片再次添加到同一文档时直接复用，不再上传
+
+素材以 parent_type=docx_image 上传到具体文档，token 只在该文档中复用，
+因此缓存按 应用 + 文档 划分作用域。
+缓存文件：.claude/feishu-image-cache.json（可通过环境变量 FEISHU_IMAGE_CACHE_FILE 指定），写入时持有文件锁
+"""
+
+import os
+import sys
+import time
+import threading
+from pathlib import Path
+
+# 添加公共模块路径
+COMMON_SCRIPT_DIR = Path(__file__).parent.parent.parent / "feishu-common" / "scripts"
+if str(COMMON_SCRIPT_DIR) not in sys.path:
+    sys.path.insert(0, str(COMMON_SCRIPT_DIR))
+
+import token_cache
+
+# 超过该时间（秒）没有使用的文档作用域在写入缓存时清理
+SCOPE_TTL_SECONDS = 90 * 24 * 3600
+
+
+def get_cache_path():
+    """缓存文件路径"""
+    env_path = os.environ.get("FEISHU_IMAGE_CACHE_FILE")
+    if env_path:
+        return Path(env_path)
+    return token_cache.get_claude_dir() / "feishu-image-cache.json"
+
+
+def scope_key(config, document_id):
+    """缓存作用域：应用 + 文档"""
+    return f"{config.get('FEISHU_APP_ID', '')}:{document_id}"
+
+
+class ImageCache:
+    """
+    单个文档作用域内的图片素材缓存
+
+    lookup / add / invalidate 线程安全，修改在 save() 时合并写入缓存文件。
+    stats 记录本次运行的 hits（命中缓存）、deduplicated（与本次运行中其他图片块内容相同）
+    和 misses（实际上传）次数。
+    """
+
+    def __init__(self, config, document_id, path=None):
+        self.path = Path(path) if path else get_cache_path()
+        self.scope = scope_key(config, document_id)
+        scope = token_cache.read_json_file(self.path).get(self.scope, {})
+        self.entries = dict(scope.get("images", {}))
+        self.added = {}
+        self.removed = set()
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "deduplicated": 0, "misses": 0}
+
+    def lookup(self, sha256):
+        """返回缓存的 file_token，没有时返回 None"""
+        with self.lock:
+            entry = self.entries.get(sha256)
+            return entry["file_token"] if entry else None
+
+    def add(self, sha256, file_token, size):
+        """记录新上传的素材"""
+        entry = {"file_token": file_token, "size": size, "uploaded_at": int(time.time())}
+        with self.lock:
+            self.entries[sha256] = entry
+            self.added[sha256] = entry
+            self.removed.discard(sha256)
+
+    def invalidate(self, sha256, file_token):
+        """缓存的 token 已不可用（设置图片失败）时删除；已被新上传的 token 替换时不删除"""
+        with self.lock:
+            entry = self.entries.get(sha256)
+            if not entry or entry["file_token"] != file_token:
+                return
+            del self.entries[sha256]
+            self.added.pop(sha256, None)
+            self.removed.add(sha256)
+
+    def count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def sources_by_token(self):
+        """{file_token: 来源标识}，用于把远端图片块对应回本地图片内容"""
+        with self.lock:
+            return {entry["file_token"]: "sha256:" + sha256 for sha256, entry in self.entries.items()}
+
+    def save(self):
+        """把本次的修改合并写入缓存文件，并清理长期未使用的作用域"""
+        with self.lock:
+            added, removed = dict(self.added), set(self.removed)
+            self.added, self.removed = {}, set()
+        if not added and not removed:
+            return
+
+        now = time.time()
+        with token_cache.file_lock(self.path):
+            data = token_cache.read_json_file(self.path)
+            scope = data.setdefault(self.scope, {"images": {}})
+            for sha256 in removed:
+                scope["images"].pop(sha256, None)
+            scope["images"].update(added)
+            scope["last_used"] = now
+            data = {key: value for key, value in data.items()
+                    if now - value.get("last_used", 0) < SCOPE_TTL_SECONDS}
+            token_cache.write_json_file(self.path, data)
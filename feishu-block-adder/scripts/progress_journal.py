@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+块添加进度日志
+追加写入的 progress.jsonl，每行一条记录，写入后立即 fsync：
+
+    {"event": "start",  "document_id", "mode", "total_blocks", "blocks_sha256", "seed", "time"}
+    {"event": "insert", "indices": [块下标], "block_ids": [返回的 block_id], "time"}
+    {"event": "image",  "block_id", "file_token", "time"}
+    {"event": "finish", "time"}
+
+进程中途退出（断网、token 过期、Ctrl-C）后，用 --resume 读取日志，跳过已确认插入的块，
+补设已插入但还没有设置素材的图片，从最后一个确认的块之后继续。
+写了一半的最后一行（进程在写入时退出）读取时忽略。
+"""
+
+import os
+import json
+import uuid
+import hashlib
+import threading
+from datetime import datetime
+
+
+JOURNAL_FILE_NAME = "progress.jsonl"
+
+# client_token 的命名空间：同一次添加（seed）中同一组块的插入请求总是使用同一个 token
+CLIENT_TOKEN_NAMESPACE = uuid.UUID("6f1f3c2e-5a4b-4d8e-9c1a-2b7d0e9f4a63")
+
+
+def blocks_digest(blocks):
+    """块列表的内容哈希，续传时校验 blocks.json 没有变化"""
+    encoded = json.dumps(blocks, sort_keys=True, ensure_ascii=False).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def client_token(seed, indices):
+    """
+    插入请求的幂等 token（uuid5）
+
+    由本次添加的 seed 和这组块的下标范围决定：请求超时后重试、或续传时重新提交同一组块，
+    都使用相同的 token，飞书不会重复创建块
+    """
+    return str(uuid.uuid5(CLIENT_TOKEN_NAMESPACE, f"{seed}:{indices[0]}-{indices[-1]}"))
+
+
+def read_records(path):
+    """读取日志中的全部记录，跳过无法解析的行（写了一半的最后一行）"""
+    records = []
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+    except FileNotFoundError:
+        pass
+    return records
+
+
+class ProgressJournal:
+    """
+    单次块添加的进度日志
+
+    新建（resume=False）时覆盖旧日志并写入 start 记录；续传时读取已有记录，
+    校验 document_id、模式和 blocks.json 与日志一致，不一致时抛出异常。
+    path 为 None 时只在内存中记录（进程内调用不写文件，但仍提供 client_token）。
+    record_* 线程安全。
+    """
+
+    def __init__(self, path, document_id, blocks, mode, resume=False):
+        self.path = path
+        self.document_id = document_id
+        self.lock = threading.Lock()
+        self.confirmed = {}
+        self.images_set = set()
+        self.finished = False
+        self.resumed = False
+
+        digest = blocks_digest(blocks)
+        records = read_records(path) if resume and path else []
+        if records:
+            start = records[0]
+            if start.get("event") != "start":
+                raise Exception(f"进度日志格式错误: {path}")
+            if start.get("document_id") != document_id:
+                raise Exception(f"进度日志属于文档 {start.get('document_id')}，与当前文档 {document_id} 不一致，无法续传")
+            if start.get("blocks_sha256") != digest:
+                raise Exception("blocks.json 与进度日志记录的内容不一致，无法续传")
+            if start.get("mode") != mode:
+                raise Exception(f"进度日志使用 {start.get('mode')} 模式，续传时必须使用相同的模式")
+            self.seed = start["seed"]
+            self.resumed = True
+            for record in records[1:]:
+                if record.get("event") == "insert":
+                    self.confirmed.update(zip(record["indices"], record["block_ids"]))
+                elif record.get("event") == "image":
+                    self.images_set.add(record["block_id"])
+                elif record.get("event") == "finish":
+                    self.finished = True
+            self._file = open(path, 'a', encoding='utf-8')
+        else:
+            if resume:
+                print(f"[feishu-block-adder] [WARN] 没有可续传的进度日志，从头开始: {path}")
+            self.seed = uuid.uuid4().hex
+            self._file = open(path, 'w', encoding='utf-8') if path else None
+            self._write({
+                "event": "start", "document_id": document_id, "mode": mode,
+                "total_blocks": len(blocks), "blocks_sha256": digest, "seed": self.seed
+            })
+
+    def _write(self, record):
+        if self._file is None:
+            return
+        record["time"] = datetime.now().isoformat()
+        with self.lock:
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def is_confirmed(self, indices):
+        """这组块是否已确认插入"""
+        return all(index in self.confirmed for index in indices)
+
+    def resume_point(self):
+        """最后一个确认插入的块之后的下标（没有确认的块时为 0）"""
+        return max(self.confirmed) + 1 if self.confirmed else 0
+
+    def pending_images(self, blocks, is_image_block):
+        """已插入但还没有设置素材的图片块：[(下标, block_id)]"""
+        return [(index, block_id) for index, block_id in sorted(self.confirmed.items())
+                if block_id and block_id not in self.images_set and is_image_block(blocks[index])]
+
+    def client_token(self, indices):
+        return client_token(self.seed, indices)
+
+    def record_insert(self, indices, block_ids):
+        """记录一次确认成功的插入（block_ids 与 indices 一一对应，未知时为 None）"""
+        self._write({"event": "insert", "indices": list(indices), "block_ids": list(block_ids)})
+        with self.lock:
+            self.confirmed.update(zip(indices, block_ids))
+
+    def record_image(self, block_id, file_token):
+        """记录图片块的素材已设置"""
+        self._write({"event": "image", "block_id": block_id, "file_token": file_token})
+        with self.lock:
+            self.images_set.add(block_id)
+
+    def finish(self):
+        """全部块处理完成"""
+        self._write({"event": "finish"})
+        self.finished = True
+
+    def close(self):
+        with self.lock:
+            if self._file is not None:
+                self._file.close()
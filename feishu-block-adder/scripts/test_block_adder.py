@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""block_adder 请求打包、补插与分片重试的测试"""
+
+import pytest
+
+import block_adder
+import feishu_client
+import progress_journal
+from block_adder import pack_descendant_trees, payload_size
+
+
+def make_tree(index, nodes=1, text_size=10):
+    descendants = [{"block_id": f"b{index}_{n}", "block_type": 2,
+                    "text": {"elements": [{"text_run": {"content": "x" * text_size}}]}}
+                   for n in range(nodes)]
+    return (index, {"block_type": 2}, descendants[0]["block_id"], descendants)
+
+
+def pack_indices(packs):
+    return [[tree[0] for tree in pack] for pack in packs]
+
+
+def test_pack_all_in_one_request():
+    trees = [make_tree(i) for i in range(5)]
+    assert pack_indices(pack_descendant_trees(trees)) == [[0, 1, 2, 3, 4]]
+
+
+def test_pack_respects_block_budget():
+    trees = [make_tree(i, nodes=3) for i in range(5)]
+    assert pack_indices(pack_descendant_trees(trees, max_blocks=6)) == [[0, 1], [2, 3], [4]]
+
+
+def test_pack_respects_byte_budget():
+    trees = [make_tree(i) for i in range(5)]
+    size = payload_size(trees[0][3])
+    packs = pack_descendant_trees(trees, max_bytes=size * 2)
+    assert pack_indices(packs) == [[0, 1], [2, 3], [4]]
+    for pack in packs:
+        assert sum(payload_size(tree[3]) for tree in pack) <= size * 2
+
+
+def test_oversized_tree_gets_its_own_request():
+    trees = [make_tree(0), make_tree(1, nodes=10), make_tree(2)]
+    assert pack_indices(pack_descendant_trees(trees, max_blocks=4)) == [[0], [1], [2]]
+    trees = [make_tree(0), make_tree(1, text_size=5000), make_tree(2)]
+    assert pack_indices(pack_descendant_trees(trees, max_bytes=1000)) == [[0], [1], [2]]
+
+
+def test_pack_keeps_document_order():
+    trees = [make_tree(i, nodes=1 + i % 3) for i in range(50)]
+    packs = pack_descendant_trees(trees, max_blocks=7)
+    assert [index for pack in pack_indices(packs) for index in pack] == list(range(50))
+    assert all(sum(len(tree[3]) for tree in pack) <= 7 for pack in packs)
+
+
+def test_pack_empty():
+    assert pack_descendant_trees([]) == []
+
+
+class FakeDocument:
+    """模拟文档一级块：insert(分组, index) 把分组插入到 index 位置，含坏块的分组整体失败"""
+
+    def __init__(self, journal, bad=(), transient=False):
+        self.children = []
+        self.journal = journal
+        self.bad = set(bad)
+        self.transient = transient
+        self.requests = []
+
+    def get_block(self, token, config, document_id, block_id):
+        return {"block_id": block_id, "children": list(self.children)}
+
+    def insert(self, unit, index=-1):
+        indices = [item[0] for item in unit]
+        self.requests.append(indices)
+        if self.bad & set(indices):
+            status = 503 if self.transient else 400
+            raise feishu_client.APIError(f"插入失败: {indices}", status_code=status, code=1770001)
+        block_ids = [f"id{i}" for i in indices]
+        if index == -1:
+            self.children.extend(block_ids)
+        else:
+            self.children[index:index] = block_ids
+        self.journal.record_insert(indices, block_ids)
+        return block_ids
+
+
+def run_reinsert(monkeypatch, total, failed_groups, bad=(), transient=False):
+    """先按顺序插入未失败的分组，再补插 failed_groups，返回 (文档, stats)"""
+    blocks = [{"block_type": 2} for _ in range(total)]
+    journal = progress_journal.ProgressJournal(None, "doc", blocks, "batched")
+    document = FakeDocument(journal, bad, transient)
+    monkeypatch.setattr(block_adder.docx_blocks, "get_block", document.get_block)
+
+    failed = {index for group in failed_groups for index in group}
+    for index in range(total):
+        if index not in failed:
+            document.insert([(index, blocks[index])])
+    deferred = [[(index, blocks[index]) for index in group] for group in failed_groups]
+
+    stats = block_adder.new_stats()
+    block_adder.reinsert_deferred("token", {}, "doc", deferred, journal, document.insert, stats, total)
+    return document, stats
+
+
+def test_reinsert_restores_document_order(monkeypatch):
+    document, stats = run_reinsert(monkeypatch, 10, [[2, 3], [6, 7, 8]])
+    assert document.children == [f"id{i}" for i in range(10)]
+    assert stats["reinserted_blocks"] == 5
+    assert stats["failed_blocks"] == []
+
+
+def test_reinsert_bisects_to_the_bad_block(monkeypatch):
+    document, stats = run_reinsert(monkeypatch, 10, [[4, 5, 6, 7]], bad={6})
+    assert document.children == [f"id{i}" for i in range(10) if i != 6]
+    assert [failure["index"] for failure in stats["failed_blocks"]] == [6]
+    assert stats["reinserted_blocks"] == 3
+
+
+def test_reinsert_bisects_to_several_bad_blocks(monkeypatch):
+    document, stats = run_reinsert(monkeypatch, 12, [list(range(1, 11))], bad={2, 9})
+    assert document.children == [f"id{i}" for i in range(12) if i not in (2, 9)]
+    assert [failure["index"] for failure in stats["failed_blocks"]] == [2, 9]
+
+
+def test_reinsert_does_not_bisect_transient_errors(monkeypatch):
+    document, stats = run_reinsert(monkeypatch, 6, [[2, 3, 4]], bad={3}, transient=True)
+    assert document.requests[-1] == [2, 3, 4]
+    assert document.requests.count([2, 3, 4]) == 1
+    assert [failure["index"] for failure in stats["failed_blocks"]] == [2, 3, 4]
+    assert document.children == ["id0", "id1", "id5"]
+
+
+class FakeResponse:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.body = body
+        self.text = str(body)
+
+    def json(self):
+        return self.body
+
+
+def upload_part_with(monkeypatch, responses):
+    """上传一个分片，每次请求依次取出 responses 中的一个响应，返回发出的请求数"""
+    sent = []
+
+    def post(url, **kwargs):
+        sent.append(url)
+        return responses.pop(0)
+
+    monkeypatch.setattr(block_adder.feishu_client, "post", post)
+    monkeypatch.setattr(block_adder.time, "sleep", lambda seconds: None)
+    config = {"FEISHU_API_DOMAIN": "http://feishu"}
+    block_adder.upload_media_part("token", config, "upload", 0, b"data", 4, lambda count: None)
+    return len(sent)
+
+
+def test_upload_part_retries_transient_errors(monkeypatch):
+    ok = FakeResponse(200, {"code": 0, "data": {}})
+    assert upload_part_with(monkeypatch, [FakeResponse(503, "busy"), FakeResponse(429, "limit"), ok]) == 3
+
+
+def test_upload_part_does_not_retry_other_errors(monkeypatch):
+    responses = [FakeResponse(200, {"code": 1061002, "msg": "params error"}), FakeResponse(200, {"code": 0})]
+    with pytest.raises(feishu_client.APIError, match="上传分片 0"):
+        upload_part_with(monkeypatch, responses)
+    assert len(responses) == 1
+
+
+def test_upload_part_gives_up_after_max_retries(monkeypatch):
+    responses = [FakeResponse(500, "error")] * (block_adder.MAX_PART_RETRIES + 2)
+    with pytest.raises(feishu_client.APIError):
+        upload_part_with(monkeypatch, responses)
+    assert len(responses) == 1
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""doc_sync.plan_sync 编辑脚本的测试"""
+
+import pytest
+
+from doc_sync import plan_sync
+
+import docx_blocks  # doc_sync 导入时已把 feishu-common/scripts 加入 sys.path
+
+
+def text_block(content, block_type=2, **extra):
+    key = docx_blocks.BLOCK_TYPE_KEYS[block_type]
+    return {"block_type": block_type, key: {"elements": [{"text_run": {"content": content}}]}, **extra}
+
+
+def split_spec(spec):
+    """"a#b-c" -> ["a", "#b", "-c"]"""
+    items = []
+    for char in spec:
+        if items and items[-1] in ("#", "-"):
+            items[-1] += char
+        else:
+            items.append(char)
+    return items
+
+
+def fingerprints(spec):
+    """"a" 为文本块，"#a" 为一级标题，"-a" 为无序列表"""
+    types = {"#": 3, "-": 12}
+    return [docx_blocks.local_fingerprint(text_block(item.lstrip("#-"), types.get(item[0], 2))) for item in spec]
+
+
+def apply_plan(remote, local, edits, patches):
+    """按 doc_sync 的执行顺序模拟编辑脚本：先批量更新文字，再依次执行删除和插入"""
+    doc = list(remote)
+    for remote_idx, local_idx in patches:
+        assert remote[remote_idx].patchable_to(local[local_idx])
+        doc[remote_idx] = local[local_idx]
+    for edit in edits:
+        if edit["op"] == "delete":
+            del doc[edit["start"]:edit["end"]]
+        else:
+            doc[edit["index"]:edit["index"]] = [local[j] for j in edit["local"]]
+    return [fp.key for fp in doc]
+
+
+@pytest.mark.parametrize("before, after, deleted, inserted, patched", [
+    ("abc", "abc", 0, 0, 0),
+    ("abc", "abxc", 0, 1, 0),
+    ("abc", "xabc", 0, 1, 0),
+    ("abc", "ac", 1, 0, 0),
+    ("abc", "", 3, 0, 0),
+    ("", "ab", 0, 2, 0),
+    ("abc", "axc", 0, 0, 1),
+    ("abc", "xyz", 0, 0, 3),
+    ("abc", "cab", 1, 1, 0),
+    ("abcd", "dcba", 3, 3, 0),
+    ("abc", "a-bc", 1, 1, 0),
+    ("abc", "a#xc", 1, 1, 0),
+    ("abcde", "a#x#ycde", 1, 2, 0),
+    ("abcd", "xd", 2, 0, 1),
+    ("ab", "axyb", 0, 2, 0),
+    ("a#b-cd", "a-c#bd", 1, 1, 0),
+])
+def test_plan_sync_matrix(before, after, deleted, inserted, patched):
+    remote = fingerprints(split_spec(before))
+    local = fingerprints(split_spec(after))
+
+    edits, patches = plan_sync(remote, local)
+
+    assert apply_plan(remote, local, edits, patches) == [fp.key for fp in local]
+    assert sum(e["end"] - e["start"] for e in edits if e["op"] == "delete") == deleted
+    assert sum(len(e["local"]) for e in edits if e["op"] == "insert") == inserted
+    assert len(patches) == patched
+
+
+def test_edits_run_from_end_to_start():
+    remote = fingerprints(split_spec("abcdef"))
+    local = fingerprints(split_spec("#ab#cd#ef"))
+    edits, patches = plan_sync(remote, local)
+
+    positions = [edit.get("start", edit.get("index")) for edit in edits]
+    assert positions == sorted(positions, reverse=True)
+    assert apply_plan(remote, local, edits, patches) == [fp.key for fp in local]
+
+
+def test_changed_block_type_is_rebuilt_not_patched():
+    remote = fingerprints(["a"])
+    local = fingerprints(["#a"])
+    assert plan_sync(remote, local) == ([{"op": "delete", "start": 0, "end": 1},
+                                         {"op": "insert", "index": 0, "local": [0]}], [])
+
+
+def test_todo_done_change_is_rebuilt():
+    remote = [docx_blocks.local_fingerprint(text_block("任务", 17, done=False))]
+    local = [docx_blocks.local_fingerprint(text_block("任务", 17, done=True))]
+    edits, patches = plan_sync(remote, local)
+    assert patches == []
+    assert [edit["op"] for edit in edits] == ["delete", "insert"]
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""progress_journal 续传校验的测试"""
+
+import json
+
+import pytest
+
+from progress_journal import ProgressJournal, read_records
+
+BLOCKS = [{"block_type": 2, "text": {"elements": [{"text_run": {"content": str(i)}}]}} for i in range(5)]
+
+
+def write_journal(path):
+    journal = ProgressJournal(path, "doc", BLOCKS, "batched")
+    journal.record_insert([0, 1], ["id0", "id1"])
+    journal.record_insert([2], ["id2"])
+    journal.record_image("id2", "file_token")
+    journal.close()
+    return journal
+
+
+def test_resume_restores_confirmed_blocks(tmp_path):
+    path = tmp_path / "progress.jsonl"
+    first = write_journal(path)
+
+    journal = ProgressJournal(path, "doc", BLOCKS, "batched", resume=True)
+    assert journal.resumed
+    assert journal.seed == first.seed
+    assert journal.confirmed == {0: "id0", 1: "id1", 2: "id2"}
+    assert journal.images_set == {"id2"}
+    assert journal.resume_point() == 3
+    assert journal.client_token([0, 1]) == first.client_token([0, 1])
+    assert journal.client_token([0, 1]) != journal.client_token([0, 2])
+    journal.close()
+
+
+def test_resume_ignores_partial_last_line(tmp_path):
+    path = tmp_path / "progress.jsonl"
+    write_journal(path)
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('{"event": "insert", "indices": [3')
+
+    journal = ProgressJournal(path, "doc", BLOCKS, "batched", resume=True)
+    assert journal.resume_point() == 3
+    journal.close()
+
+
+@pytest.mark.parametrize("document_id, blocks, mode, message", [
+    ("other", BLOCKS, "batched", "文档"),
+    ("doc", BLOCKS[:4], "batched", "blocks.json"),
+    ("doc", BLOCKS, "descendant", "模式"),
+])
+def test_resume_rejects_mismatched_journal(tmp_path, document_id, blocks, mode, message):
+    path = tmp_path / "progress.jsonl"
+    write_journal(path)
+    with pytest.raises(Exception, match=message):
+        ProgressJournal(path, document_id, blocks, mode, resume=True)
+
+
+def test_resume_rejects_journal_without_start(tmp_path):
+    path = tmp_path / "progress.jsonl"
+    path.write_text(json.dumps({"event": "insert", "indices": [0], "block_ids": ["id0"]}) + "\n", encoding='utf-8')
+    with pytest.raises(Exception, match="格式错误"):
+        ProgressJournal(path, "doc", BLOCKS, "batched", resume=True)
+
+
+def test_resume_without_journal_starts_over(tmp_path):
+    path = tmp_path / "progress.jsonl"
+    journal = ProgressJournal(path, "doc", BLOCKS, "batched", resume=True)
+    assert not journal.resumed
+    assert journal.resume_point() == 0
+    journal.close()
+    assert [record["event"] for record in read_records(path)] == ["start"]
+
+
+def test_new_journal_overwrites_old_one(tmp_path):
+    path = tmp_path / "progress.jsonl"
+    first = write_journal(path)
+    journal = ProgressJournal(path, "doc", BLOCKS, "batched")
+    journal.close()
+    records = read_records(path)
+    assert [record["event"] for record in records] == ["start"]
+    assert records[0]["seed"] != first.seed
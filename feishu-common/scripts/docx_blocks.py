@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+飞书文档块读取与指纹 - 公共模块
+分页读取文档的全部块，并把远端块和 blocks.json 中的块归一化为可比较的内容指纹
+"""
+
+import json
+import hashlib
+from pathlib import Path
+from urllib.parse import unquote
+
+import feishu_client
+
+# 获取文档所有块接口的最大分页大小
+MAX_PAGE_SIZE = 500
+
+# block_type -> 块内容所在的字段名
+BLOCK_TYPE_KEYS = {
+    2: "text", 3: "heading1", 4: "heading2", 5: "heading3", 6: "heading4",
+    7: "heading5", 8: "heading6", 9: "heading7", 10: "heading8", 11: "heading9",
+    12: "bullet", 13: "ordered", 14: "code", 15: "quote", 17: "todo",
+    19: "callout", 22: "divider", 27: "image", 31: "table", 32: "table_cell"
+}
+
+# 可以通过 update_text_elements 原地修改文字的块类型
+TEXT_PATCHABLE_TYPES = {2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 17}
+
+# 参与比较的行内样式（其余字段远端总会返回默认值，忽略）
+INLINE_STYLE_KEYS = ("bold", "italic", "strikethrough", "underline", "inline_code")
+
+# 高亮块参与比较的样式字段
+CALLOUT_STYLE_KEYS = ("background_color", "border_color", "text_color", "emoji_id")
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def iter_block_pages(token, config, document_id, page_size=MAX_PAGE_SIZE):
+    """
+    分页获取文档的所有块（含嵌套块），每次产出一页的块列表
+
+    使用 document_revision_id=-1 读取最新版本
+    """
+    url = f"{config['FEISHU_API_DOMAIN']}/open-apis/docx/v1/documents/{document_id}/blocks"
+    headers = {"Authorization": f"Bearer {token}"}
+
+    page_token = None
+    while True:
+        params = {"page_size": page_size, "document_revision_id": -1}
+        if page_token:
+            params["page_token"] = page_token
+        response = feishu_client.get(url, headers=headers, params=params)
+        result = response.json()
+        if result.get("code") != 0:
+            raise Exception(f"获取文档块失败: {result}")
+
+        data = result.get("data", {})
+        yield data.get("items", [])
+        page_token = data.get("page_token")
+        if not data.get("has_more") or not page_token:
+            return
+
+
+def get_block(token, config, document_id, block_id):
+    """获取单个块（文档根块的 children 即一级块的 block_id 顺序）"""
+    url = f"{config['FEISHU_API_DOMAIN']}/open-apis/docx/v1/documents/{document_id}/blocks/{block_id}"
+    headers = {"Authorization": f"Bearer {token}"}
+    response = feishu_client.get(url, headers=headers, params={"document_revision_id": -1})
+    result = response.json()
+    if result.get("code") != 0:
+        raise Exception(f"获取块失败: {result}")
+    return result.get("data", {}).get("block", {})
+
+
+def list_blocks(token, config, document_id, page_size=MAX_PAGE_SIZE):
+    """获取文档的所有块，返回块列表"""
+    return [block for page in iter_block_pages(token, config, document_id, page_size) for block in page]
+
+
+def index_blocks(items):
+    """块列表 -> {block_id: block}"""
+    return {block["block_id"]: block for block in items}
+
+
+def top_level_blocks(document_id, by_id):
+    """文档根块（page）下按顺序排列的一级子块"""
+    root = by_id.get(document_id, {})
+    return [by_id[child_id] for child_id in root.get("children", []) if child_id in by_id]
+
+
+def normalize_elements(elements):
+    """
+    把 text_run 元素归一化为 [[内容, 样式], ...]
+
+    只保留有效的行内样式（远端返回的 false 值、空链接都去掉），链接 URL 统一解码，
+    样式相同的相邻片段合并，这样解析器的输出和远端返回的块可以直接比较
+    """
+    runs = []
+    for element in elements or []:
+        text_run = element.get("text_run")
+        if text_run is None:
+            runs.append([None, json.dumps(element, sort_keys=True, ensure_ascii=False)])
+            continue
+        content = text_run.get("content", "")
+        if not content:
+            continue
+        style = text_run.get("text_element_style") or {}
+        normalized = {key: True for key in INLINE_STYLE_KEYS if style.get(key)}
+        link = (style.get("link") or {}).get("url")
+        if link:
+            normalized["link"] = unquote(link)
+        if runs and runs[-1][0] is not None and runs[-1][1] == normalized:
+            runs[-1][0] += content
+        else:
+            runs.append([content, normalized])
+    return runs
+
+
+def join_element_lines(lines):
+    """把多行元素（如高亮块的子文本块）用换行连接为一组元素"""
+    joined = []
+    for idx, elements in enumerate(lines):
+        if idx:
+            joined.append({"text_run": {"content": "\n"}})
+        joined.extend(elements)
+    return joined
+
+
+def block_elements(block):
+    """块内容字段中的 elements，没有时返回空列表"""
+    content = block.get(BLOCK_TYPE_KEYS.get(block.get("block_type"), ""), {})
+    return content.get("elements", []) if isinstance(content, dict) else []
+
+
+def hash_file(path):
+    """分块计算文件内容的 sha256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def local_image_source(block):
+    """
+    本地图片块的来源标识：本地文件为内容 sha256，网络图片为 URL
+
+    用于判断远端图片块是否来自同一个图片
+    """
+    local_path = block.get("local_path")
+    if local_path and Path(local_path).exists():
+        return "sha256:" + hash_file(local_path)
+    return "url:" + block.get("image", {}).get("token", "")
+
+
+def _digest(shape, text):
+    encoded = json.dumps([shape, text], sort_keys=True, ensure_ascii=False).encode('utf-8')
+    return hashlib.sha1(encoded).hexdigest()
+
+
+class BlockFingerprint:
+    """
+    块指纹
+
+    shape 为块类型和结构/样式部分，text 为归一化后的文字内容；
+    key 为两者的哈希，key 相同即认为块没有变化。shape 相同而 text 不同时，
+    如果类型在 TEXT_PATCHABLE_TYPES 中，可以只更新文字而不必删除重建
+    """
+
+    __slots__ = ("block_type", "shape", "text", "key")
+
+    def __init__(self, block_type, shape, text):
+        self.block_type = block_type
+        self.shape = shape
+        self.text = text
+        self.key = _digest(shape, text)
+
+    def patchable_to(self, other):
+        """能否通过更新文字把本块变成 other"""
+        return self.block_type in TEXT_PATCHABLE_TYPES and self.shape == other.shape
+
+    def __eq__(self, other):
+        return isinstance(other, BlockFingerprint) and self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+
+def _table_shape(rows):
+    return {"rows": len(rows), "columns": len(rows[0]) if rows else 0}
+
+
+def local_fingerprint(block):
+    """
+    blocks.json 中的块的指纹
+
+    表格按第一行的列数补齐或截断（与块添加器创建表格的方式一致），
+    单元格优先使用 cell_elements
+    """
+    if block.get("type") == "table":
+        rows = block.get("data", [])
+        col_size = len(rows[0]) if rows else 0
+        cell_elements = block.get("cell_elements") or []
+        text = []
+        for row_idx, row in enumerate(rows):
+            row = (list(row) + [""] * col_size)[:col_size]
+            row_elements = list(cell_elements[row_idx]) if row_idx < len(cell_elements) else []
+            row_elements = (row_elements + [None] * col_size)[:col_size]
+            text.append([normalize_elements(elements or [{"text_run": {"content": cell}}])
+                         for cell, elements in zip(row, row_elements)])
+        return BlockFingerprint(31, _table_shape(rows), text)
+
+    block_type = block.get("block_type")
+    if block_type == 27:
+        return BlockFingerprint(27, {"type": 27}, local_image_source(block))
+
+    content = block.get(BLOCK_TYPE_KEYS.get(block_type, ""), {})
+    shape = {"type": block_type}
+    if block_type == 14:
+        shape["language"] = content.get("style", {}).get("language", 1)
+    elif block_type == 17:
+        # 解析器把完成状态放在块的顶层 "done"（块添加器提交时转换为 todo.style.done）
+        shape["done"] = bool(block.get("done", content.get("style", {}).get("done")))
+    elif block_type == 19:
+        shape.update({key: content[key] for key in CALLOUT_STYLE_KEYS if key in content})
+    return BlockFingerprint(block_type, shape, normalize_elements(block_elements(block)))
+
+
+def _children_text(block, by_id):
+    """容器块（单元格、高亮块）的文字：子文本块按行连接"""
+    lines = [block_elements(by_id[child_id]) for child_id in block.get("children", []) if child_id in by_id]
+    return join_element_lines(lines)
+
+
+def remote_fingerprint(block, by_id, image_sources=None):
+    """
+    远端块的指纹
+
+    image_sources 为 {素材 file_token: 来源标识}（由图片素材缓存提供），
+    缓存中没有的图片以素材 token 作为来源，不会与本地图片匹配
+    """
+    block_type = block.get("block_type")
+
+    if block_type == 31:
+        prop = block.get("table", {}).get("property", {})
+        row_size = prop.get("row_size", 0)
+        col_size = prop.get("column_size", 0)
+        cells = [normalize_elements(_children_text(by_id[cell_id], by_id)) if cell_id in by_id else []
+                 for cell_id in block.get("children", [])]
+        text = [cells[row * col_size:(row + 1) * col_size] for row in range(row_size)]
+        return BlockFingerprint(31, {"rows": row_size, "columns": col_size}, text)
+
+    if block_type == 27:
+        file_token = block.get("image", {}).get("token", "")
+        source = (image_sources or {}).get(file_token, "token:" + file_token)
+        return BlockFingerprint(27, {"type": 27}, source)
+
+    content = block.get(BLOCK_TYPE_KEYS.get(block_type, ""), {})
+    if block_type not in BLOCK_TYPE_KEYS:
+        # 解析器不会生成的块（手动添加的附件、分栏等）：不会与任何本地块匹配
+        return BlockFingerprint(block_type, {"type": block_type, "raw": block.get("block_id")}, None)
+
+    shape = {"type": block_type}
+    elements = block_elements(block)
+    if block_type == 14:
+        shape["language"] = content.get("style", {}).get("language", 1)
+    elif block_type == 17:
+        shape["done"] = bool(content.get("style", {}).get("done"))
+    elif block_type == 19:
+        shape.update({key: content[key] for key in CALLOUT_STYLE_KEYS if key in content})
+        if not elements:
+            # /descendant 创建的高亮块是容器，文字在子文本块中
+            elements = _children_text(block, by_id)
+    return BlockFingerprint(block_type, shape, normalize_elements(elements))
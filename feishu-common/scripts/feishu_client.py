@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+飞书 HTTP 客户端 - 公共模块
+所有子技能共享的连接池会话，复用 TCP+TLS 连接
+"""
+
+import os
+import json
+import time
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import rate_limiter
+import http_metrics
+
+# 默认连接池大小（每个主机保持的连接数）
+DEFAULT_POOL_SIZE = 10
+
+# 默认超时：(连接超时, 读取超时)，单位秒
+DEFAULT_TIMEOUT = (5, 60)
+
+# 被限流后自动重试的最大次数
+MAX_THROTTLE_RETRIES = 5
+
+_session = None
+_session_lock = threading.Lock()
+_pool_size = None
+_timeout = None
+
+# 已关闭会话的连接统计，重建会话后继续累计
+_closed_stats = {}
+
+# 每次请求（含限流重试）完成后调用的钩子，默认记录 http_metrics
+_request_hooks = [http_metrics.record]
+
+
+def _parse_timeout(value):
+    """解析超时配置：'30' 或 '5,60'"""
+    parts = [float(part) for part in str(value).split(',') if part.strip()]
+    if len(parts) == 1:
+        return parts[0]
+    return tuple(parts[:2])
+
+
+def _default_pool_size():
+    return int(os.environ.get("FEISHU_HTTP_POOL_SIZE", DEFAULT_POOL_SIZE))
+
+
+def _default_timeout():
+    value = os.environ.get("FEISHU_HTTP_TIMEOUT")
+    return _parse_timeout(value) if value else DEFAULT_TIMEOUT
+
+
+def configure(pool_size=None, timeout=None):
+    """
+    调整连接池大小和默认超时
+
+    未指定的参数使用环境变量 FEISHU_HTTP_POOL_SIZE / FEISHU_HTTP_TIMEOUT，
+    再没有则使用默认值。已创建的会话会被关闭，下次请求时按新配置重建。
+    """
+    global _pool_size, _timeout
+    with _session_lock:
+        _pool_size = pool_size
+        _timeout = _parse_timeout(timeout) if isinstance(timeout, str) else timeout
+        _close_session()
+
+
+def _close_session():
+    """关闭当前会话，保留其连接统计"""
+    global _session
+    if _session is None:
+        return
+    for host, stats in _collect_pool_stats(_session).items():
+        total = _closed_stats.setdefault(host, {"requests": 0, "connections": 0})
+        total["requests"] += stats["requests"]
+        total["connections"] += stats["connections"]
+    _session.close()
+    _session = None
+
+
+def get_session():
+    """获取共享的连接池会话（线程安全，首次调用时创建）"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                pool_size = _pool_size or _default_pool_size()
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def get_timeout():
+    """当前默认超时"""
+    return _timeout if _timeout is not None else _default_timeout()
+
+
+def encode_json(payload):
+    """紧凑 JSON 编码：去掉多余空白，中文不转义"""
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class APIError(Exception):
+    """飞书接口返回错误：HTTP 状态码和业务 code 用于判断能否重试"""
+
+    def __init__(self, message, status_code=None, code=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.code = code
+
+
+def check_response(response, action):
+    """解析 JSON 响应，业务 code 非 0 或响应不是 JSON 时抛出 APIError（消息以 action 开头）"""
+    try:
+        result = response.json()
+    except ValueError:
+        raise APIError(f"{action}: HTTP {response.status_code} {response.text[:200]}", response.status_code)
+    if result.get("code") != 0:
+        raise APIError(f"{action}: {result}", response.status_code, result.get("code"))
+    return result
+
+
+def is_transient_error(error):
+    """
+    判断错误是否为临时错误（可以原样重试）
+
+    超时、连接错误、HTTP 5xx 和限流是临时错误；参数错误、无权限等重试也不会成功
+    """
+    if isinstance(error, (requests.exceptions.Timeout, requests.exceptions.ConnectionError)):
+        return True
+    if isinstance(error, APIError):
+        status = error.status_code or 0
+        return status >= 500 or status == 429 or error.code in rate_limiter.RATE_LIMIT_CODES
+    return False
+
+
+def add_request_hook(hook):
+    """
+    注册请求钩子：每次请求完成（含失败和限流重试）后调用
+
+        hook(method=, url=, status_code=, duration=, bytes_sent=, bytes_received=,
+             error=, throttled=, retry=)
+
+    status_code 在网络异常时为 None；钩子抛出的异常会被忽略，不影响请求
+    """
+    _request_hooks.append(hook)
+
+
+def remove_request_hook(hook):
+    if hook in _request_hooks:
+        _request_hooks.remove(hook)
+
+
+def _body_size(body):
+    """请求体字节数（multipart 上传由 requests 编码为 bytes）"""
+    if isinstance(body, bytes):
+        return len(body)
+    if isinstance(body, str):
+        return len(body.encode('utf-8'))
+    return 0
+
+
+def _response_size(response, stream):
+    """响应体字节数；流式读取时只能取 Content-Length"""
+    if stream:
+        return int(response.headers.get("Content-Length") or 0)
+    return len(response.content)
+
+
+def _run_hooks(**event):
+    for hook in list(_request_hooks):
+        try:
+            hook(**event)
+        except Exception:
+            # 统计失败不能影响接口调用
+            pass
+
+
+def _send(method, url, headers, timeout, retry, **kwargs):
+    """发送一次请求并调用请求钩子"""
+    start = time.perf_counter()
+    try:
+        response = get_session().request(method, url, headers=headers, timeout=timeout, **kwargs)
+    except requests.exceptions.RequestException:
+        _run_hooks(method=method, url=url, status_code=None, duration=time.perf_counter() - start,
+                   bytes_sent=_body_size(kwargs.get("data")), bytes_received=0,
+                   error=True, throttled=False, retry=retry)
+        raise
+    duration = time.perf_counter() - start
+    if _request_hooks:
+        _run_hooks(method=method, url=url, status_code=response.status_code, duration=duration,
+                   bytes_sent=_body_size(response.request.body),
+                   bytes_received=_response_size(response, kwargs.get("stream")),
+                   error=response.status_code >= 400,
+                   throttled=response.status_code >= 400 and rate_limiter.is_throttled(response),
+                   retry=retry)
+    return response
+
+
+def _rewind_files(files):
+    """重试前把上传文件的读取位置移回开头"""
+    if not files:
+        return
+    values = files.values() if isinstance(files, dict) else [value for _, value in files]
+    for value in values:
+        file_obj = value[1] if isinstance(value, (tuple, list)) else value
+        if hasattr(file_obj, "seek"):
+            file_obj.seek(0)
+
+
+def request(method, url, json=None, headers=None, timeout=None, **kwargs):
+    """
+    发送请求，参数与 requests.request 一致
+
+    - json 参数使用紧凑编码发送
+    - 未指定 timeout 时使用默认超时
+    - 写入类接口经过对应类别的自适应限流器；被限流（HTTP 429 / 99991400）时
+      按 Retry-After 等待后自动重试，最多 MAX_THROTTLE_RETRIES 次
+    - 每次发送后调用请求钩子（耗时、字节数、状态码、是否限流/重试），见 add_request_hook()
+    """
+    headers = dict(headers or {})
+    if json is not None:
+        kwargs["data"] = encode_json(json)
+        headers.setdefault("Content-Type", "application/json; charset=utf-8")
+    if timeout is None:
+        timeout = get_timeout()
+
+    limiter = rate_limiter.limiter_for(method, url)
+    attempt = 0
+    while True:
+        if limiter:
+            limiter.acquire()
+        response = _send(method, url, headers, timeout, attempt > 0, **kwargs)
+        if limiter is None:
+            return response
+        if rate_limiter.is_throttled(response) and attempt < MAX_THROTTLE_RETRIES:
+            attempt += 1
+            limiter.on_throttle(rate_limiter.retry_after_seconds(response))
+            _rewind_files(kwargs.get("files"))
+            continue
+        if not rate_limiter.is_throttled(response):
+            limiter.on_success(rate_limiter.rate_limit_of(response))
+        return response
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+
+def patch(url, **kwargs):
+    return request("PATCH", url, **kwargs)
+
+
+def delete(url, **kwargs):
+    return request("DELETE", url, **kwargs)
+
+
+def _collect_pool_stats(session):
+    """读取会话中每个主机连接池的请求数和新建连接数"""
+    stats = {}
+    seen = set()
+    for adapter in session.adapters.values():
+        if id(adapter) in seen:
+            continue
+        seen.add(id(adapter))
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            host = f"{pool.host}:{pool.port}" if pool.port else pool.host
+            entry = stats.setdefault(host, {"requests": 0, "connections": 0})
+            entry["requests"] += pool.num_requests
+            entry["connections"] += pool.num_connections
+    return stats
+
+
+def connection_stats():
+    """
+    按主机统计连接复用情况
+
+    返回：{host: {"requests": 请求数, "connections": 新建连接数,
+                  "reused": 复用连接的请求数（即省掉的握手次数）}}
+    """
+    with _session_lock:
+        stats = {host: dict(entry) for host, entry in _closed_stats.items()}
+        if _session is not None:
+            for host, entry in _collect_pool_stats(_session).items():
+                total = stats.setdefault(host, {"requests": 0, "connections": 0})
+                total["requests"] += entry["requests"]
+                total["connections"] += entry["connections"]
+    for entry in stats.values():
+        entry["reused"] = max(entry["requests"] - entry["connections"], 0)
+    return stats
+
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+HTTP 请求指标 - 公共模块
+feishu_client 每发送一次请求（含限流后的重试）调用一次 record()，按接口统计：
+
+- 延迟直方图（Prometheus 风格的固定分桶）、总耗时、最大耗时
+- 请求字节数、响应字节数
+- HTTP 状态码分布、错误数（HTTP >= 400 或网络异常）、限流次数、重试次数
+
+接口按 "方法 路径模板" 归类，路径中的文档 ID、块 ID 等替换为 :id。
+进程级汇总用 snapshot() 读取；collect() 在当前上下文（contextvars）中额外收集一份，
+进程内编排器、批量编排器的各个文档、各个步骤因此能分别统计。
+统计结果可以合并（merge），并导出为 Prometheus 文本格式（write_prometheus）。
+"""
+
+import os
+import threading
+import contextvars
+from contextlib import contextmanager
+from pathlib import Path
+from urllib.parse import urlsplit
+
+
+# 延迟分桶上界（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# 路径段被视为 ID 的最短长度（还需要含数字或大写字母，接口名都是小写）
+ID_SEGMENT_MIN_LENGTH = 8
+
+METRIC_PREFIX = "feishu_http"
+
+# 当前上下文中的收集器（collect() 嵌套时逐层追加）
+_collectors = contextvars.ContextVar("http_metrics_collectors", default=())
+
+# 当前请求是否为调用方的重试（retry_attempt() 设置）
+_retrying = contextvars.ContextVar("http_metrics_retrying", default=False)
+
+
+def endpoint_path(url):
+    """URL -> 路径模板：去掉主机和查询参数，ID 段替换为 :id"""
+    segments = []
+    for segment in urlsplit(url).path.split("/"):
+        if (len(segment) >= ID_SEGMENT_MIN_LENGTH
+                and any(char.isdigit() or char.isupper() for char in segment)):
+            segment = ":id"
+        segments.append(segment)
+    return "/".join(segments)
+
+
+def new_endpoint_stats(method, path):
+    """单个接口的原始计数（可以直接相加合并）"""
+    return {
+        "method": method,
+        "path": path,
+        "requests": 0,
+        "errors": 0,
+        "throttled": 0,
+        "retries": 0,
+        "bytes_sent": 0,
+        "bytes_received": 0,
+        "total_seconds": 0.0,
+        "max_seconds": 0.0,
+        "status_codes": {},
+        "buckets": [0] * (len(LATENCY_BUCKETS) + 1)
+    }
+
+
+def bucket_index(duration):
+    """耗时落入的分桶下标（最后一个为 +Inf）"""
+    for index, bound in enumerate(LATENCY_BUCKETS):
+        if duration <= bound:
+            return index
+    return len(LATENCY_BUCKETS)
+
+
+def bucket_percentile(stats, pct):
+    """
+    由直方图估算百分位数：取累计计数达到 pct% 的分桶上界（不超过最大耗时）
+    """
+    target = stats["requests"] * pct / 100
+    cumulative = 0
+    for index, count in enumerate(stats["buckets"]):
+        cumulative += count
+        if count and cumulative >= target:
+            bound = LATENCY_BUCKETS[index] if index < len(LATENCY_BUCKETS) else stats["max_seconds"]
+            return round(min(bound, stats["max_seconds"]), 3)
+    return 0.0
+
+
+class MetricsRegistry:
+    """按接口累计的请求指标（线程安全）"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+
+    def record(self, method, path, status_code, duration, bytes_sent, bytes_received,
+               error=False, throttled=False, retry=False):
+        key = f"{method} {path}"
+        status = str(status_code) if status_code is not None else "error"
+        with self.lock:
+            stats = self.endpoints.get(key)
+            if stats is None:
+                stats = self.endpoints[key] = new_endpoint_stats(method, path)
+            stats["requests"] += 1
+            stats["errors"] += int(error)
+            stats["throttled"] += int(throttled)
+            stats["retries"] += int(retry)
+            stats["bytes_sent"] += bytes_sent
+            stats["bytes_received"] += bytes_received
+            stats["total_seconds"] += duration
+            stats["max_seconds"] = max(stats["max_seconds"], duration)
+            stats["status_codes"][status] = stats["status_codes"].get(status, 0) + 1
+            stats["buckets"][bucket_index(duration)] += 1
+
+    def raw(self):
+        """原始计数的副本：{"方法 路径": {...}}"""
+        with self.lock:
+            return {key: dict(stats, status_codes=dict(stats["status_codes"]), buckets=list(stats["buckets"]))
+                    for key, stats in self.endpoints.items()}
+
+    def snapshot(self):
+        """汇总结果，格式见 summarize()"""
+        return summarize(self.raw())
+
+
+_process_registry = MetricsRegistry()
+
+
+def record(method, url, status_code, duration, bytes_sent=0, bytes_received=0,
+           error=False, throttled=False, retry=False):
+    """
+    记录一次请求：写入进程级汇总和当前上下文中的所有收集器
+
+    作为 feishu_client 的请求钩子注册；retry 为客户端限流重试，调用方的重试由 retry_attempt() 标记
+    """
+    path = endpoint_path(url)
+    retry = retry or _retrying.get()
+    for registry in (_process_registry,) + _collectors.get():
+        registry.record(method, path, status_code, duration, bytes_sent, bytes_received,
+                        error=error, throttled=throttled, retry=retry)
+
+
+@contextmanager
+def collect():
+    """
+    在 with 块内（包括用 contextvars.copy_context() 提交到线程池的任务）单独收集请求指标
+
+        with http_metrics.collect() as metrics:
+            ...
+        result["http_metrics"] = metrics.snapshot()
+    """
+    registry = MetricsRegistry()
+    token = _collectors.set(_collectors.get() + (registry,))
+    try:
+        yield registry
+    finally:
+        _collectors.reset(token)
+
+
+@contextmanager
+def retry_attempt(retrying=True):
+    """with 块内发出的请求记为重试（调用方自己实现的重试循环使用）"""
+    token = _retrying.set(retrying)
+    try:
+        yield
+    finally:
+        _retrying.reset(token)
+
+
+def summarize(raw):
+    """
+    原始计数 -> 结果 JSON 中的 http_metrics
+
+    返回：{"requests", "errors", "throttled", "retries", "bytes_sent", "bytes_received", "total_seconds",
+           "endpoints": {"方法 路径": {..., "mean_seconds", "p50_seconds", "p95_seconds", "p99_seconds",
+                                        "latency_buckets": {上界: 累计数}}}}
+    endpoints 按总耗时从大到小排列，第一个即占用时间最多的接口
+    """
+    endpoints = {}
+    for key, stats in sorted(raw.items(), key=lambda item: item[1]["total_seconds"], reverse=True):
+        cumulative = 0
+        latency_buckets = {}
+        for bound, count in zip([str(bound) for bound in LATENCY_BUCKETS] + ["+Inf"], stats["buckets"]):
+            cumulative += count
+            latency_buckets[bound] = cumulative
+        requests = stats["requests"]
+        summary = {name: value for name, value in stats.items() if name != "buckets"}
+        endpoints[key] = dict(
+            summary,
+            total_seconds=round(stats["total_seconds"], 3),
+            max_seconds=round(stats["max_seconds"], 3),
+            mean_seconds=round(stats["total_seconds"] / requests, 3) if requests else 0.0,
+            p50_seconds=bucket_percentile(stats, 50),
+            p95_seconds=bucket_percentile(stats, 95),
+            p99_seconds=bucket_percentile(stats, 99),
+            latency_buckets=latency_buckets
+        )
+
+    totals = {name: sum(stats[name] for stats in raw.values())
+              for name in ("requests", "errors", "throttled", "retries", "bytes_sent", "bytes_received")}
+    totals["total_seconds"] = round(sum(stats["total_seconds"] for stats in raw.values()), 3)
+    totals["endpoints"] = endpoints
+    return totals
+
+
+def to_raw(snapshot):
+    """http_metrics（summarize 的结果）-> 原始计数，用于合并多个结果文件中的统计"""
+    raw = {}
+    for key, stats in (snapshot or {}).get("endpoints", {}).items():
+        entry = new_endpoint_stats(stats["method"], stats["path"])
+        for name in ("requests", "errors", "throttled", "retries", "bytes_sent", "bytes_received",
+                     "total_seconds", "max_seconds"):
+            entry[name] = stats.get(name, entry[name])
+        entry["status_codes"] = dict(stats.get("status_codes", {}))
+        previous = 0
+        for index, cumulative in enumerate(stats.get("latency_buckets", {}).values()):
+            entry["buckets"][index] = cumulative - previous
+            previous = cumulative
+        raw[key] = entry
+    return raw
+
+
+def merge(*snapshots):
+    """合并多个 http_metrics（例如一次运行中各步骤的结果文件），返回合并后的 http_metrics"""
+    merged = {}
+    for snapshot in snapshots:
+        for key, stats in to_raw(snapshot).items():
+            total = merged.get(key)
+            if total is None:
+                merged[key] = stats
+                continue
+            for name in ("requests", "errors", "throttled", "retries", "bytes_sent", "bytes_received",
+                         "total_seconds"):
+                total[name] += stats[name]
+            total["max_seconds"] = max(total["max_seconds"], stats["max_seconds"])
+            for status, count in stats["status_codes"].items():
+                total["status_codes"][status] = total["status_codes"].get(status, 0) + count
+            total["buckets"] = [a + b for a, b in zip(total["buckets"], stats["buckets"])]
+    return summarize(merged)
+
+
+def snapshot():
+    """本进程所有请求的 http_metrics"""
+    return _process_registry.snapshot()
+
+
+def format_labels(labels):
+    escaped = {name: str(value).replace("\\", "\\\\").replace('"', '\\"') for name, value in labels.items()}
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped.items()) + "}"
+
+
+def format_prometheus(metrics, labels=None):
+    """
+    http_metrics -> Prometheus 文本格式
+
+    labels 为附加到每条指标上的标签（例如 {"job": "feishu-doc-orchestrator"}）
+    """
+    labels = labels or {}
+    counters = [
+        ("errors", "errors_total", "HTTP >= 400 或网络异常的请求数"),
+        ("throttled", "throttled_total", "被限流的请求数"),
+        ("retries", "retries_total", "重试发出的请求数"),
+        ("bytes_sent", "request_bytes_total", "请求体字节数"),
+        ("bytes_received", "response_bytes_total", "响应体字节数"),
+    ]
+    endpoints = list(metrics.get("endpoints", {}).values())
+
+    lines = [
+        f"# HELP {METRIC_PREFIX}_request_duration_seconds 飞书接口请求耗时",
+        f"# TYPE {METRIC_PREFIX}_request_duration_seconds histogram"
+    ]
+    for stats in endpoints:
+        series = dict(labels, method=stats["method"], endpoint=stats["path"])
+        for bound, count in stats["latency_buckets"].items():
+            lines.append(f"{METRIC_PREFIX}_request_duration_seconds_bucket{format_labels(dict(series, le=bound))} {count}")
+        lines.append(f"{METRIC_PREFIX}_request_duration_seconds_sum{format_labels(series)} {stats['total_seconds']}")
+        lines.append(f"{METRIC_PREFIX}_request_duration_seconds_count{format_labels(series)} {stats['requests']}")
+
+    lines.append(f"# HELP {METRIC_PREFIX}_responses_total 按 HTTP 状态码统计的请求数（网络异常为 error）")
+    lines.append(f"# TYPE {METRIC_PREFIX}_responses_total counter")
+    for stats in endpoints:
+        for status, count in sorted(stats["status_codes"].items()):
+            series = dict(labels, method=stats["method"], endpoint=stats["path"], status=status)
+            lines.append(f"{METRIC_PREFIX}_responses_total{format_labels(series)} {count}")
+
+    for field, name, help_text in counters:
+        lines.append(f"# HELP {METRIC_PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {METRIC_PREFIX}_{name} counter")
+        for stats in endpoints:
+            series = dict(labels, method=stats["method"], endpoint=stats["path"])
+            lines.append(f"{METRIC_PREFIX}_{name}{format_labels(series)} {stats[field]}")
+    return "\n".join(lines) + "\n"
+
+
+def get_prometheus_file():
+    """Prometheus 文本文件路径（环境变量 FEISHU_HTTP_METRICS_FILE，未设置时为 None）"""
+    value = os.environ.get("FEISHU_HTTP_METRICS_FILE")
+    return Path(value) if value else None
+
+
+def write_prometheus(path, metrics, labels=None):
+    """
+    把 http_metrics 写成 Prometheus 文本格式文件（node_exporter textfile collector 可直接读取）
+
+    先写临时文件再替换，采集时不会读到写了一半的文件。返回文件路径
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = path.with_name(path.name + ".tmp")
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        f.write(format_prometheus(metrics, labels))
+    os.replace(tmp_file, path)
+    return path
+
+
+def print_summary(metrics, prefix, limit=5):
+    """打印耗时最多的几个接口"""
+    if not metrics.get("requests"):
+        return
+    print(f"{prefix} HTTP: {metrics['requests']} requests, {metrics['total_seconds']:.2f}s, "
+          f"sent {metrics['bytes_sent']} B, received {metrics['bytes_received']} B, "
+          f"errors {metrics['errors']}, throttled {metrics['throttled']}")
+    for key, stats in list(metrics["endpoints"].items())[:limit]:
+        print(f"{prefix}   {key}: {stats['requests']} x, {stats['total_seconds']:.2f}s "
+              f"(p50 ≤{stats['p50_seconds']:.3f}s, p95 ≤{stats['p95_seconds']:.3f}s, max {stats['max_seconds']:.3f}s)")
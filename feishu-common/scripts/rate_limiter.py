@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+自适应令牌桶限流器 - 公共模块
+按接口类别（文档写入、素材上传、权限）限流，被限流时乘性降速，
+未被限流时加性提速（AIMD），让请求速率贴近飞书 API 实际允许的上限
+"""
+
+import time
+import threading
+
+# 飞书限流错误码（频率超限）
+RATE_LIMIT_CODES = {99991400}
+
+# 各接口类别的初始速率、速率上限和下限（请求/秒）
+ENDPOINT_LIMITS = {
+    "docx_write": {"rate": 5.0, "max_rate": 20.0, "min_rate": 0.5},
+    "media_upload": {"rate": 5.0, "max_rate": 10.0, "min_rate": 0.5},
+    "permission": {"rate": 5.0, "max_rate": 10.0, "min_rate": 0.5},
+}
+
+# 每次成功请求后的速率增量（加性增）和被限流后的速率系数（乘性减）
+ADDITIVE_INCREASE = 0.2
+MULTIPLICATIVE_DECREASE = 0.5
+
+# 没有 Retry-After 等响应头时，被限流后的默认等待时间（秒）
+DEFAULT_RETRY_AFTER = 1.0
+
+
+class AdaptiveRateLimiter:
+    """线程安全的自适应令牌桶"""
+
+    def __init__(self, name, rate, max_rate, min_rate):
+        self.name = name
+        self.rate = rate
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.tokens = 1.0
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+        self.throttled_count = 0
+        self.request_count = 0
+        self.wait_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        # 桶容量取当前速率（至少 1），允许最多一秒的突发
+        capacity = max(1.0, self.rate)
+        self.tokens = min(capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def acquire(self):
+        """取一个令牌，不足时阻塞等待"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self.blocked_until and self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    self.request_count += 1
+                    return
+                wait = max(self.blocked_until - now, (1.0 - self.tokens) / self.rate)
+                self.wait_seconds += wait
+            time.sleep(wait)
+
+    def on_success(self, limit=None):
+        """请求成功：加性提速；响应头给出了限额时以限额为上限"""
+        with self._lock:
+            if limit:
+                self.max_rate = max(self.min_rate, float(limit))
+            self.rate = min(self.max_rate, self.rate + ADDITIVE_INCREASE)
+
+    def on_throttle(self, retry_after=None):
+        """被限流：乘性降速，并在 retry_after 秒内暂停发放令牌"""
+        with self._lock:
+            now = time.monotonic()
+            self.throttled_count += 1
+            self.rate = max(self.min_rate, self.rate * MULTIPLICATIVE_DECREASE)
+            self.tokens = 0.0
+            self.updated_at = now
+            delay = retry_after if retry_after is not None else DEFAULT_RETRY_AFTER
+            self.blocked_until = max(self.blocked_until, now + delay)
+
+    def snapshot(self):
+        """当前状态，用于写入结果文件"""
+        with self._lock:
+            return {
+                "rate": round(self.rate, 2),
+                "max_rate": round(self.max_rate, 2),
+                "requests": self.request_count,
+                "throttled": self.throttled_count,
+                "wait_seconds": round(self.wait_seconds, 2)
+            }
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(name):
+    """获取指定接口类别的限流器（进程内共享）"""
+    with _limiters_lock:
+        if name not in _limiters:
+            _limiters[name] = AdaptiveRateLimiter(name, **ENDPOINT_LIMITS[name])
+        return _limiters[name]
+
+
+def classify_endpoint(method, url):
+    """
+    根据请求方法和 URL 判断接口类别
+
+    - docx_write：文档写入（创建文档、创建/更新/删除块）
+    - media_upload：素材上传
+    - permission：协作者和所有权
+    其他接口（获取 token、读取块等）不限流，返回 None
+    """
+    if "/drive/v1/medias/" in url:
+        return "media_upload"
+    if "/drive/v1/permissions/" in url:
+        return "permission"
+    if "/docx/v1/documents" in url and method.upper() != "GET":
+        return "docx_write"
+    return None
+
+
+def limiter_for(method, url):
+    """请求对应的限流器，不需要限流时返回 None"""
+    name = classify_endpoint(method, url)
+    return get_limiter(name) if name else None
+
+
+def is_throttled(response):
+    """判断响应是否为限流（HTTP 429 或飞书限流错误码）"""
+    if response.status_code == 429:
+        return True
+    if response.status_code >= 400:
+        try:
+            return response.json().get("code") in RATE_LIMIT_CODES
+        except ValueError:
+            return False
+    return False
+
+
+def retry_after_seconds(response):
+    """从 Retry-After / x-ogw-ratelimit-reset 响应头读取需要等待的秒数"""
+    for header in ("Retry-After", "x-ogw-ratelimit-reset"):
+        value = response.headers.get(header)
+        if value:
+            try:
+                return max(float(value), 0.0)
+            except ValueError:
+                continue
+    return None
+
+
+def rate_limit_of(response):
+    """从 x-ogw-ratelimit-limit 响应头读取每秒限额"""
+    value = response.headers.get("x-ogw-ratelimit-limit")
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+def limiter_stats():
+    """所有已使用的限流器状态"""
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {name: limiter.snapshot() for name, limiter in limiters.items()}
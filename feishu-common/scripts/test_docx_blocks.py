@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""docx_blocks 块指纹归一化的测试"""
+
+from docx_blocks import normalize_elements, local_fingerprint, remote_fingerprint
+
+
+def run(content, **style):
+    if style:
+        return {"text_run": {"content": content, "text_element_style": style}}
+    return {"text_run": {"content": content}}
+
+
+def remote_style(**overrides):
+    """远端返回的样式：所有字段都有默认值"""
+    style = {"bold": False, "italic": False, "strikethrough": False, "underline": False, "inline_code": False}
+    style.update(overrides)
+    return style
+
+
+def test_remote_default_styles_are_ignored():
+    assert normalize_elements([run("a", **remote_style())]) == normalize_elements([run("a")]) == [["a", {}]]
+
+
+def test_adjacent_runs_with_same_style_merge():
+    assert normalize_elements([run("a", bold=True), run("b", **remote_style(bold=True)), run("c")]) == [
+        ["ab", {"bold": True}], ["c", {}]
+    ]
+
+
+def test_empty_runs_are_dropped():
+    assert normalize_elements([run("a"), run(""), run("b")]) == [["ab", {}]]
+    assert normalize_elements(None) == []
+
+
+def test_link_url_is_decoded():
+    encoded = run("文档", link={"url": "https%3A%2F%2Fa.com%2F%E8%B7%AF%E5%BE%84"})
+    assert normalize_elements([encoded]) == [["文档", {"link": "https://a.com/路径"}]]
+    assert normalize_elements([run("a", link={"url": ""})]) == [["a", {}]]
+
+
+def test_non_text_elements_are_kept_verbatim():
+    mention = {"mention_user": {"user_id": "ou_1"}}
+    runs = normalize_elements([run("a"), mention, run("b")])
+    assert [content for content, _ in runs] == ["a", None, "b"]
+
+
+def test_local_and_remote_text_blocks_match():
+    local = {"block_type": 2, "text": {"elements": [run("a "), run("b", bold=True)]}}
+    remote = {"block_id": "x", "block_type": 2, "text": {"elements": [
+        run("a ", **remote_style()), run("b", **remote_style(bold=True))
+    ]}}
+    assert local_fingerprint(local) == remote_fingerprint(remote, {})
+
+
+def test_todo_done_state():
+    """解析器把完成状态放在顶层 done，远端在 todo.style.done"""
+    def remote(done):
+        return {"block_id": "t", "block_type": 17, "todo": {"elements": [run("任务")], "style": {"done": done}}}
+
+    def local(done):
+        return {"type": "todo", "block_type": 17, "done": done, "todo": {"elements": [run("任务")]}}
+
+    assert local_fingerprint(local(True)) == remote_fingerprint(remote(True), {})
+    assert local_fingerprint(local(False)) == remote_fingerprint(remote(False), {})
+    assert local_fingerprint(local(True)) != remote_fingerprint(remote(False), {})
+
+
+def test_table_rows_are_padded_to_first_row():
+    local = {"type": "table", "data": [["a", "b"], ["c"]]}
+    fp = local_fingerprint(local)
+    assert fp.shape == {"rows": 2, "columns": 2}
+    assert fp.text == [[[["a", {}]], [["b", {}]]], [[["c", {}]], []]]
+
+
+def test_table_matches_remote_cells():
+    by_id = {}
+    cells = []
+    for idx, content in enumerate(["a", "b", "c", ""]):
+        text_id, cell_id = f"t{idx}", f"c{idx}"
+        by_id[text_id] = {"block_id": text_id, "block_type": 2, "text": {"elements": [run(content)]}}
+        by_id[cell_id] = {"block_id": cell_id, "block_type": 32, "children": [text_id]}
+        cells.append(cell_id)
+    table = {"block_id": "tb", "block_type": 31, "children": cells,
+             "table": {"property": {"row_size": 2, "column_size": 2}}}
+
+    local = {"type": "table", "data": [["a", "b"], ["c"]]}
+    assert local_fingerprint(local) == remote_fingerprint(table, by_id)
+
+
+def test_unknown_remote_blocks_never_match():
+    a = remote_fingerprint({"block_id": "a", "block_type": 23}, {})
+    b = remote_fingerprint({"block_id": "b", "block_type": 23}, {})
+    assert a != b
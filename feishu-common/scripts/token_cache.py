@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+tenant_access_token 缓存 - 公共模块
+跨进程共享的磁盘缓存（文件锁保护），按 expire 字段在过期前主动刷新
+"""
+
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+import feishu_client
+
+# 距离过期不足该秒数时主动刷新
+REFRESH_MARGIN_SECONDS = 300
+
+# 等待文件锁的最长时间（秒）
+LOCK_TIMEOUT_SECONDS = 30
+
+# 进程内缓存，避免每次都读文件
+_memory = {}
+_memory_lock = threading.Lock()
+
+
+def get_claude_dir():
+    """项目根目录下的 .claude 目录（与 feishu-token.json 所在目录一致）"""
+    project_root = Path(__file__).parent.parent.parent.parent.parent
+    claude_dir = project_root / ".claude"
+    if not claude_dir.exists():
+        claude_dir = Path(".claude")
+    return claude_dir
+
+
+def get_cache_path():
+    """缓存文件路径，可通过环境变量 FEISHU_TOKEN_CACHE_FILE 指定"""
+    env_path = os.environ.get("FEISHU_TOKEN_CACHE_FILE")
+    if env_path:
+        return Path(env_path)
+    return get_claude_dir() / "feishu-tenant-token.json"
+
+
+@contextmanager
+def file_lock(path, timeout=LOCK_TIMEOUT_SECONDS):
+    """
+    跨进程文件锁（独占），锁文件为 <path>.lock
+
+    POSIX 使用 fcntl.flock，Windows 使用 msvcrt.locking
+    """
+    lock_path = Path(str(path) + ".lock")
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    deadline = time.monotonic() + timeout
+    with open(lock_path, 'a+') as lock_file:
+        if os.name == "nt":
+            import msvcrt
+            while True:
+                try:
+                    lock_file.seek(0)
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+                    break
+                except OSError:
+                    if time.monotonic() > deadline:
+                        raise Exception(f"等待文件锁超时: {lock_path}")
+                    time.sleep(0.05)
+            try:
+                yield
+            finally:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            while True:
+                try:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except OSError:
+                    if time.monotonic() > deadline:
+                        raise Exception(f"等待文件锁超时: {lock_path}")
+                    time.sleep(0.05)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def read_json_file(path):
+    """读取 JSON 文件，不存在或损坏时返回空字典"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_json_file(path, data):
+    """原子写入 JSON 文件：先写临时文件再替换，读取方不会看到写了一半的文件"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _is_fresh(entry):
+    return bool(entry) and entry.get("expires_at", 0) - time.time() > REFRESH_MARGIN_SECONDS
+
+
+def fetch_tenant_access_token(config):
+    """调用 /auth/v3/tenant_access_token/internal 获取新 token"""
+    url = f"{config['FEISHU_API_DOMAIN']}/open-apis/auth/v3/tenant_access_token/internal"
+    headers = {"Content-Type": "application/json"}
+    payload = {
+        "app_id": config['FEISHU_APP_ID'],
+        "app_secret": config['FEISHU_APP_SECRET']
+    }
+    response = feishu_client.post(url, json=payload, headers=headers)
+    result = response.json()
+    if result.get("code") != 0:
+        raise Exception(f"获取 tenant_access_token 失败: {result}")
+    return {
+        "tenant_access_token": result["tenant_access_token"],
+        "expires_at": int(time.time()) + int(result.get("expire", 7200))
+    }
+
+
+def get_tenant_access_token(config, force_refresh=False):
+    """
+    获取 tenant_access_token（带缓存）
+
+    依次查找进程内缓存和磁盘缓存，距离过期超过 REFRESH_MARGIN_SECONDS 时直接复用；
+    否则在文件锁内重新获取并写回磁盘，多个进程同时刷新时只有一个会真正请求接口。
+    """
+    app_id = config['FEISHU_APP_ID']
+
+    if not force_refresh:
+        with _memory_lock:
+            entry = _memory.get(app_id)
+        if _is_fresh(entry):
+            return entry["tenant_access_token"]
+
+    cache_path = get_cache_path()
+    with file_lock(cache_path):
+        cache = read_json_file(cache_path)
+        entry = cache.get(app_id)
+        if force_refresh or not _is_fresh(entry):
+            entry = fetch_tenant_access_token(config)
+            cache[app_id] = entry
+            write_json_file(cache_path, cache)
+
+    with _memory_lock:
+        _memory[app_id] = entry
+    return entry["tenant_access_token"]
+
+
+def invalidate_tenant_token(config):
+    """丢弃缓存的 token（例如接口返回 token 无效时），下次获取会重新请求"""
+    app_id = config['FEISHU_APP_ID']
+    with _memory_lock:
+        _memory.pop(app_id, None)
+    cache_path = get_cache_path()
+    with file_lock(cache_path):
+        cache = read_json_file(cache_path)
+        if cache.pop(app_id, None) is not None:
+            write_json_file(cache_path, cache)
@@ -5,7 +5,6 @@
 自动启动本地服务器接收 OAuth 回调，无需手动复制授权码
 """
 
-import requests
 import json
 import time
 import webbrowser
@@ -16,6 +15,17 @@ from http.server import HTTPServer, BaseHTTPRequestHandler
 from threading import Thread
 from pathlib import Path
 
+# 添加公共模块路径
+COMMON_SCRIPT_DIR = Path(__file__).parent.parent.parent / "feishu-common" / "scripts"
+if str(COMMON_SCRIPT_DIR) not in sys.path:
+    sys.path.insert(0, str(COMMON_SCRIPT_DIR))
+
+import feishu_client
+import token_cache
+
+# 距离过期不足该秒数时使用 refresh_token 静默刷新 user_access_token
+USER_TOKEN_REFRESH_MARGIN = 300
+
 # 全局变量存储授权码
 auth_code = None
 server_running = True
@@ -127,7 +137,7 @@ def get_token_with_code(code, config):
     }
 
     print(f"[INFO] 正在获取 user_access_token...")
-    response = requests.post(url, json=payload, timeout=30)
+    response = feishu_client.post(url, json=payload, timeout=30)
     result = response.json()
 
     if result.get('code') != 0:
@@ -136,13 +146,18 @@ def get_token_with_code(code, config):
     return result
 
 
-def save_token(token_data):
-    """保存 token 到文件"""
+def get_token_path():
+    """user_access_token 文件路径"""
     # 获取项目根目录 - 从脚本位置向上找到项目根目录
     # 脚本位置: .claude/skills/feishu-doc-creator-with-permission/scripts/auto_auth.py
     # 项目根目录需要向上 5 级
     project_root = Path(__file__).parent.parent.parent.parent.parent
-    token_path = project_root / ".claude" / "feishu-token.json"
+    return project_root / ".claude" / "feishu-token.json"
+
+
+def save_token(token_data):
+    """保存 token 到文件"""
+    token_path = get_token_path()
 
     expires_in = token_data.get('expires_in', 7200)
     refresh_expires_in = token_data.get('refresh_token_expires_in', 604800)
@@ -164,6 +179,72 @@ def save_token(token_data):
     return data
 
 
+def refresh_user_token(refresh_token, config):
+    """使用 refresh_token 刷新 user_access_token（OAuth refresh_token 授权）"""
+    url = f"{config['FEISHU_API_DOMAIN']}/open-apis/authen/v2/oauth/token"
+    payload = {
+        'grant_type': 'refresh_token',
+        'client_id': config['FEISHU_APP_ID'],
+        'client_secret': config['FEISHU_APP_SECRET'],
+        'refresh_token': refresh_token
+    }
+
+    print(f"[INFO] 正在使用 refresh_token 刷新 user_access_token...")
+    response = feishu_client.post(url, json=payload, timeout=30)
+    result = response.json()
+
+    if result.get('code') != 0:
+        raise Exception(f"刷新 token 失败: {result}")
+
+    return result
+
+
+def get_valid_user_token(config=None):
+    """
+    获取可用的 user_access_token，必要时静默刷新
+
+    - 距离过期超过 USER_TOKEN_REFRESH_MARGIN 秒：直接返回
+    - 即将过期但 refresh_token 仍有效：使用 refresh_token 刷新并保存
+    - token 文件不存在或 refresh_token 也已过期：返回 None，由调用方启动交互式授权
+
+    刷新时持有文件锁：refresh_token 只能使用一次，并发进程不会重复刷新。
+    """
+    if config is None:
+        config = load_config()
+
+    token_path = get_token_path()
+    if not token_path.exists():
+        return None
+
+    with token_cache.file_lock(token_path):
+        token_data = token_cache.read_json_file(token_path)
+        # 支持 access_token 和 user_access_token 两种格式
+        token = token_data.get("user_access_token") or token_data.get("access_token")
+        now = time.time()
+
+        # 旧版 token 文件没有过期时间，无法判断，直接使用
+        if token and "expires_at" not in token_data:
+            return token
+        if token and token_data["expires_at"] - now > USER_TOKEN_REFRESH_MARGIN:
+            return token
+
+        refresh_token = token_data.get("refresh_token")
+        if not refresh_token or token_data.get("refresh_expires_at", 0) <= now:
+            return None
+
+        try:
+            result = refresh_user_token(refresh_token, config)
+        except Exception as e:
+            print(f"[WARN] {e}")
+            return None
+
+        # 响应中没有新的 refresh_token 时继续使用原来的
+        if not result.get('refresh_token'):
+            result['refresh_token'] = refresh_token
+            result['refresh_token_expires_in'] = int(token_data["refresh_expires_at"] - now)
+        return save_token(result)['access_token']
+
+
 def auto_authorize():
     """自动完成 OAuth 授权流程"""
     global auth_code, server_running
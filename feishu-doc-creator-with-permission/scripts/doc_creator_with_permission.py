@@ -13,13 +13,22 @@ import time
 import os
 from pathlib import Path
 from datetime import datetime
-import requests
 
 # 添加 feishu_auth 路径
 AUTH_SCRIPT_DIR = Path(__file__).parent.parent.parent / "feishu-doc-creator" / "scripts"
 if str(AUTH_SCRIPT_DIR) not in sys.path:
     sys.path.insert(0, str(AUTH_SCRIPT_DIR))
 
+# 添加公共模块路径
+COMMON_SCRIPT_DIR = Path(__file__).parent.parent.parent / "feishu-common" / "scripts"
+if str(COMMON_SCRIPT_DIR) not in sys.path:
+    sys.path.insert(0, str(COMMON_SCRIPT_DIR))
+
+import feishu_client
+import http_metrics
+import rate_limiter
+import token_cache
+
 
 def load_config():
     """加载飞书配置"""
@@ -43,19 +52,14 @@ def load_config():
 def get_access_token(config, use_user_token=False):
     """获取访问令牌"""
     if use_user_token:
-        # 修复路径 - 获取项目根目录
-        project_root = Path(__file__).parent.parent.parent.parent.parent
-        token_path = project_root / ".claude" / "feishu-token.json"
-
-        if token_path.exists():
-            with open(token_path, 'r', encoding='utf-8') as f:
-                token_data = json.load(f)
-                # 支持 access_token 和 user_access_token 两种格式
-                token = token_data.get("user_access_token") or token_data.get("access_token")
-                if token:
-                    return token
-
-        # Token 不存在或无效，自动触发授权
+        from auto_auth import get_valid_user_token
+
+        # token 即将过期时使用 refresh_token 静默刷新
+        token = get_valid_user_token(config)
+        if token:
+            return token
+
+        # Token 不存在或 refresh_token 也已过期，自动触发授权
         print()
         print("=" * 70)
         print("[INFO] user_access_token 不存在或已过期")
@@ -74,9 +78,7 @@ def get_access_token(config, use_user_token=False):
             )
             if result.returncode == 0:
                 # 重新读取 token
-                with open(token_path, 'r', encoding='utf-8') as f:
-                    token_data = json.load(f)
-                return token_data.get("user_access_token") or token_data.get("access_token")
+                return get_valid_user_token(config)
             else:
                 raise Exception("自动授权失败，请检查网络连接或手动运行 auto_auth.py")
         else:
@@ -84,19 +86,8 @@ def get_access_token(config, use_user_token=False):
 
         return None
     else:
-        # 获取 tenant_access_token
-        url = f"{config['FEISHU_API_DOMAIN']}/open-apis/auth/v3/tenant_access_token/internal"
-        headers = {"Content-Type": "application/json"}
-        payload = {
-            "app_id": config['FEISHU_APP_ID'],
-            "app_secret": config['FEISHU_APP_SECRET']
-        }
-        response = requests.post(url, json=payload, headers=headers)
-        result = response.json()
-        if result.get("code") == 0:
-            return result["tenant_access_token"]
-        else:
-            raise Exception(f"获取 tenant_access_token 失败: {result}")
+        # 获取 tenant_access_token（跨进程缓存，过期前自动刷新）
+        return token_cache.get_tenant_access_token(config)
 
 
 def create_document_with_user_token(user_token, config, title):
@@ -114,8 +105,6 @@ def create_document_with_user_token(user_token, config, title):
         "title": "文档标题"
     }
     """
-    import requests
-
     url = f"{config['FEISHU_API_DOMAIN']}/open-apis/docx/v1/documents"
     headers = {
         "Authorization": f"Bearer {user_token}",
@@ -133,7 +122,7 @@ def create_document_with_user_token(user_token, config, title):
         payload["folder_token"] = folder_token
         print(f"[INFO] 在指定文件夹创建文档: {folder_token}")
 
-    response = requests.post(url, json=payload, headers=headers)
+    response = feishu_client.post(url, json=payload, headers=headers)
     result = response.json()
 
     if result.get("code") != 0:
@@ -162,7 +151,7 @@ def create_document(token, config, title):
         "folder_token": config.get('FEISHU_DEFAULT_FOLDER', '')
     }
 
-    response = requests.post(url, json=payload, headers=headers)
+    response = feishu_client.post(url, json=payload, headers=headers)
     result = response.json()
 
     if result.get("code") == 0:
@@ -187,8 +176,6 @@ def create_document_with_tenant_token(tenant_token, config, title, folder_token=
         "title": "文档标题"
     }
     """
-    import requests
-
     url = f"{config['FEISHU_API_DOMAIN']}/open-apis/docx/v1/documents"
     headers = {
         "Authorization": f"Bearer {tenant_token}",
@@ -205,7 +192,7 @@ def create_document_with_tenant_token(tenant_token, config, title, folder_token=
         payload["folder_token"] = folder_token
         print(f"[INFO] 在指定文件夹创建文档: {folder_token}")
 
-    response = requests.post(url, json=payload, headers=headers)
+    response = feishu_client.post(url, json=payload, headers=headers)
     result = response.json()
 
     if result.get("code") != 0:
@@ -237,7 +224,7 @@ def add_permission_member(token, config, document_id, user_id, user_type, perm):
         "perm": perm
     }
 
-    response = requests.post(url, json=payload, headers=headers)
+    response = feishu_client.post(url, json=payload, headers=headers)
     result = response.json()
 
     if result.get("code") == 0:
@@ -246,8 +233,13 @@ def add_permission_member(token, config, document_id, user_id, user_type, perm):
         raise Exception(f"添加权限成员失败: {result}")
 
 
-def transfer_owner(document_id, user_id):
-    """转移文档所有权 - 必须使用 user_access_token 和 SDK"""
+def transfer_owner(document_id, user_id, old_owner_perm="view"):
+    """
+    转移文档所有权 - 必须使用 user_access_token 和 SDK
+
+    old_owner_perm: 转移后原所有者（应用）保留的权限。降为只读后应用无法再写入文档，
+    需在块添加完成之后转移
+    """
     try:
         import lark_oapi as lark
         from lark_oapi.api.drive.v1 import TransferOwnerPermissionMemberRequest, Owner
@@ -258,23 +250,12 @@ def transfer_owner(document_id, user_id):
     if not config:
         raise Exception("无法加载配置文件")
 
-    # 获取 user_access_token
-    # 修复路径 - 从脚本位置向上 5 级到达项目根目录
-    project_root = Path(__file__).parent.parent.parent.parent.parent
-    token_path = project_root / ".claude" / "feishu-token.json"
-    if not token_path.exists():
-        raise Exception("user_access_token 文件不存在，请先运行授权: python auto_auth.py")
-
-    try:
-        with open(token_path, 'r', encoding='utf-8') as f:
-            token_data = json.load(f)
-        # 支持 access_token 和 user_access_token 两种格式
-        user_token = token_data.get("user_access_token") or token_data.get("access_token")
-    except Exception as e:
-        raise Exception(f"读取 user_access_token 失败: {e}")
+    # 获取 user_access_token（即将过期时使用 refresh_token 静默刷新）
+    from auto_auth import get_valid_user_token
 
+    user_token = get_valid_user_token(config)
     if not user_token:
-        raise Exception("user_access_token 不存在")
+        raise Exception("user_access_token 不存在或已过期，请先运行授权: python auto_auth.py")
 
     # 创建使用 user_access_token 的客户端
     client = lark.Client.builder() \
@@ -294,15 +275,25 @@ def transfer_owner(document_id, user_id):
         .need_notification(True) \
         .remove_old_owner(False) \
         .stay_put(False) \
-        .old_owner_perm("view") \
+        .old_owner_perm(old_owner_perm) \
         .request_body(Owner.builder()
             .member_type("openid")
             .member_id(user_id)
             .build()) \
         .build()
 
-    # 执行转移
+    # 执行转移（SDK 不经过 feishu_client，单独记录请求指标）
+    start = time.perf_counter()
     response = client.drive.v1.permission_member.transfer_owner(request, request_option)
+    raw = getattr(response, "raw", None)
+    status_code = getattr(raw, "status_code", None)
+    http_metrics.record(
+        "POST", f"/open-apis/drive/v1/permissions/{document_id}/members/transfer_owner",
+        status_code, time.perf_counter() - start,
+        bytes_received=len(getattr(raw, "content", None) or b""),
+        error=not response.success(),
+        throttled=status_code == 429 or response.code in rate_limiter.RATE_LIMIT_CODES
+    )
 
     if not response.success():
         raise Exception(f"转移所有权失败: code={response.code}, msg={response.msg}")
@@ -334,55 +325,23 @@ def should_use_user_token(title):
     return False
 
 
-def main():
-    """主函数 - 命令行入口"""
-    # 解析参数
-    title = "未命名文档"
-    output_dir = Path("output")
-    force_user_token = False  # 强制使用 user_token 的标志
-
-    if len(sys.argv) >= 2:
-        title = sys.argv[1]
-
-    if len(sys.argv) >= 3:
-        output_dir = Path(sys.argv[2])
-
-    # 检查是否强制使用 user_token（通过环境变量或参数）
-    if "--user-token" in sys.argv or os.environ.get("FEISHU_USE_USER_TOKEN", "").lower() in ("1", "true", "yes"):
-        force_user_token = True
-
+def save_result(result, output_dir):
+    """保存结果到 doc_with_permission.json，返回文件路径"""
+    output_dir = Path(output_dir)
     output_dir.mkdir(parents=True, exist_ok=True)
+    result_file = output_dir / "doc_with_permission.json"
+    with open(result_file, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    return result_file
 
-    # 加载配置
-    config = load_config()
-    if not config:
-        print("[feishu-doc-creator-with-permission] Error: Unable to load config")
-        sys.exit(1)
-
-    print("=" * 70)
-    print("文档创建 + 权限管理（原子操作）")
-    print("=" * 70)
-    print(f"文档标题: {title}")
-    print()
-
-    # ========== 智能判断使用哪种 Token ==========
-    # 检查是否强制使用 user_token 或标题包含关键词
-    use_user_token_mode = force_user_token or should_use_user_token(title)
-
-    if use_user_token_mode:
-        print("[模式] User Token 模式（文档属于用户，可指定文件夹）")
-        print("      检测到关键词: 文件夹/用户/个人/我的")
-        print("      无需权限转移，文档直接属于用户")
-    else:
-        print("[模式] Tenant Token 模式（文档属于应用，需权限转移）")
-        print("      默认模式，适合自动化批量创建")
 
-    print()
+def create_document_step(title, config, use_user_token_mode):
+    """
+    第一步：创建文档
 
-    # 权限配置
+    返回结果数据；创建失败时结果中没有 document_id，错误记录在 errors 中
+    """
     collaborator_id = config.get('FEISHU_AUTO_COLLABORATOR_ID')
-    collaborator_type = config.get('FEISHU_AUTO_COLLABORATOR_TYPE', 'openid')
-    collaborator_perm = config.get('FEISHU_AUTO_COLLABORATOR_PERM', 'full_access')
 
     # 结果数据
     result = {
@@ -398,44 +357,31 @@ def main():
         "errors": []
     }
 
-    # ========== 第一步：创建文档 ==========
     folder_token = config.get('FEISHU_DEFAULT_FOLDER', '')
 
-    if use_user_token_mode:
-        # User Token 模式：文档属于用户，无需权限转移
-        print("[步骤 1/1] 创建文档 (user_access_token - 文档属于用户)...")
-        if folder_token:
-            print(f"         目标目录: {folder_token}")
-
+    with http_metrics.collect() as metrics:
         try:
-            user_token = get_access_token(config, use_user_token=True)
-            if not user_token:
-                raise Exception("无法获取 user_access_token，请先运行授权")
+            if use_user_token_mode:
+                # User Token 模式：文档属于用户，无需权限转移
+                print("[步骤 1/1] 创建文档 (user_access_token - 文档属于用户)...")
+                if folder_token:
+                    print(f"         目标目录: {folder_token}")
+
+                user_token = get_access_token(config, use_user_token=True)
+                if not user_token:
+                    raise Exception("无法获取 user_access_token，请先运行授权")
+
+                doc_id = create_document_with_user_token(user_token, config, title)
+                result["permission"]["user_has_full_control"] = True  # User Token 模式，用户自动有完全控制权
+            else:
+                # Tenant Token 模式：文档属于应用，需要添加协作者权限和转移所有权
+                print("[步骤 1/3] 创建文档 (tenant_access_token - 文档属于应用)...")
+                print("         注意: Tenant Token 模式无法指定文件夹，文档将创建在根目录")
 
-            doc_id = create_document_with_user_token(user_token, config, title)
-            result["document_id"] = doc_id
-            result["document_url"] = f"{config.get('FEISHU_WEB_DOMAIN', 'https://feishu.cn')}/docx/{doc_id}"
-            result["permission"]["user_has_full_control"] = True  # User Token 模式，用户自动有完全控制权
-            print(f"[OK] 文档创建成功")
-            print(f"     文档ID: {doc_id}")
-        except Exception as e:
-            error_msg = str(e)
-            result["errors"].append(f"创建文档失败: {error_msg}")
-            print(f"[FAIL] 创建文档失败: {error_msg}")
-            # 保存失败结果并退出
-            result_file = output_dir / "doc_with_permission.json"
-            with open(result_file, 'w', encoding='utf-8') as f:
-                json.dump(result, f, ensure_ascii=False, indent=2)
-            sys.exit(1)
-    else:
-        # Tenant Token 模式：文档属于应用，需要添加协作者权限和转移所有权
-        print("[步骤 1/3] 创建文档 (tenant_access_token - 文档属于应用)...")
-        print("         注意: Tenant Token 模式无法指定文件夹，文档将创建在根目录")
+                tenant_token = get_access_token(config, use_user_token=False)
+                # Tenant Token 模式不传 folder_token（无权限指定文件夹）
+                doc_id = create_document_with_tenant_token(tenant_token, config, title, folder_token=None)
 
-        try:
-            tenant_token = get_access_token(config, use_user_token=False)
-            # Tenant Token 模式不传 folder_token（无权限指定文件夹）
-            doc_id = create_document_with_tenant_token(tenant_token, config, title, folder_token=None)
             result["document_id"] = doc_id
             result["document_url"] = f"{config.get('FEISHU_WEB_DOMAIN', 'https://feishu.cn')}/docx/{doc_id}"
             print(f"[OK] 文档创建成功")
@@ -444,17 +390,33 @@ def main():
             error_msg = str(e)
             result["errors"].append(f"创建文档失败: {error_msg}")
             print(f"[FAIL] 创建文档失败: {error_msg}")
-            # 保存失败结果并退出
-            result_file = output_dir / "doc_with_permission.json"
-            with open(result_file, 'w', encoding='utf-8') as f:
-                json.dump(result, f, ensure_ascii=False, indent=2)
-            sys.exit(1)
+    result["http_metrics"] = metrics.snapshot()
+
+    return result
+
+
+def add_collaborator(result, config):
+    """
+    第二步（Tenant Token 模式）：添加协作者权限
+
+    直接更新 result 中的 permission 和 errors；User Token 模式或未配置协作者时无需处理
+    """
+    if result["token_mode"] == "user_access_token" or "document_id" not in result:
+        return result
+
+    with http_metrics.collect() as metrics:
+        doc_id = result["document_id"]
+
+        # 权限配置
+        collaborator_id = config.get('FEISHU_AUTO_COLLABORATOR_ID')
+        collaborator_type = config.get('FEISHU_AUTO_COLLABORATOR_TYPE', 'openid')
+        collaborator_perm = config.get('FEISHU_AUTO_COLLABORATOR_PERM', 'full_access')
 
-        # ========== 第二步：添加协作者权限 ==========
         print("\n[步骤 2/3] 添加协作者权限...")
         if collaborator_id:
             try:
                 # 使用 tenant_access_token 添加协作者
+                tenant_token = get_access_token(config, use_user_token=False)
                 add_permission_member(tenant_token, config, doc_id, collaborator_id, collaborator_type, collaborator_perm)
                 result["permission"]["collaborator_added"] = True
                 result["permission"]["user_has_full_control"] = True
@@ -468,13 +430,30 @@ def main():
                 print(f"[INFO] 文档已创建，但协作者未添加")
         else:
             print("[SKIP] 未配置协作者ID (FEISHU_AUTO_COLLABORATOR_ID)")
+    result["http_metrics"] = http_metrics.merge(result.get("http_metrics"), metrics.snapshot())
+
+    return result
+
+
+def transfer_ownership(result, config):
+    """
+    第三步（Tenant Token 模式）：把所有权转移给协作者，应用保留只读权限
 
-    # ========== 第三步：转移所有权（Tenant Token 模式） ==========
-    # 只有 Tenant Token 模式需要转移所有权
-    if not use_user_token_mode and collaborator_id:
+    直接更新 result 中的 permission 和 errors；User Token 模式或未配置协作者时无需处理。
+    转移后应用无法再写入文档，需在块添加完成之后调用
+    """
+    if result["token_mode"] == "user_access_token" or "document_id" not in result:
+        return result
+
+    collaborator_id = config.get('FEISHU_AUTO_COLLABORATOR_ID')
+    if not collaborator_id:
+        print("\n[SKIP] 未配置协作者ID (FEISHU_AUTO_COLLABORATOR_ID)，无法转移所有权")
+        return result
+
+    with http_metrics.collect() as metrics:
         print("\n[步骤 3/3] 转移文档所有权...")
         try:
-            transfer_owner(doc_id, collaborator_id)
+            transfer_owner(result["document_id"], collaborator_id)
             result["permission"]["owner_transferred"] = True
             result["permission"]["user_has_full_control"] = True
             print(f"[OK] 所有权转移成功")
@@ -484,15 +463,144 @@ def main():
             result["errors"].append(f"转移所有权失败: {error_msg}")
             print(f"[WARN] 所有权转移失败: {error_msg}")
             print(f"[INFO] 协作者已有编辑权限，但所有权未转移")
-    elif not use_user_token_mode:
-        print("\n[SKIP] 未配置协作者ID (FEISHU_AUTO_COLLABORATOR_ID)，无法转移所有权")
+    result["http_metrics"] = http_metrics.merge(result.get("http_metrics"), metrics.snapshot())
+
+    return result
+
+
+def grant_permissions(result, config):
+    """
+    第二步、第三步（Tenant Token 模式）：添加协作者权限并转移所有权
+
+    直接更新 result 中的 permission 和 errors；User Token 模式无需处理
+    """
+    add_collaborator(result, config)
+    return transfer_ownership(result, config)
+
+
+def choose_token_mode(title, force_user_token=False):
+    """智能判断使用哪种 Token，返回 True 表示 User Token 模式"""
+    # 检查是否强制使用 user_token 或标题包含关键词
+    use_user_token_mode = force_user_token or should_use_user_token(title)
+
+    if use_user_token_mode:
+        print("[模式] User Token 模式（文档属于用户，可指定文件夹）")
+        print("      检测到关键词: 文件夹/用户/个人/我的")
+        print("      无需权限转移，文档直接属于用户")
+    else:
+        print("[模式] Tenant Token 模式（文档属于应用，需权限转移）")
+        print("      默认模式，适合自动化批量创建")
+
+    print()
+    return use_user_token_mode
+
+
+def create_document_with_permission(title, config=None, force_user_token=False, transfer=True):
+    """
+    创建文档并完成权限管理（原子操作），供编排器在进程内直接调用
+
+    transfer=False 时只添加协作者，所有权转移由调用方在块添加完成后单独执行
+    （转移后应用只保留只读权限，无法再写入块）。
+    返回 doc_with_permission.json 的内容；创建失败时没有 document_id
+    """
+    if config is None:
+        config = load_config()
+
+    # ========== 智能判断使用哪种 Token ==========
+    use_user_token_mode = choose_token_mode(title, force_user_token)
+
+    result = create_document_step(title, config, use_user_token_mode)
+    if transfer:
+        grant_permissions(result, config)
+    else:
+        add_collaborator(result, config)
+    return result
+
+
+def transfer_main(result_file):
+    """
+    --transfer 命令行入口：读取已创建文档的 doc_with_permission.json，转移所有权后写回
+
+    编排器的子进程模式在块添加完成后调用
+    """
+    result_file = Path(result_file)
+    if not result_file.exists():
+        print(f"[feishu-doc-creator-with-permission] Error: {result_file} 不存在")
+        sys.exit(1)
+    with open(result_file, 'r', encoding='utf-8') as f:
+        result = json.load(f)
+
+    config = load_config()
+    if not config:
+        print("[feishu-doc-creator-with-permission] Error: Unable to load config")
+        sys.exit(1)
+
+    transfer_ownership(result, config)
+    save_result(result, result_file.parent)
+    print(f"所有权已转移: {result['permission']['owner_transferred']}")
+    print(f"\n[OUTPUT] {result_file}")
+
+
+def main():
+    """
+    主函数 - 命令行入口
+
+        doc_creator_with_permission.py [标题] [输出目录] [--user-token] [--no-transfer]
+        doc_creator_with_permission.py --transfer <doc_with_permission.json>
+
+    --no-transfer 只创建文档并添加协作者；--transfer 对已创建的文档执行所有权转移
+    """
+    if "--transfer" in sys.argv:
+        index = sys.argv.index("--transfer")
+        if index + 1 >= len(sys.argv):
+            print("用法: python doc_creator_with_permission.py --transfer <doc_with_permission.json>")
+            sys.exit(1)
+        transfer_main(sys.argv[index + 1])
+        return
+
+    # 解析参数
+    title = "未命名文档"
+    output_dir = Path("output")
+    force_user_token = False  # 强制使用 user_token 的标志
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+
+    if len(args) >= 1:
+        title = args[0]
+
+    if len(args) >= 2:
+        output_dir = Path(args[1])
+
+    # 检查是否强制使用 user_token（通过环境变量或参数）
+    if "--user-token" in sys.argv or os.environ.get("FEISHU_USE_USER_TOKEN", "").lower() in ("1", "true", "yes"):
+        force_user_token = True
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    # 加载配置
+    config = load_config()
+    if not config:
+        print("[feishu-doc-creator-with-permission] Error: Unable to load config")
+        sys.exit(1)
+
+    print("=" * 70)
+    print("文档创建 + 权限管理（原子操作）")
+    print("=" * 70)
+    print(f"文档标题: {title}")
+    print()
+
+    result = create_document_with_permission(title, config, force_user_token=force_user_token,
+                                             transfer="--no-transfer" not in sys.argv)
 
     # 保存结果
-    result_file = output_dir / "doc_with_permission.json"
-    with open(result_file, 'w', encoding='utf-8') as f:
-        json.dump(result, f, ensure_ascii=False, indent=2)
+    result["http_connections"] = feishu_client.connection_stats()
+    result_file = save_result(result, output_dir)
+
+    if "document_id" not in result:
+        # 创建失败，已保存失败结果
+        sys.exit(1)
 
     # 打印摘要
+    folder_token = config.get('FEISHU_DEFAULT_FOLDER', '')
     print()
     print("=" * 70)
     print("操作完成")
@@ -500,12 +608,16 @@ def main():
     print(f"文档URL: {result['document_url']}")
     print(f"Token 模式: {result['token_mode']}")
     print(f"目录位置: {folder_token if folder_token else '根目录'}")
-    if use_user_token_mode:
+    if result["token_mode"] == "user_access_token":
         print(f"用户完全控制: {result['permission']['user_has_full_control']} (User Token 模式，无需权限转移)")
     else:
         print(f"协作者已添加: {result['permission']['collaborator_added']}")
-        print(f"所有权已转移: {result['permission']['owner_transferred']}")
+        if "--no-transfer" in sys.argv:
+            print("所有权已转移: 跳过（--no-transfer，块添加完成后再执行 --transfer）")
+        else:
+            print(f"所有权已转移: {result['permission']['owner_transferred']}")
         print(f"用户完全控制: {result['permission']['user_has_full_control']}")
+    http_metrics.print_summary(result["http_metrics"], "[feishu-doc-creator-with-permission]")
     print(f"\n输出文件: {result_file}")
     print(f"\n[OUTPUT] {result_file}")
 
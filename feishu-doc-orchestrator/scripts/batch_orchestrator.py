@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+飞书文档批量创建 - 批量编排脚本
+把一个目录（或 glob 匹配）下的所有 Markdown 文件转换为飞书文档
+
+每个文件走进程内流水线（见 orchestrator.run_in_process），多个文件由有界线程池并行处理。
+所有工作线程共用同一个 HTTP 会话、token 缓存和按端点划分的全局限流器。
+"""
+
+import io
+import sys
+import json
+import glob
+import time
+import contextvars
+from pathlib import Path
+from datetime import datetime
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import orchestrator
+
+# 添加公共模块路径
+COMMON_SCRIPT_DIR = Path(__file__).parent.parent.parent / "feishu-common" / "scripts"
+if str(COMMON_SCRIPT_DIR) not in sys.path:
+    sys.path.insert(0, str(COMMON_SCRIPT_DIR))
+
+import feishu_client
+import http_metrics
+import rate_limiter
+
+
+DEFAULT_WORKERS = 4
+
+
+class ContextOutputRouter:
+    """
+    按上下文分流 stdout
+
+    工作线程在 capture() 中运行时，子技能的 print 写入该文档自己的缓冲区，
+    不会与其他文档的输出交错；其余输出（进度行、汇总）照常写到终端。
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._buffer = contextvars.ContextVar("batch_output_buffer", default=None)
+
+    @contextmanager
+    def capture(self):
+        buffer = io.StringIO()
+        token = self._buffer.set(buffer)
+        try:
+            yield buffer
+        finally:
+            self._buffer.reset(token)
+
+    def write(self, text):
+        buffer = self._buffer.get()
+        if buffer is not None:
+            return buffer.write(text)
+        return self._stream.write(text)
+
+    def flush(self):
+        if self._buffer.get() is None:
+            self._stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+def get_option(name, default=None):
+    """读取 --name value 形式的命令行参数"""
+    if name in sys.argv:
+        index = sys.argv.index(name)
+        if index + 1 < len(sys.argv):
+            return sys.argv[index + 1]
+    return default
+
+
+def get_positional_args():
+    """位置参数（跳过 --flag 及带值参数的值）"""
+    args = []
+    skip_next = False
+    for arg in sys.argv[1:]:
+        if skip_next:
+            skip_next = False
+            continue
+        if arg in ("--workers", "--pages"):
+            skip_next = True
+            continue
+        if arg.startswith("--"):
+            continue
+        args.append(arg)
+    return args
+
+
+def collect_markdown_files(source):
+    """
+    收集待转换的 Markdown 文件
+
+    source 为目录时递归查找其中的 .md 文件，否则作为 glob 模式匹配（支持 **）
+    """
+    source_path = Path(source)
+    if source_path.is_dir():
+        files = source_path.rglob("*.md")
+    else:
+        files = (Path(p) for p in glob.glob(source, recursive=True))
+    return sorted(f for f in files if f.is_file() and f.suffix.lower() == ".md")
+
+
+def convert_one(index, md_file, batch_dir, output_dir, config, output_router, options):
+    """
+    转换单个文件，返回该文件的结果记录
+
+    options 为传给 orchestrator.run_in_process 的 persist / verify / use_cache / optimize_images；
+    子技能输出写入 batch_dir/logs/ 下的独立日志文件
+    """
+    doc_title = md_file.stem
+    run_name = f"{index:04d}-{md_file.stem}"
+    step_dirs = {
+        "parse": batch_dir / run_name / "step1_parse",
+        "create_with_permission": batch_dir / run_name / "step2_create_with_permission",
+        "add_blocks": batch_dir / run_name / "step3_add_blocks",
+        "verify": batch_dir / run_name / "step4_verify"
+    }
+    log_file = batch_dir / "logs" / f"{run_name}.log"
+
+    record = {
+        "source_file": str(md_file),
+        "title": doc_title,
+        "success": False,
+        "blocks": 0,
+        "log_file": str(log_file)
+    }
+
+    start_time = time.time()
+    with output_router.capture() as buffer:
+        try:
+            if options["persist"]:
+                for step_dir in step_dirs.values():
+                    step_dir.mkdir(parents=True, exist_ok=True)
+
+            pipeline_result = orchestrator.run_in_process(
+                md_file, doc_title, step_dirs, output_dir, config=config, **options
+            )
+
+            if pipeline_result is None:
+                record["error"] = "文档创建失败"
+            else:
+                doc_info = pipeline_result["doc_info"]
+                add_result = pipeline_result["add_result"]
+                record["document_id"] = doc_info["document_id"]
+                record["document_url"] = doc_info["document_url"]
+                record["blocks"] = add_result.get("total_blocks", 0)
+                record["request_count"] = add_result.get("request_count", 0)
+                record["success"] = add_result.get("success", False)
+                if not record["success"]:
+                    failed_blocks = add_result.get("failed_blocks", [])
+                    if failed_blocks:
+                        record["error"] = f"{len(failed_blocks)} 个块添加失败"
+                    else:
+                        record["error"] = "; ".join(add_result.get("errors", [])) or "块添加失败"
+        except Exception as e:
+            record["error"] = str(e)
+            print(f"[FAIL] {e}")
+
+    record["duration_seconds"] = round(time.time() - start_time, 2)
+
+    log_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(log_file, 'w', encoding='utf-8') as f:
+        f.write(buffer.getvalue())
+
+    return record
+
+
+def throughput(done_docs, done_blocks, elapsed):
+    """计算吞吐量：(文档/分钟, 块/秒)"""
+    if elapsed <= 0:
+        return 0.0, 0.0
+    return done_docs / elapsed * 60, done_blocks / elapsed
+
+
+def run_batch(md_files, batch_dir, output_dir, workers=DEFAULT_WORKERS, persist=False, verify=False,
+              use_cache=True, optimize_images=False):
+    """
+    用有界线程池批量转换文件
+
+    返回 batch_summary.json 的内容
+    """
+    modules = orchestrator.load_sub_skill_modules()
+    config = modules["creator_with_permission"].load_config()
+
+    # 每个文档最多同时有两个请求在途（块添加 + 后台权限管理）
+    feishu_client.configure(pool_size=max(workers * 2, feishu_client.DEFAULT_POOL_SIZE))
+
+    options = {"persist": persist, "verify": verify, "use_cache": use_cache, "optimize_images": optimize_images}
+    output_router = ContextOutputRouter(sys.stdout)
+    sys.stdout = output_router
+
+    total = len(md_files)
+    records = []
+    done_blocks = 0
+    failed = 0
+    started_at = datetime.now()
+    start_time = time.time()
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(contextvars.copy_context().run, convert_one,
+                                index, md_file, batch_dir, output_dir, config,
+                                output_router, options)
+                for index, md_file in enumerate(md_files, 1)
+            ]
+
+            for future in as_completed(futures):
+                record = future.result()
+                records.append(record)
+                done_blocks += record["blocks"]
+                if not record["success"]:
+                    failed += 1
+
+                docs_per_min, blocks_per_sec = throughput(len(records), done_blocks, time.time() - start_time)
+                status = "[OK]" if record["success"] else "[FAIL]"
+                print(f"[{len(records):>{len(str(total))}}/{total}] {status} {record['title']} "
+                      f"({record['blocks']} 块, {record['duration_seconds']:.1f}s) | "
+                      f"{docs_per_min:.1f} 文档/分钟, {blocks_per_sec:.1f} 块/秒, 失败 {failed}")
+                if not record["success"]:
+                    print(f"         {record.get('error', '')}  日志: {record['log_file']}")
+    finally:
+        sys.stdout = output_router._stream
+
+    duration = time.time() - start_time
+    docs_per_min, blocks_per_sec = throughput(total, done_blocks, duration)
+    records.sort(key=lambda r: r["source_file"])
+
+    return {
+        "started_at": started_at.isoformat(),
+        "completed_at": datetime.now().isoformat(),
+        "workers": workers,
+        "total_files": total,
+        "succeeded": total - failed,
+        "failed": failed,
+        "total_blocks": done_blocks,
+        "duration_seconds": round(duration, 2),
+        "docs_per_minute": round(docs_per_min, 2),
+        "blocks_per_second": round(blocks_per_sec, 2),
+        "http_connections": feishu_client.connection_stats(),
+        "rate_limits": rate_limiter.limiter_stats(),
+        "http_metrics": http_metrics.snapshot(),
+        "failures": [r for r in records if not r["success"]],
+        "documents": records
+    }
+
+
+def browser_verify_batch(summary, batch_dir, pages=None, screenshots=False):
+    """
+    转换完成后在同一个浏览器上下文中打开所有成功创建的文档页面
+
+    结果写入 <批次目录>/browser_verify/batch_verify_result.json，汇总写入 summary["browser_verify"]
+    """
+    # 验证子技能目录已由 load_sub_skill_modules 加入 sys.path
+    import batch_verifier
+
+    docs = [record for record in summary["documents"] if record["success"]]
+    verify_dir = batch_dir / "browser_verify"
+    verify_dir.mkdir(parents=True, exist_ok=True)
+    result = batch_verifier.verify_documents(docs, verify_dir, pages=pages, screenshots=screenshots)
+
+    result_file = verify_dir / "batch_verify_result.json"
+    with open(result_file, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+    summary["browser_verify"] = {key: value for key, value in result.items() if key != "documents"}
+    summary["browser_verify"]["result_file"] = str(result_file)
+    return result
+
+
+def main():
+    """主函数"""
+    args = get_positional_args()
+
+    if len(args) < 1:
+        print("用法: python batch_orchestrator.py <目录或glob> [批次名称] [--workers N] [--verify] [--persist] [--no-cache] [--optimize-images] [--browser-verify [--pages N] [--screenshots]]")
+        print()
+        print("参数说明:")
+        print("  目录或glob   - Markdown 文件所在目录（递归查找 .md），或 glob 模式如 \"docs/**/*.md\"")
+        print("  批次名称     - 本次批量运行的文件夹名称（可选，默认使用时间戳）")
+        print(f"  --workers N  - 并行处理的文档数（默认 {DEFAULT_WORKERS}）")
+        print("  --verify     - 对每个文档通过接口比较文档结构与解析结果（默认关闭）")
+        print("  --persist    - 保存每个文档各步骤的中间结果文件")
+        print("  --no-cache   - 不使用 Markdown 解析缓存")
+        print("  --optimize-images - 上传前缩小并重新压缩过大的图片（需要 Pillow）")
+        print("  --browser-verify  - 全部转换完成后用同一个浏览器打开每个文档页面验证（需要已保存的登录状态）")
+        print("  --pages N    - 浏览器验证同时打开的页面数（默认 4）")
+        print("  --screenshots - 浏览器验证时保存缩小的截图")
+        print()
+        print("示例:")
+        print("  python batch_orchestrator.py docs/")
+        print("  python batch_orchestrator.py \"docs/**/*.md\" nightly --workers 8")
+        sys.exit(1)
+
+    workers = int(get_option("--workers", DEFAULT_WORKERS))
+    if workers < 1:
+        print("错误: --workers 必须大于 0")
+        sys.exit(1)
+
+    md_files = collect_markdown_files(args[0])
+    if not md_files:
+        print(f"错误: 没有找到 Markdown 文件: {args[0]}")
+        sys.exit(1)
+
+    batch_name = args[1] if len(args) >= 2 else datetime.now().strftime("batch-%Y-%m-%d-%H%M%S")
+
+    # 与 orchestrator.py 相同的项目根目录和日志目录
+    project_root = Path(__file__).parent.parent.parent.parent
+    batch_dir = project_root / "workflow" / "feishu-batch-runs" / batch_name
+    output_dir = project_root / "workflow" / "feishu-logs"
+    batch_dir.mkdir(parents=True, exist_ok=True)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    persist = "--persist" in sys.argv
+    verify = "--verify" in sys.argv
+    use_cache = "--no-cache" not in sys.argv
+    optimize_images = "--optimize-images" in sys.argv
+    browser_verify = "--browser-verify" in sys.argv
+    pages = get_option("--pages")
+
+    print("="*70)
+    print("Feishu Document Creation - Batch Orchestrator")
+    print("="*70)
+    print(f"输入: {args[0]}")
+    print(f"文件数: {len(md_files)}")
+    print(f"并行数: {workers}")
+    print(f"文档验证: {'开启' if verify else '关闭'}")
+    print(f"页面验证: {'开启' if browser_verify else '关闭'}")
+    print(f"批次目录: {batch_dir}")
+    print(f"日志目录: {output_dir}")
+    print()
+
+    summary = run_batch(md_files, batch_dir, output_dir, workers=workers, persist=persist, verify=verify,
+                        use_cache=use_cache, optimize_images=optimize_images)
+    summary["batch_name"] = batch_name
+    summary["source"] = args[0]
+
+    if browser_verify:
+        print("\n" + "="*70)
+        print("页面验证")
+        print("="*70)
+        browser_verify_batch(summary, batch_dir, pages=int(pages) if pages else None,
+                             screenshots="--screenshots" in sys.argv)
+
+    summary_file = batch_dir / "batch_summary.json"
+    with open(summary_file, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+
+    print("\n" + "="*70)
+    print("批量转换完成")
+    print("="*70)
+    print(f"成功: {summary['succeeded']}/{summary['total_files']}，失败: {summary['failed']}")
+    print(f"耗时: {summary['duration_seconds']:.2f} 秒")
+    print(f"吞吐: {summary['docs_per_minute']:.1f} 文档/分钟, {summary['blocks_per_second']:.1f} 块/秒")
+    for host, conn in summary["http_connections"].items():
+        print(f"连接 {host}: {conn['connections']} 个连接, {conn['requests']} 次请求")
+    for name, limit in summary["rate_limits"].items():
+        print(f"限流 {name}: {limit['rate']}/s, 触发 {limit['throttled']} 次")
+    orchestrator.export_http_metrics(summary["http_metrics"])
+
+    if summary["failures"]:
+        print()
+        print("失败的文件:")
+        for record in summary["failures"]:
+            print(f"  - {record['source_file']}: {record.get('error', '')}")
+            print(f"    日志: {record['log_file']}")
+
+    if browser_verify:
+        verify_summary = summary["browser_verify"]
+        print(f"页面验证: {verify_summary['verified']}/{verify_summary['total']} 通过")
+
+    print()
+    print(f"[提示] 批次汇总: {summary_file}")
+
+    if summary["failed"] or (browser_verify and not summary["browser_verify"]["success"]):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
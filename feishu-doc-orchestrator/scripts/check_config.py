@@ -11,8 +11,8 @@ from pathlib import Path
 # 添加技能目录到路径
 sys.path.insert(0, '.claude/skills/feishu-doc-creator-with-permission/scripts')
 
-from doc_creator_with_permission import load_config, get_access_token
-import requests
+from doc_creator_with_permission import load_config
+import token_cache
 
 
 def check_config():
@@ -83,7 +83,8 @@ def check_config():
     if config.get('FEISHU_APP_ID') and config.get('FEISHU_APP_SECRET'):
         try:
             print("  正在测试API连接...")
-            token = get_access_token(config, use_user_token=False)
+            # 强制刷新，确保验证的是当前配置中的应用凭证而不是缓存
+            token = token_cache.get_tenant_access_token(config, force_refresh=True)
             if token:
                 print("  [OK] API连接正常")
                 print("     应用凭证有效")
@@ -11,7 +11,14 @@ import json
 import time
 from pathlib import Path
 from datetime import datetime
-import requests
+
+# 添加公共模块路径
+COMMON_SCRIPT_DIR = Path(__file__).parent.parent.parent / "feishu-common" / "scripts"
+if str(COMMON_SCRIPT_DIR) not in sys.path:
+    sys.path.insert(0, str(COMMON_SCRIPT_DIR))
+
+import feishu_client
+import token_cache
 
 
 def load_config():
@@ -32,19 +39,8 @@ def load_config():
 
 
 def get_access_token(config):
-    """获取 tenant_access_token"""
-    url = f"{config['FEISHU_API_DOMAIN']}/open-apis/auth/v3/tenant_access_token/internal"
-    headers = {"Content-Type": "application/json"}
-    payload = {
-        "app_id": config['FEISHU_APP_ID'],
-        "app_secret": config['FEISHU_APP_SECRET']
-    }
-    response = requests.post(url, json=payload, headers=headers)
-    result = response.json()
-    if result.get("code") == 0:
-        return result["tenant_access_token"]
-    else:
-        raise Exception(f"获取 token 失败: {result}")
+    """获取 tenant_access_token（跨进程缓存，过期前自动刷新）"""
+    return token_cache.get_tenant_access_token(config)
 
 
 def create_document(token, config, title):
@@ -60,7 +56,7 @@ def create_document(token, config, title):
         "folder_token": config.get('FEISHU_DEFAULT_FOLDER', '')
     }
 
-    response = requests.post(url, json=payload, headers=headers)
+    response = feishu_client.post(url, json=payload, headers=headers)
     result = response.json()
 
     if result.get("code") == 0:
@@ -86,7 +82,7 @@ def add_collaborator(token, config, document_id, user_id, user_type, perm):
         "perm": perm
     }
 
-    response = requests.post(url, json=payload, headers=headers)
+    response = feishu_client.post(url, json=payload, headers=headers)
     result = response.json()
 
     if result.get("code") == 0:
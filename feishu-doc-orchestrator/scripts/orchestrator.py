@@ -7,34 +7,53 @@
 """
 
 import sys
+import time
 import subprocess
+import importlib
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 import json
 from pathlib import Path
 from datetime import datetime
 
+# 添加公共模块路径
+COMMON_SCRIPT_DIR = Path(__file__).parent.parent.parent / "feishu-common" / "scripts"
+if str(COMMON_SCRIPT_DIR) not in sys.path:
+    sys.path.insert(0, str(COMMON_SCRIPT_DIR))
+
+import http_metrics
+
 
 # 子技能脚本路径
 SCRIPT_DIR = Path(__file__).parent.parent.parent
 SUB_SKILLS = {
     "parser": SCRIPT_DIR / "feishu-md-parser" / "scripts" / "md_parser.py",
+    "image_preprocessor": SCRIPT_DIR / "feishu-image-preprocessor" / "scripts" / "image_preprocessor.py",
     "creator_with_permission": SCRIPT_DIR / "feishu-doc-creator-with-permission" / "scripts" / "doc_creator_with_permission.py",
     "block_adder": SCRIPT_DIR / "feishu-block-adder" / "scripts" / "block_adder.py",
     "verifier": SCRIPT_DIR / "feishu-doc-verifier" / "scripts" / "doc_verifier.py",
     "logger": SCRIPT_DIR / "feishu-logger" / "scripts" / "logger.py"
 }
 
+# 子进程模式下各步骤耗时的文件（工作流目录中），由日志记录步骤读取
+STEP_TIMINGS_FILE = "step_timings.json"
+
+
+def run_step_process(script, args):
+    """启动子进程运行子技能脚本，返回 (命令, CompletedProcess, 耗时秒数)"""
+    cmd = [sys.executable, str(script)] + args
+    start = time.perf_counter()
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    return cmd, result, round(time.perf_counter() - start, 3)
 
-def run_step(name, script, args):
-    """运行单个步骤"""
+
+def report_step(name, cmd, result):
+    """打印步骤输出，返回是否成功"""
     print(f"\n{'='*70}")
     print(f"[步骤] {name}")
     print(f"{'='*70}")
-
-    cmd = [sys.executable, str(script)] + args
     print(f"命令: {' '.join(cmd)}")
 
-    result = subprocess.run(cmd, capture_output=True, text=True)
-
     # 打印输出
     if result.stdout:
         print(result.stdout)
@@ -49,20 +68,314 @@ def run_step(name, script, args):
     return True
 
 
+def run_step(name, script, args, timings=None, step=None):
+    """运行单个步骤；timings 不为空时把耗时记录到 timings[step]"""
+    cmd, result, duration = run_step_process(script, args)
+    if timings is not None:
+        timings[step] = duration
+    return report_step(name, cmd, result)
+
+
+def run_steps_concurrently(steps, timings=None):
+    """
+    并行运行多个互不依赖的步骤
+
+    steps: [(名称, 脚本, 参数, 步骤键), ...]
+    子进程同时运行，输出按 steps 的顺序打印，避免交错。返回每个步骤是否成功
+    """
+    with ThreadPoolExecutor(max_workers=len(steps)) as executor:
+        futures = [executor.submit(run_step_process, script, args) for _, script, args, _ in steps]
+        outcomes = [future.result() for future in futures]
+    if timings is not None:
+        for (_, _, _, step), (_, _, duration) in zip(steps, outcomes):
+            timings[step] = duration
+    return [report_step(name, cmd, result) for (name, _, _, _), (cmd, result, _) in zip(steps, outcomes)]
+
+
+def timed(timings, step, fn, *args, **kwargs):
+    """运行 fn，并把耗时（秒）记录到 timings[step]"""
+    start = time.perf_counter()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        timings[step] = round(time.perf_counter() - start, 3)
+
+
+def load_sub_skill_modules():
+    """
+    把子技能脚本目录加入 sys.path，并将子技能作为模块导入（进程内模式）
+
+    返回：{子技能名称: 模块}
+    """
+    modules = {}
+    for name, script in SUB_SKILLS.items():
+        script_dir = str(script.parent)
+        if script_dir not in sys.path:
+            sys.path.insert(0, script_dir)
+        modules[name] = importlib.import_module(script.stem)
+    return modules
+
+
+def submit_in_context(executor, fn, *args):
+    """提交任务到线程池，并让任务在调用方的 contextvars 上下文中运行（批量模式按上下文收集输出）"""
+    return executor.submit(contextvars.copy_context().run, fn, *args)
+
+
+def run_in_process(md_file, doc_title, step_dirs, output_dir, persist=False, verify=True, config=None,
+                   use_cache=True, optimize_images=False, browser_verify=False):
+    """
+    进程内运行五个步骤：子技能作为模块导入，数据结构直接在内存中传递
+
+    省去每一步启动 Python 解释器、重新导入 requests、重新读取配置和 token、
+    以及 JSON 文件往返序列化的开销。persist=True 时仍把各步骤结果写入工作流目录。
+    verify=False 时跳过第四步；config 为空时读取配置文件；use_cache=False 时不使用解析缓存；
+    optimize_images=True 时压缩超过最大边长的图片（否则图片预处理只读取尺寸）。
+    第四步默认通过文档块接口比较文档结构与解析结果；browser_verify=True 时改用 Playwright 打开页面。
+
+    各步骤耗时记录在日志记录的 steps 中（parse / preprocess / create / permissions / add_blocks / transfer / verify / total）。
+
+    返回：{"doc_info", "add_result", "verify_result", "log_entry"}，
+    文档创建失败时返回 None
+    """
+    modules = load_sub_skill_modules()
+    parser = modules["parser"]
+    preprocessor = modules["image_preprocessor"]
+    creator = modules["creator_with_permission"]
+    adder = modules["block_adder"]
+    verifier = modules["verifier"]
+    logger = modules["logger"]
+
+    # 配置只读取一次，各步骤共用
+    if config is None:
+        config = creator.load_config()
+    use_user_token_mode = creator.choose_token_mode(doc_title)
+    timings = {}
+    start_time = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        # ========== 第一步、第二步并行：Markdown 解析 + 文档创建 ==========
+        # 文档创建只依赖标题，与解析互不依赖；在块添加之前汇合
+        print(f"\n{'='*70}\n[步骤] 第一步 + 第二步（并行）：Markdown 解析 / 文档创建\n{'='*70}")
+        parse_future = submit_in_context(executor, timed, timings, "parse",
+                                         parser.parse_markdown_file, md_file, False, use_cache)
+        create_future = submit_in_context(executor, timed, timings, "create",
+                                          creator.create_document_step, doc_title, config, use_user_token_mode)
+
+        parse_result = parse_future.result()
+        print(f"[OK] 解析完成: {parse_result['metadata']['total_blocks']} 个块")
+
+        # 图片预处理在文档创建期间进行：读取尺寸，按需压缩
+        preprocess_result = timed(timings, "preprocess", preprocessor.preprocess_blocks,
+                                  parse_result["blocks"], optimize=optimize_images)
+        if persist:
+            parser.write_parse_output(parse_result, step_dirs["parse"])
+            with open(step_dirs["parse"] / "preprocess_result.json", 'w', encoding='utf-8') as f:
+                json.dump(preprocess_result, f, ensure_ascii=False, indent=2)
+
+        doc_info = create_future.result()
+
+        if "document_id" not in doc_info:
+            print(f"[FAIL] 文档创建失败: {doc_info['errors']}")
+            if persist:
+                creator.save_result(doc_info, step_dirs["create_with_permission"])
+            return None
+
+        # ========== 添加协作者与块添加并行 ==========
+        # 所有权转移会把应用降为只读，放到块添加完成之后
+        permission_future = submit_in_context(executor, timed, timings, "permissions",
+                                              creator.add_collaborator, doc_info, config)
+
+        # ========== 第三步：块添加 ==========
+        print(f"\n{'='*70}\n[步骤] 第三步：块添加\n{'='*70}")
+        try:
+            journal_path = step_dirs["add_blocks"] / "progress.jsonl" if persist else None
+            add_result = timed(timings, "add_blocks", adder.add_blocks, parse_result["blocks"],
+                               doc_info["document_id"], config, journal_path=journal_path)
+        except Exception as e:
+            print(f"[WARN] 块添加失败，但继续执行后续步骤: {e}")
+            add_result = {"success": False, "document_id": doc_info["document_id"], "errors": [str(e)]}
+        if persist:
+            adder.save_add_result(add_result, step_dirs["add_blocks"])
+
+        permission_future.result()
+        timed(timings, "transfer", creator.transfer_ownership, doc_info, config)
+        if persist:
+            creator.save_result(doc_info, step_dirs["create_with_permission"])
+
+    # ========== 第四步：文档验证 ==========
+    print(f"\n{'='*70}\n[步骤] 第四步：文档验证\n{'='*70}")
+    if verify:
+        verify_result = timed(timings, "verify", verifier.verify_document,
+                              doc_info, step_dirs["verify"] if persist else None,
+                              blocks=parse_result["blocks"], config=config, browser=browser_verify)
+        if persist:
+            verifier.save_verify_result(verify_result, step_dirs["verify"])
+    else:
+        print("[SKIP] 文档验证已关闭")
+        verify_result = {"success": False, "skipped": True}
+
+    # ========== 第五步：日志记录 ==========
+    print(f"\n{'='*70}\n[步骤] 第五步：日志记录\n{'='*70}")
+    timings["total"] = round(time.perf_counter() - start_time, 3)
+    log_entry = logger.build_log_entry(parse_result, doc_info, add_result, verify_result,
+                                       source_file=str(md_file), step_timings=timings)
+    db_file = logger.append_log_entry(log_entry, output_dir)
+    logger.print_log_summary(log_entry, db_file)
+
+    return {
+        "doc_info": doc_info,
+        "add_result": add_result,
+        "verify_result": verify_result,
+        "log_entry": log_entry
+    }
+
+
+def merge_step_metrics(step_dirs):
+    """子进程模式：合并各步骤结果文件中的 http_metrics"""
+    snapshots = []
+    for result_file in (step_dirs["create_with_permission"] / "doc_with_permission.json",
+                        step_dirs["add_blocks"] / "add_result.json",
+                        step_dirs["verify"] / "verify_result.json"):
+        if result_file.exists():
+            with open(result_file, 'r', encoding='utf-8') as f:
+                snapshots.append(json.load(f).get("http_metrics"))
+    return http_metrics.merge(*snapshots)
+
+
+def export_http_metrics(metrics, prefix="[feishu-doc-orchestrator]"):
+    """打印接口耗时摘要；设置了 FEISHU_HTTP_METRICS_FILE 时写入 Prometheus 文本文件"""
+    http_metrics.print_summary(metrics, prefix)
+    metrics_file = http_metrics.get_prometheus_file()
+    if metrics_file is not None:
+        http_metrics.write_prometheus(metrics_file, metrics)
+        print(f"{prefix} HTTP metrics: {metrics_file}")
+
+
+def run_with_subprocesses(md_file, doc_title, workflow_dir, step_dirs, output_dir, use_cache=True,
+                          optimize_images=False, browser_verify=False):
+    """
+    每个步骤启动独立的子进程运行，步骤之间通过工作流目录中的 JSON 文件传递数据
+
+    返回：doc_with_permission.json 的内容，失败时返回 None
+    """
+    # ========== 第一步、第二步并行：Markdown 解析 + 文档创建+添加协作者 ==========
+    # 文档创建只依赖标题，两个子进程同时运行，在块添加之前汇合。
+    # 所有权转移会把应用降为只读，这里跳过（--no-transfer），在块添加完成后单独执行
+    timings = {}
+    start_time = time.perf_counter()
+    parse_ok, create_ok = run_steps_concurrently([
+        ("第一步：Markdown 解析",
+         SUB_SKILLS["parser"],
+         [str(md_file), str(step_dirs["parse"])] + ([] if use_cache else ["--no-cache"]),
+         "parse"),
+        ("第二步：文档创建+添加协作者",
+         SUB_SKILLS["creator_with_permission"],
+         [doc_title, str(step_dirs["create_with_permission"]), "--no-transfer"],
+         "create")
+    ], timings)
+    if not (parse_ok and create_ok):
+        return None
+
+    blocks_file = step_dirs["parse"] / "blocks.json"
+    if not blocks_file.exists():
+        print(f"[FAIL] blocks.json 未生成: {blocks_file}")
+        return None
+
+    # 图片预处理：原地更新 step1_parse/blocks.json，失败时使用未处理的块继续
+    if not run_step(
+        "第一步（续）：图片预处理",
+        SUB_SKILLS["image_preprocessor"],
+        [str(blocks_file), str(step_dirs["parse"])] + (["--optimize"] if optimize_images else []),
+        timings, "preprocess"
+    ):
+        print("[WARN] 图片预处理失败，但继续执行后续步骤")
+
+    doc_info_file = step_dirs["create_with_permission"] / "doc_with_permission.json"
+    if not doc_info_file.exists():
+        print(f"[FAIL] doc_with_permission.json 未生成: {doc_info_file}")
+        return None
+
+    # ========== 第三步：块添加 ==========
+    if not run_step(
+        "第三步：块添加",
+        SUB_SKILLS["block_adder"],
+        [str(blocks_file), str(doc_info_file), str(step_dirs["add_blocks"])],
+        timings, "add_blocks"
+    ):
+        print("[WARN] 块添加失败，但继续执行后续步骤")
+
+    # ========== 第三步（续）：转移所有权 ==========
+    # 块写入完成后再转移，应用保留只读权限；结果写回 doc_with_permission.json
+    if not run_step(
+        "第三步（续）：转移所有权",
+        SUB_SKILLS["creator_with_permission"],
+        ["--transfer", str(doc_info_file)],
+        timings, "transfer"
+    ):
+        print("[WARN] 所有权转移失败，但继续执行后续步骤")
+
+    # 读取文档信息
+    with open(doc_info_file, 'r', encoding='utf-8') as f:
+        doc_info = json.load(f)
+    permission = doc_info.get("permission", {})
+
+    print(f"\n[权限状态]")
+    print(f"  协作者添加: {permission.get('collaborator_added', False)}")
+    print(f"  所有权转移: {permission.get('owner_transferred', False)}")
+    print(f"  用户完全控制: {permission.get('user_has_full_control', False)}")
+
+    # ========== 第四步：文档验证 ==========
+    if not run_step(
+        "第四步：文档验证",
+        SUB_SKILLS["verifier"],
+        [str(doc_info_file), str(step_dirs["verify"]), str(blocks_file)] + (["--browser"] if browser_verify else []),
+        timings, "verify"
+    ):
+        print("[WARN] 文档验证失败，但继续执行后续步骤")
+
+    # 各步骤耗时交给日志记录步骤
+    timings["total"] = round(time.perf_counter() - start_time, 3)
+    with open(workflow_dir / STEP_TIMINGS_FILE, 'w', encoding='utf-8') as f:
+        json.dump(timings, f, ensure_ascii=False, indent=2)
+
+    # ========== 第五步：日志记录 ==========
+    if not run_step(
+        "第五步：日志记录",
+        SUB_SKILLS["logger"],
+        [str(workflow_dir), str(output_dir)]
+    ):
+        print("[WARN] 日志记录失败")
+
+    return doc_info
+
+
 def main():
     """主函数"""
-    if len(sys.argv) < 2:
-        print("用法: python orchestrator.py <markdown文件> [文档标题] [运行名称]")
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    in_process = "--in-process" in sys.argv
+    persist = "--persist" in sys.argv or not in_process
+    use_cache = "--no-cache" not in sys.argv
+    optimize_images = "--optimize-images" in sys.argv
+    browser_verify = "--browser-verify" in sys.argv
+
+    if len(args) < 1:
+        print("用法: python orchestrator.py <markdown文件> [文档标题] [运行名称] [--in-process [--persist]] [--no-cache] [--optimize-images] [--browser-verify]")
         print()
         print("参数说明:")
         print("  markdown文件  - 要转换的 Markdown 文件路径")
         print("  文档标题      - 飞书文档标题（可选，默认使用文件名）")
         print("  运行名称      - 本次运行的文件夹名称（可选，默认使用时间戳）")
+        print("  --in-process  - 进程内运行：子技能作为模块导入，数据在内存中传递")
+        print("  --persist     - 进程内模式下仍保存各步骤的中间结果文件")
+        print("  --no-cache    - 不使用 Markdown 解析缓存")
+        print("  --optimize-images - 上传前缩小并重新压缩过大的图片（需要 Pillow）")
+        print("  --browser-verify  - 使用 Playwright 打开文档页面验证（默认通过接口比较文档结构）")
         print()
         print("示例:")
         print("  python orchestrator.py input.md")
         print("  python orchestrator.py input.md \"我的文档\"")
         print("  python orchestrator.py input.md \"我的文档\" \"test-run-01\"")
+        print("  python orchestrator.py input.md \"我的文档\" --in-process")
         print()
         print("工作流目录结构:")
         print("  workflow/run-2026-02-10-143022/")
@@ -72,20 +385,20 @@ def main():
         print("  └── step4_verify/")
         sys.exit(1)
 
-    md_file = Path(sys.argv[1])
+    md_file = Path(args[0])
     if not md_file.exists():
         print(f"错误: 文件不存在: {md_file}")
         sys.exit(1)
 
     # 文档标题
-    if len(sys.argv) >= 3:
-        doc_title = sys.argv[2]
+    if len(args) >= 2:
+        doc_title = args[1]
     else:
         doc_title = md_file.stem  # 使用文件名作为标题
 
     # 运行名称（用于创建独立子文件夹）
-    if len(sys.argv) >= 4:
-        run_name = sys.argv[3]
+    if len(args) >= 3:
+        run_name = args[2]
     else:
         # 默认使用时间戳：run-YYYY-MM-DD-HHMMSS
         run_name = datetime.now().strftime("run-%Y-%m-%d-%H%M%S")
@@ -105,16 +418,17 @@ def main():
     print("="*70)
     print(f"输入文件: {md_file}")
     print(f"文档标题: {doc_title}")
+    print(f"运行模式: {'进程内' if in_process else '子进程'}{'（保存中间结果）' if in_process and persist else ''}")
     print(f"运行名称: {run_name}")
-    print(f"工作流目录: {workflow_dir}")
+    if persist:
+        print(f"工作流目录: {workflow_dir}")
     print(f"日志目录: {output_dir}")
     print()
 
-    # 确保工作流目录和输出目录存在
-    workflow_base_dir.mkdir(parents=True, exist_ok=True)
+    # 确保输出目录存在
     output_dir.mkdir(parents=True, exist_ok=True)
 
-    # 创建工作流目录
+    # 工作流目录
     step_dirs = {
         "parse": workflow_dir / "step1_parse",
         "create_with_permission": workflow_dir / "step2_create_with_permission",
@@ -122,73 +436,35 @@ def main():
         "verify": workflow_dir / "step4_verify"
     }
 
-    for step_dir in step_dirs.values():
-        step_dir.mkdir(parents=True, exist_ok=True)
+    if persist:
+        for step_dir in step_dirs.values():
+            step_dir.mkdir(parents=True, exist_ok=True)
 
     # 记录开始时间
     start_time = datetime.now()
 
-    # ========== 第一步：Markdown 解析 ==========
-    if not run_step(
-        "第一步：Markdown 解析",
-        SUB_SKILLS["parser"],
-        [str(md_file), str(step_dirs["parse"])]
-    ):
-        sys.exit(1)
-
-    blocks_file = step_dirs["parse"] / "blocks.json"
-    if not blocks_file.exists():
-        print(f"[FAIL] blocks.json 未生成: {blocks_file}")
-        sys.exit(1)
+    if in_process:
+        with http_metrics.collect() as run_metrics:
+            pipeline_result = run_in_process(md_file, doc_title, step_dirs, output_dir, persist=persist,
+                                             use_cache=use_cache, optimize_images=optimize_images,
+                                             browser_verify=browser_verify)
+        doc_info = pipeline_result["doc_info"] if pipeline_result else None
+        metrics = run_metrics.snapshot()
+    else:
+        doc_info = run_with_subprocesses(md_file, doc_title, workflow_dir, step_dirs, output_dir,
+                                         use_cache=use_cache, optimize_images=optimize_images,
+                                         browser_verify=browser_verify)
+        metrics = merge_step_metrics(step_dirs)
 
-    # ========== 第二步：文档创建+权限管理（原子操作）==========
-    if not run_step(
-        "第二步：文档创建+权限管理（原子操作）",
-        SUB_SKILLS["creator_with_permission"],
-        [doc_title, str(step_dirs["create_with_permission"])]
-    ):
-        sys.exit(1)
+    print()
+    export_http_metrics(metrics)
 
-    doc_info_file = step_dirs["create_with_permission"] / "doc_with_permission.json"
-    if not doc_info_file.exists():
-        print(f"[FAIL] doc_with_permission.json 未生成: {doc_info_file}")
+    if doc_info is None:
         sys.exit(1)
 
-    # 读取文档信息
-    with open(doc_info_file, 'r', encoding='utf-8') as f:
-        doc_info = json.load(f)
     doc_url = doc_info["document_url"]
     permission = doc_info.get("permission", {})
 
-    print(f"\n[权限状态]")
-    print(f"  协作者添加: {permission.get('collaborator_added', False)}")
-    print(f"  所有权转移: {permission.get('owner_transferred', False)}")
-    print(f"  用户完全控制: {permission.get('user_has_full_control', False)}")
-
-    # ========== 第三步：块添加 ==========
-    if not run_step(
-        "第三步：块添加",
-        SUB_SKILLS["block_adder"],
-        [str(blocks_file), str(doc_info_file), str(step_dirs["add_blocks"])]
-    ):
-        print("[WARN] 块添加失败，但继续执行后续步骤")
-
-    # ========== 第四步：文档验证 ==========
-    if not run_step(
-        "第四步：文档验证",
-        SUB_SKILLS["verifier"],
-        [str(doc_info_file), str(step_dirs["verify"])]
-    ):
-        print("[WARN] 文档验证失败，但继续执行后续步骤")
-
-    # ========== 第五步：日志记录 ==========
-    if not run_step(
-        "第五步：日志记录",
-        SUB_SKILLS["logger"],
-        [str(workflow_dir), str(output_dir)]
-    ):
-        print("[WARN] 日志记录失败")
-
     # 完成
     end_time = datetime.now()
     duration = (end_time - start_time).total_seconds()
@@ -198,7 +474,8 @@ def main():
     print("="*70)
     print(f"文档 URL: {doc_url}")
     print(f"耗时: {duration:.2f} 秒")
-    print(f"运行目录: {workflow_dir}")
+    if persist:
+        print(f"运行目录: {workflow_dir}")
     print()
     print("权限状态:")
     print(f"  协作者添加: {'[OK]' if permission.get('collaborator_added') else '[FAIL]'}")
@@ -206,16 +483,17 @@ def main():
     print(f"  用户完全控制: {'[OK]' if permission.get('user_has_full_control') else '[FAIL]'}")
     print()
     print("日志文件:")
-    print(f"  - {output_dir / 'CREATED_DOCS.md'}")
-    print(f"  - {output_dir / 'created_docs.json'}")
-    print()
-    print("本次运行工作流文件:")
-    print(f"  - {workflow_dir / 'step1_parse/blocks.json'}")
-    print(f"  - {workflow_dir / 'step2_create_with_permission/doc_with_permission.json'}")
-    print(f"  - {workflow_dir / 'step3_add_blocks/add_result.json'}")
-    print(f"  - {workflow_dir / 'step4_verify/verify_result.json'}")
+    print(f"  - {output_dir / 'run_log.db'}")
+    print(f"  （生成 Markdown 报告: python {SUB_SKILLS['logger']} --report {output_dir}）")
     print()
-    print(f"[提示] 所有工作流数据保存在: {workflow_base_dir}")
+    if persist:
+        print("本次运行工作流文件:")
+        print(f"  - {workflow_dir / 'step1_parse/blocks.json'}")
+        print(f"  - {workflow_dir / 'step2_create_with_permission/doc_with_permission.json'}")
+        print(f"  - {workflow_dir / 'step3_add_blocks/add_result.json'}")
+        print(f"  - {workflow_dir / 'step4_verify/verify_result.json'}")
+        print()
+        print(f"[提示] 所有工作流数据保存在: {workflow_base_dir}")
     print(f"[提示] 日志文件保存在: {output_dir}")
 
 
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+批量页面验证 - 文档验证子技能的浏览器批量模式
+只启动一次浏览器：所有文档共用同一个持久化上下文（登录状态），
+以有界数量的并发页面打开文档，等待文档内容渲染完成而不是固定等待
+输出：batch_verify_result.json
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+from pathlib import Path
+from datetime import datetime
+
+import doc_verifier
+
+
+# 同时打开的页面数
+DEFAULT_PAGES = 4
+
+# 单个文档的导航等待时间（毫秒）
+NAVIGATION_TIMEOUT_MS = 60000
+
+# 截图使用较小的视口和 JPEG 压缩
+SCREENSHOT_VIEWPORT = {"width": 1280, "height": 800}
+SCREENSHOT_QUALITY = 60
+
+# 不截图时不加载的资源类型
+BLOCKED_RESOURCE_TYPES = {"image", "media", "font"}
+
+
+def get_page_count():
+    """并发页面数（环境变量 FEISHU_VERIFY_PAGES）"""
+    return max(1, int(os.environ.get("FEISHU_VERIFY_PAGES", DEFAULT_PAGES)))
+
+
+def is_login_url(url):
+    """是否被重定向到了登录页"""
+    url = url.lower()
+    return "login" in url or "accounts" in url
+
+
+async def verify_page(context, doc_info, semaphore, ready_selector, screenshot_dir=None):
+    """
+    在新页面中打开一个文档，等待文档块渲染后读取标题和渲染出的块数
+
+    返回单个文档的验证结果
+    """
+    result = {
+        "success": False,
+        "document_id": doc_info["document_id"],
+        "document_url": doc_info["document_url"],
+        "page_title": "",
+        "rendered_blocks": 0,
+        "screenshot": "",
+        "errors": []
+    }
+
+    async with semaphore:
+        start_time = time.time()
+        page = await context.new_page()
+        try:
+            if screenshot_dir is None:
+                await page.route("**/*", block_heavy_resources)
+
+            await page.goto(doc_info["document_url"], timeout=NAVIGATION_TIMEOUT_MS, wait_until="domcontentloaded")
+            if is_login_url(page.url):
+                raise Exception("登录状态已失效，请先运行 doc_verifier.py --browser 扫码登录")
+
+            await page.wait_for_selector(ready_selector, state="attached", timeout=doc_verifier.READY_TIMEOUT_MS)
+            try:
+                await page.wait_for_load_state("networkidle", timeout=doc_verifier.NETWORK_IDLE_TIMEOUT_MS)
+            except Exception:
+                # 文档页面保持长连接，网络可能一直不空闲；块已经渲染即可
+                pass
+
+            result["page_title"] = doc_verifier.clean_zero_width_chars(await page.title())
+            result["rendered_blocks"] = await page.locator(ready_selector).count()
+            result["success"] = bool(result["page_title"]) and result["rendered_blocks"] > 0
+
+            if screenshot_dir is not None:
+                screenshot_file = Path(screenshot_dir) / f"{doc_info['document_id']}.jpg"
+                await page.screenshot(path=str(screenshot_file), type="jpeg",
+                                      quality=SCREENSHOT_QUALITY, scale="css")
+                result["screenshot"] = str(screenshot_file)
+        except Exception as e:
+            result["errors"].append(f"验证异常: {e}")
+        finally:
+            await page.close()
+        result["duration_seconds"] = round(time.time() - start_time, 2)
+
+    status = "[OK]" if result["success"] else "[FAIL]"
+    print(f"  {status} {doc_info.get('title', doc_info['document_id'])} "
+          f"({result['rendered_blocks']} 块, {result['duration_seconds']:.1f}s)"
+          + (f" {result['errors'][0][:80]}" if result["errors"] else ""))
+    return result
+
+
+async def block_heavy_resources(route):
+    """不截图时跳过图片、视频和字体，只验证文档结构能渲染"""
+    if route.request.resource_type in BLOCKED_RESOURCE_TYPES:
+        await route.abort()
+    else:
+        await route.continue_()
+
+
+async def verify_all(docs, pages, screenshot_dir):
+    """启动一个持久化上下文，以最多 pages 个并发页面验证所有文档"""
+    from playwright.async_api import async_playwright
+
+    state_dir = doc_verifier.get_playwright_state_dir()
+    ready_selector = doc_verifier.get_ready_selector()
+    semaphore = asyncio.Semaphore(pages)
+
+    async with async_playwright() as p:
+        context = await p.chromium.launch_persistent_context(
+            user_data_dir=str(state_dir),
+            headless=True,
+            viewport=SCREENSHOT_VIEWPORT,
+            device_scale_factor=1,
+            timeout=NAVIGATION_TIMEOUT_MS
+        )
+        try:
+            return await asyncio.gather(*[
+                verify_page(context, doc_info, semaphore, ready_selector, screenshot_dir)
+                for doc_info in docs
+            ])
+        finally:
+            await context.close()
+
+
+def verify_documents(docs, output_dir=None, pages=None, screenshots=False):
+    """
+    在同一个浏览器上下文中批量验证文档页面，供批量编排器在进程内直接调用
+
+    docs 为 doc_info 列表（需要 document_id 和 document_url）；pages 为同时打开的页面数；
+    screenshots=True 时把截图保存到 output_dir/screenshots/。
+    需要已保存的登录状态（先用 doc_verifier.py --browser 扫码登录一次）。
+    返回 batch_verify_result.json 的内容
+    """
+    pages = pages or get_page_count()
+    start_time = time.time()
+    summary = {
+        "success": False,
+        "total": len(docs),
+        "verified": 0,
+        "failed": 0,
+        "pages": pages,
+        "screenshots": screenshots,
+        "errors": [],
+        "documents": []
+    }
+
+    print(f"[feishu-doc-verifier] Browser batch: {len(docs)} documents, {pages} pages")
+
+    if not doc_verifier.get_playwright_state_file().exists():
+        summary["errors"].append("没有保存的登录状态，请先运行 doc_verifier.py --browser 扫码登录")
+        print(f"[FAIL] {summary['errors'][0]}")
+        return summary
+
+    screenshot_dir = None
+    if screenshots and output_dir is not None:
+        screenshot_dir = Path(output_dir) / "screenshots"
+        screenshot_dir.mkdir(parents=True, exist_ok=True)
+
+    try:
+        results = asyncio.run(verify_all(docs, pages, screenshot_dir))
+    except Exception as e:
+        summary["errors"].append(f"浏览器启动失败: {e}")
+        print(f"[FAIL] 浏览器启动失败: {e}")
+        return summary
+
+    duration = time.time() - start_time
+    summary["documents"] = list(results)
+    summary["verified"] = sum(1 for r in results if r["success"])
+    summary["failed"] = len(results) - summary["verified"]
+    summary["success"] = summary["failed"] == 0
+    summary["duration_seconds"] = round(duration, 2)
+    summary["docs_per_minute"] = round(len(results) / duration * 60, 2) if duration > 0 else 0.0
+    summary["verified_at"] = datetime.now().isoformat()
+
+    print(f"[feishu-doc-verifier] Verified {summary['verified']}/{len(results)} in {duration:.1f}s "
+          f"({summary['docs_per_minute']:.1f} 文档/分钟)")
+    return summary
+
+
+def load_documents(source):
+    """
+    读取要验证的文档列表
+
+    source 可以是 batch_summary.json（取成功创建的文档）、单个 doc_info.json，
+    或目录（递归查找 doc_with_permission.json / doc_info.json）
+    """
+    path = Path(source)
+    if path.is_dir():
+        files = sorted(path.rglob("doc_with_permission.json")) or sorted(path.rglob("doc_info.json"))
+        docs = []
+        for file in files:
+            with open(file, 'r', encoding='utf-8') as f:
+                docs.append(json.load(f))
+        return docs
+
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if "documents" in data:
+        return [{"document_id": r["document_id"], "document_url": r["document_url"], "title": r.get("title", "")}
+                for r in data["documents"] if r.get("document_url")]
+    return [data]
+
+
+def get_option(name, default=None):
+    """读取 --name value 形式的命令行参数"""
+    if name in sys.argv:
+        index = sys.argv.index(name)
+        if index + 1 < len(sys.argv):
+            return sys.argv[index + 1]
+    return default
+
+
+def get_positional_args():
+    """位置参数（跳过 --flag 及带值参数的值）"""
+    args = []
+    skip_next = False
+    for arg in sys.argv[1:]:
+        if skip_next:
+            skip_next = False
+            continue
+        if arg == "--pages":
+            skip_next = True
+            continue
+        if arg.startswith("--"):
+            continue
+        args.append(arg)
+    return args
+
+
+def main():
+    """
+    主函数
+
+    所有文档共用一个浏览器上下文，最多同时打开 --pages 个页面（默认 4）；
+    --screenshots 时保存缩小的 JPEG 截图，否则不加载图片、视频和字体
+    """
+    args = get_positional_args()
+    if len(args) < 1:
+        print("Usage: python batch_verifier.py <batch_summary.json | doc_info.json | 目录> [output_dir] [--pages N] [--screenshots]")
+        sys.exit(1)
+
+    output_dir = Path(args[1]) if len(args) >= 2 else Path("output")
+    pages = get_option("--pages")
+    if pages is not None:
+        pages = int(pages)
+        if pages < 1:
+            print("错误: --pages 必须大于 0")
+            sys.exit(1)
+
+    docs = load_documents(args[0])
+    if not docs:
+        print(f"[FAIL] 没有找到要验证的文档: {args[0]}")
+        sys.exit(1)
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    summary = verify_documents(docs, output_dir, pages=pages, screenshots="--screenshots" in sys.argv)
+
+    result_file = output_dir / "batch_verify_result.json"
+    with open(result_file, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    print(f"[feishu-doc-verifier] Output: {result_file}")
+    print(f"\n[OUTPUT] {result_file}")
+
+    if not summary["success"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,16 +2,54 @@
 # -*- coding: utf-8 -*-
 """
 文档验证器 - 子技能5
-使用 Playwright 验证文档是否创建成功
+默认通过文档块接口读取文档结构，与 blocks.json 逐块比较类型、顺序和文字；
+--browser 时使用 Playwright 打开文档页面验证
 输出：verify_result.json
 """
 
+import os
 import sys
 import json
 import re
 import time
 from pathlib import Path
 from datetime import datetime
+from difflib import SequenceMatcher
+
+# 添加公共模块路径
+COMMON_SCRIPT_DIR = Path(__file__).parent.parent.parent / "feishu-common" / "scripts"
+if str(COMMON_SCRIPT_DIR) not in sys.path:
+    sys.path.insert(0, str(COMMON_SCRIPT_DIR))
+
+import token_cache
+import docx_blocks
+import http_metrics
+
+# 不一致报告中文字预览的最大长度
+PREVIEW_LENGTH = 60
+
+# 浏览器验证：文档内容渲染完成的标志（出现文档块元素）和等待时间（毫秒）；
+# 文档页面保持长连接，网络空闲只作为额外信号，等待时间较短
+DEFAULT_READY_SELECTOR = "[data-block-id]"
+READY_TIMEOUT_MS = 30000
+NETWORK_IDLE_TIMEOUT_MS = 5000
+
+
+def load_config():
+    """加载飞书配置"""
+    config_path = Path(__file__).parent.parent.parent.parent / "feishu-config.env"
+    if not config_path.exists():
+        config_path = Path(".claude/feishu-config.env")
+
+    config = {}
+    if config_path.exists():
+        with open(config_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#') and '=' in line:
+                    key, value = line.split('=', 1)
+                    config[key.strip()] = value.strip().strip('"\'')
+    return config
 
 
 def clean_zero_width_chars(text):
@@ -36,26 +74,239 @@ def clean_zero_width_chars(text):
     return text.strip()
 
 
-def main():
-    """主函数"""
-    if len(sys.argv) < 2:
-        print("Usage: python doc_verifier.py <doc_info.json> [output_dir]")
-        sys.exit(1)
+def get_ready_selector():
+    """文档渲染完成的选择器（环境变量 FEISHU_VERIFY_READY_SELECTOR）"""
+    return os.environ.get("FEISHU_VERIFY_READY_SELECTOR", DEFAULT_READY_SELECTOR)
+
+
+def wait_for_document_ready(page):
+    """
+    等待文档块渲染完成，再短暂等待网络空闲
+
+    返回文档块是否已渲染（超时返回 False，不抛出异常）
+    """
+    try:
+        page.wait_for_selector(get_ready_selector(), state="attached", timeout=READY_TIMEOUT_MS)
+    except Exception:
+        return False
+    try:
+        page.wait_for_load_state("networkidle", timeout=NETWORK_IDLE_TIMEOUT_MS)
+    except Exception:
+        pass
+    return True
+
+
+def get_playwright_state_dir():
+    """浏览器持久化上下文目录（保存登录状态），位于项目根目录的 .claude/playwright_state"""
+    project_root = Path(__file__).parent.parent.parent.parent.parent
+    return project_root / ".claude" / "playwright_state"
+
+
+def get_playwright_state_file():
+    """首次扫码登录成功后保存的登录状态文件"""
+    return get_playwright_state_dir() / "state.json"
+
+
+def is_verifiable_block(block):
+    """blocks.json 中会被添加到文档的块（表格、图片和有内容字段的普通块）"""
+    if block.get("type") == "table" or block.get("block_type") == 27:
+        return True
+    return block.get("block_type") in docx_blocks.BLOCK_TYPE_KEYS and block.get("block_type") not in (31, 32)
 
-    doc_info_file = Path(sys.argv[1])
 
-    if len(sys.argv) >= 3:
-        output_dir = Path(sys.argv[2])
+def verify_key(fingerprint):
+    """
+    比较用的键：图片只比较位置（远端素材 token 与本地文件无法直接对应），
+    其余块使用内容指纹
+    """
+    return "image" if fingerprint.block_type == 27 else fingerprint.key
+
+
+def preview_text(fingerprint):
+    """块内容的简短预览，用于不一致报告"""
+    if fingerprint.block_type == 31:
+        return f"{fingerprint.shape['rows']}x{fingerprint.shape['columns']} 表格"
+    if fingerprint.block_type == 27:
+        return "图片"
+    text = "".join(run[0] or "" for run in fingerprint.text or [])
+    return clean_zero_width_chars(text)[:PREVIEW_LENGTH]
+
+
+def describe_mismatch(expected, actual):
+    """成对的本地块和远端块不一致的原因"""
+    if expected.block_type != actual.block_type:
+        return "type_mismatch"
+    if expected.shape != actual.shape:
+        return "style_mismatch"
+    return "text_mismatch"
+
+
+def mismatch_entry(status, local_index=None, expected=None, remote_index=None, actual=None, remote_block=None):
+    """不一致报告中的一项：本地块下标、远端块下标、期望与实际的类型、文字预览和指纹"""
+    entry = {"status": status, "index": local_index, "remote_index": remote_index}
+    if expected is not None:
+        entry["expected_type"] = expected.block_type
+        entry["expected_text"] = preview_text(expected)
+        entry["expected_hash"] = expected.key[:12]
+    if actual is not None:
+        entry["actual_type"] = actual.block_type
+        entry["actual_text"] = preview_text(actual)
+        entry["actual_hash"] = actual.key[:12]
+        entry["block_id"] = remote_block.get("block_id")
+    return entry
+
+
+def compare_blocks(local_blocks, remote_blocks, by_id):
+    """
+    按文档顺序比较 blocks.json 中的块与文档的一级块
+
+    local_blocks 为 [(blocks.json 下标, 块)]。用 difflib 按指纹对齐两个序列：
+    对齐的块一致；变化区域中成对的块按类型、样式、文字判断原因，多出的本地块为 missing，
+    多出的远端块为 unexpected。本地有图片文件但远端图片块没有素材时为 image_not_set。
+
+    返回 (一致的块数, 不一致报告列表)
+    """
+    local = [docx_blocks.local_fingerprint(block) if block.get("block_type") != 27
+             else docx_blocks.BlockFingerprint(27, {"type": 27}, None)
+             for _, block in local_blocks]
+    remote = [docx_blocks.remote_fingerprint(block, by_id) for block in remote_blocks]
+
+    matcher = SequenceMatcher(None, [verify_key(fp) for fp in local], [verify_key(fp) for fp in remote],
+                              autojunk=False)
+    matched = 0
+    mismatches = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            for k in range(i2 - i1):
+                local_index, block = local_blocks[i1 + k]
+                remote_block = remote_blocks[j1 + k]
+                if (block.get("block_type") == 27 and block.get("local_path")
+                        and not remote_block.get("image", {}).get("token")):
+                    mismatches.append(mismatch_entry("image_not_set", local_index, local[i1 + k],
+                                                     j1 + k, remote[j1 + k], remote_block))
+                else:
+                    matched += 1
+            continue
+
+        paired = min(i2 - i1, j2 - j1)
+        for k in range(paired):
+            expected, actual = local[i1 + k], remote[j1 + k]
+            mismatches.append(mismatch_entry(describe_mismatch(expected, actual), local_blocks[i1 + k][0],
+                                             expected, j1 + k, actual, remote_blocks[j1 + k]))
+        for k in range(i1 + paired, i2):
+            mismatches.append(mismatch_entry("missing", local_blocks[k][0], local[k]))
+        for k in range(j1 + paired, j2):
+            mismatches.append(mismatch_entry("unexpected", remote_index=k, actual=remote[k],
+                                             remote_block=remote_blocks[k]))
+
+    return matched, mismatches
+
+
+def verify_document_api(doc_info, blocks=None, config=None):
+    """
+    通过文档块接口验证文档，供编排器在进程内直接调用
+
+    以最大分页读取文档的全部块，与 blocks 逐块比较类型、顺序和文字哈希；
+    blocks 为 None 时只检查文档可读取且不为空。
+    返回 verify_result.json 的内容
+    """
+    doc_id = doc_info["document_id"]
+    print(f"[feishu-doc-verifier] Document ID: {doc_id}")
+    print("[feishu-doc-verifier] Mode: API (读取文档块结构)")
+
+    result = {
+        "success": False,
+        "mode": "api",
+        "document_id": doc_id,
+        "document_url": doc_info.get("document_url", ""),
+        "errors": []
+    }
+
+    start_time = time.time()
+    metrics = http_metrics.MetricsRegistry()
+    try:
+        if config is None:
+            config = load_config()
+        with http_metrics.collect() as metrics:
+            token = token_cache.get_tenant_access_token(config)
+
+            items = []
+            request_count = 0
+            for page in docx_blocks.iter_block_pages(token, config, doc_id):
+                request_count += 1
+                items.extend(page)
+    except Exception as e:
+        result["errors"].append(f"读取文档块失败: {e}")
+        print(f"[WARN] 读取文档块失败: {e}")
+        result["http_metrics"] = metrics.snapshot()
+        result["verified_at"] = datetime.now().isoformat()
+        return result
+
+    by_id = docx_blocks.index_blocks(items)
+    remote_blocks = docx_blocks.top_level_blocks(doc_id, by_id)
+    result["remote_blocks"] = len(remote_blocks)
+    result["request_count"] = request_count
+    result["http_metrics"] = metrics.snapshot()
+
+    if blocks is None:
+        print("[WARN] 未提供 blocks.json，只检查文档是否为空")
+        result["success"] = len(remote_blocks) > 0
     else:
-        output_dir = Path("output")
+        local_blocks = [(i, block) for i, block in enumerate(blocks) if is_verifiable_block(block)]
+        matched, mismatches = compare_blocks(local_blocks, remote_blocks, by_id)
+        counts = {}
+        for entry in mismatches:
+            counts[entry["status"]] = counts.get(entry["status"], 0) + 1
+
+        result["expected_blocks"] = len(local_blocks)
+        result["matched_blocks"] = matched
+        result["mismatch_counts"] = counts
+        result["mismatches"] = mismatches
+        result["success"] = not mismatches
+
+        for entry in mismatches[:20]:
+            position = f"块 {entry['index'] + 1}" if entry["index"] is not None else f"远端块 {entry['remote_index'] + 1}"
+            if "expected_text" in entry and "actual_text" in entry:
+                detail = f"期望 {entry['expected_text']!r}，实际 {entry['actual_text']!r}"
+            else:
+                detail = repr(entry.get("expected_text", entry.get("actual_text", "")))
+            print(f"  [{entry['status']}] {position}: {detail}")
+        if len(mismatches) > 20:
+            print(f"  ... 另有 {len(mismatches) - 20} 处不一致，见 verify_result.json")
 
-    output_dir.mkdir(parents=True, exist_ok=True)
+    duration = time.time() - start_time
+    result["duration_seconds"] = round(duration, 3)
+    result["verified_at"] = datetime.now().isoformat()
 
-    # 加载文档信息
-    print(f"[feishu-doc-verifier] Loading doc info from: {doc_info_file}")
-    with open(doc_info_file, 'r', encoding='utf-8') as f:
-        doc_info = json.load(f)
+    if result["success"]:
+        print(f"[OK] 文档验证成功 - {len(remote_blocks)} 个一级块与 blocks.json 一致 ({duration:.2f}s, {request_count} 次请求)")
+    elif blocks is not None:
+        print(f"[WARN] 文档验证失败 - {result['matched_blocks']}/{result['expected_blocks']} 个块一致，"
+              f"{len(result['mismatches'])} 处不一致")
+    else:
+        print("[WARN] 文档验证失败 - 文档为空")
+    return result
+
+
+def verify_document(doc_info, output_dir=None, blocks=None, config=None, browser=False):
+    """
+    验证文档，供编排器在进程内直接调用
+
+    默认通过文档块接口比较文档结构与 blocks；browser=True 时使用 Playwright 打开文档页面
+    返回 verify_result.json 的内容
+    """
+    if browser:
+        return verify_document_browser(doc_info, output_dir)
+    return verify_document_api(doc_info, blocks, config)
+
+
+def verify_document_browser(doc_info, output_dir=None):
+    """
+    使用 Playwright 验证文档页面能否打开
 
+    output_dir 为 None 时不保存截图
+    返回 verify_result.json 的内容
+    """
     doc_id = doc_info["document_id"]
     doc_url = doc_info["document_url"]
     title = doc_info.get("title", "未命名文档")
@@ -66,6 +317,7 @@ def main():
     # 结果
     result = {
         "success": False,
+        "mode": "browser",
         "document_id": doc_id,
         "document_url": doc_url,
         "page_loaded": False,
@@ -77,12 +329,11 @@ def main():
     # 使用 Playwright 验证
     print("\n[feishu-doc-verifier] Starting Playwright verification...")
 
-    # 获取项目根目录，用于存储登录状态
-    project_root = Path(__file__).parent.parent.parent.parent.parent
-    playwright_state_dir = project_root / ".claude" / "playwright_state"
+    # 登录状态保存在项目根目录的 .claude/playwright_state
+    playwright_state_dir = get_playwright_state_dir()
 
     # 检查是否已有登录状态
-    state_file = playwright_state_dir / "state.json"
+    state_file = get_playwright_state_file()
     has_login_state = state_file.exists()
 
     # 如果没有登录状态，使用非无头模式让用户扫码
@@ -119,8 +370,8 @@ def main():
             # 访问文档
             page.goto(doc_url, timeout=60000, wait_until="domcontentloaded")
 
-            # 等待页面稳定
-            page.wait_for_timeout(2000)
+            # 等待页面加载完成（未登录时会跳转到登录页）
+            page.wait_for_load_state("load")
 
             # 检测是否需要登录
             needs_login = False
@@ -173,7 +424,9 @@ def main():
                 if not logged_in:
                     print("[WARN] 等待登录超时，尝试继续验证...")
 
-            page.wait_for_timeout(3000)  # 额外等待3秒确保页面完全加载
+            # 等待文档块渲染，而不是固定等待
+            if not wait_for_document_ready(page):
+                print("[WARN] 等待文档内容渲染超时")
 
             # 获取页面信息
             page_title = page.title()
@@ -199,9 +452,10 @@ def main():
                 print(f"[WARN] 文档验证失败 - 页面可能无法正常访问")
 
             # 截图（可选）
-            screenshot_file = output_dir / "screenshot.png"
-            page.screenshot(path=str(screenshot_file))
-            result["screenshot"] = str(screenshot_file)
+            if output_dir is not None:
+                screenshot_file = Path(output_dir) / "screenshot.png"
+                page.screenshot(path=str(screenshot_file))
+                result["screenshot"] = str(screenshot_file)
 
             # 保存上下文状态
             context.storage_state(path=str(state_file))
@@ -217,15 +471,62 @@ def main():
         result["page_loaded"] = False
 
     result["verified_at"] = datetime.now().isoformat()
+    return result
 
-    # 保存结果
+
+def save_verify_result(result, output_dir):
+    """保存结果到 verify_result.json，返回文件路径"""
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
     result_file = output_dir / "verify_result.json"
     with open(result_file, 'w', encoding='utf-8') as f:
         json.dump(result, f, ensure_ascii=False, indent=2)
+    return result_file
+
+
+def main():
+    """
+    主函数
+
+    默认通过文档块接口验证：读取文档的一级块，与 blocks.json 逐块比较，不一致时写入 mismatches；
+    --browser 时使用 Playwright 打开文档页面（需要登录，每个文档约 10 秒）
+    """
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    if len(args) < 1:
+        print("Usage: python doc_verifier.py <doc_info.json> [output_dir] [blocks.json] [--browser]")
+        sys.exit(1)
+
+    doc_info_file = Path(args[0])
+
+    if len(args) >= 2:
+        output_dir = Path(args[1])
+    else:
+        output_dir = Path("output")
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    # 加载文档信息
+    print(f"[feishu-doc-verifier] Loading doc info from: {doc_info_file}")
+    with open(doc_info_file, 'r', encoding='utf-8') as f:
+        doc_info = json.load(f)
+
+    blocks = None
+    if len(args) >= 3:
+        print(f"[feishu-doc-verifier] Loading blocks from: {args[2]}")
+        with open(args[2], 'r', encoding='utf-8') as f:
+            blocks = json.load(f)["blocks"]
+
+    result = verify_document(doc_info, output_dir, blocks=blocks, browser="--browser" in sys.argv)
+
+    # 保存结果
+    result_file = save_verify_result(result, output_dir)
 
     print(f"\n[feishu-doc-verifier] Output: {result_file}")
     print(f"\n[OUTPUT] {result_file}")
 
+    if not result["success"]:
+        sys.exit(1)
+
 
 if __name__ == "__main__":
     main()
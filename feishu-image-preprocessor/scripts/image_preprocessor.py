@@ -0,0 +1,420 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+图片预处理 - 位于 Markdown 解析和块添加之间的子技能
+读取本地图片的文件头得到宽高（PNG / JPEG / GIF，不解码整张图片），写入图片块的 width / height；
+开启压缩时把超过最大边长的图片在进程池中缩小并重新压缩，块添加时上传压缩后的文件
+输出：blocks.json（更新后的块）+ preprocess_result.json
+"""
+
+import os
+import sys
+import json
+import time
+import struct
+import hashlib
+import tempfile
+from pathlib import Path
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+# 添加公共模块路径
+COMMON_SCRIPT_DIR = Path(__file__).parent.parent.parent / "feishu-common" / "scripts"
+if str(COMMON_SCRIPT_DIR) not in sys.path:
+    sys.path.insert(0, str(COMMON_SCRIPT_DIR))
+
+import token_cache
+import docx_blocks
+
+# 压缩参数或算法变化时递增，旧的压缩结果不再复用
+PREPROCESS_VERSION = 1
+
+# 默认最大边长（像素）和 JPEG 质量，可通过环境变量 FEISHU_IMAGE_MAX_SIZE / FEISHU_IMAGE_QUALITY 修改
+DEFAULT_MAX_SIZE = 2048
+DEFAULT_QUALITY = 85
+
+# quality 低于该值时 PNG 量化为调色板图片
+PNG_QUANTIZE_BELOW_QUALITY = 95
+
+# 超过该时间（秒）没有使用的压缩结果在运行结束时清理
+CACHE_TTL_SECONDS = 30 * 24 * 3600
+
+# JPEG 中带有图片尺寸的帧头标记（SOF0-SOF15，除去 DHT / JPG / DAC）
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+# 没有长度字段的 JPEG 标记：TEM、RST0-RST7、SOI
+JPEG_STANDALONE_MARKERS = {0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7, 0xD8}
+
+IMAGE_EXTENSIONS = {"PNG": ".png", "JPEG": ".jpg", "GIF": ".gif"}
+
+
+def get_cache_dir():
+    """压缩结果目录：环境变量 FEISHU_IMAGE_PREPROCESS_DIR，默认为项目 .claude/feishu-image-preprocess"""
+    env_dir = os.environ.get("FEISHU_IMAGE_PREPROCESS_DIR")
+    if env_dir:
+        return Path(env_dir)
+    return token_cache.get_claude_dir() / "feishu-image-preprocess"
+
+
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def get_max_size():
+    """最大边长（像素）"""
+    return max(_env_int("FEISHU_IMAGE_MAX_SIZE", DEFAULT_MAX_SIZE), 1)
+
+
+def get_quality():
+    """JPEG 压缩质量（1-95）"""
+    return min(max(_env_int("FEISHU_IMAGE_QUALITY", DEFAULT_QUALITY), 1), 95)
+
+
+def get_workers():
+    """压缩进程数，默认为 CPU 核数"""
+    return max(_env_int("FEISHU_IMAGE_PREPROCESS_WORKERS", os.cpu_count() or 1), 1)
+
+
+def _probe_png(f):
+    header = f.read(24)
+    if len(header) < 24 or header[12:16] != b"IHDR":
+        return None
+    width, height = struct.unpack(">II", header[16:24])
+    return width, height
+
+
+def _probe_gif(f):
+    header = f.read(10)
+    if len(header) < 10:
+        return None
+    width, height = struct.unpack("<HH", header[6:10])
+    return width, height
+
+
+def _probe_jpeg(f):
+    """依次跳过各段，直到帧头（SOF）中的宽高"""
+    f.seek(2)
+    while True:
+        byte = f.read(1)
+        while byte and byte != b"\xff":
+            byte = f.read(1)
+        while byte == b"\xff":
+            byte = f.read(1)
+        if not byte:
+            return None
+
+        marker = byte[0]
+        if marker in JPEG_STANDALONE_MARKERS:
+            continue
+        if marker == 0xD9:
+            return None
+
+        length_bytes = f.read(2)
+        if len(length_bytes) < 2:
+            return None
+        length = struct.unpack(">H", length_bytes)[0]
+        if marker in JPEG_SOF_MARKERS:
+            frame = f.read(5)
+            if len(frame) < 5:
+                return None
+            height, width = struct.unpack(">HH", frame[1:5])
+            return width, height
+        f.seek(length - 2, os.SEEK_CUR)
+
+
+def probe_image(path):
+    """
+    读取图片文件头，返回 (格式, 宽, 高)
+
+    只读取文件开头（JPEG 为帧头之前的各段）；不支持的格式或文件损坏时返回 None
+    """
+    with open(path, 'rb') as f:
+        signature = f.read(8)
+        f.seek(0)
+        if signature == b"\x89PNG\r\n\x1a\n":
+            image_format, size = "PNG", _probe_png(f)
+        elif signature[:6] in (b"GIF87a", b"GIF89a"):
+            image_format, size = "GIF", _probe_gif(f)
+        elif signature[:2] == b"\xff\xd8":
+            image_format, size = "JPEG", _probe_jpeg(f)
+        else:
+            return None
+    if not size or not size[0] or not size[1]:
+        return None
+    return image_format, size[0], size[1]
+
+
+def pillow_available():
+    """是否安装了 Pillow（缩小和重新压缩需要）"""
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def recompress_image(source, target, max_size, quality):
+    """
+    缩小并重新压缩一张图片（在进程池中运行）
+
+    等比缩小到最长边不超过 max_size；JPEG 按 quality 重新编码；PNG 在 quality 低于 95 时
+    量化为 256 色调色板（截图颜色少，体积通常降到几分之一），并使用最高压缩级别。
+    保持原格式，PNG 截图中的文字不会因为转成 JPEG 变模糊。
+    返回 (宽, 高, 字节数)，没有变小时不写入 target，返回 None
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(source) as image:
+        image_format = image.format
+        if getattr(image, "is_animated", False):
+            return None
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_size, max_size), Image.LANCZOS)
+
+        if image_format == "JPEG":
+            if image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            options = {"quality": quality, "optimize": True, "progressive": True}
+        elif image_format == "PNG" and quality < PNG_QUANTIZE_BELOW_QUALITY and image.mode != "P":
+            if image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGBA")
+            image = image.quantize(256, method=Image.Quantize.FASTOCTREE)
+            options = {"optimize": True}
+        else:
+            options = {"optimize": True}
+
+        fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", suffix=Path(target).suffix, dir=Path(target).parent)
+        os.close(fd)
+        try:
+            image.save(tmp_path, format=image_format, **options)
+            size = os.path.getsize(tmp_path)
+            if size >= os.path.getsize(source):
+                os.remove(tmp_path)
+                return None
+            os.replace(tmp_path, target)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return image.width, image.height, size
+
+
+def output_path(sha256, image_format, max_size, quality, cache_dir=None):
+    """压缩结果路径：由原图内容和压缩参数决定，相同输入复用同一个文件（上传时也能命中素材缓存）"""
+    cache_dir = Path(cache_dir) if cache_dir else get_cache_dir()
+    key_data = json.dumps([PREPROCESS_VERSION, sha256, max_size, quality]).encode('utf-8')
+    key = hashlib.sha256(key_data).hexdigest()[:32]
+    return cache_dir / f"{key}{IMAGE_EXTENSIONS[image_format]}"
+
+
+def prune_cache(cache_dir=None):
+    """删除长期没有使用的压缩结果，返回删除的文件数"""
+    cache_dir = Path(cache_dir) if cache_dir else get_cache_dir()
+    if not cache_dir.exists():
+        return 0
+    removed = 0
+    now = time.time()
+    for path in cache_dir.iterdir():
+        try:
+            if now - path.stat().st_mtime > CACHE_TTL_SECONDS:
+                path.unlink()
+                removed += 1
+        except OSError:
+            pass
+    return removed
+
+
+def preprocess_blocks(blocks, optimize=False, max_size=None, quality=None, workers=None):
+    """
+    预处理块列表中的本地图片，供编排器在进程内直接调用（原地修改 blocks）
+
+    所有本地图片：写入 image.width / image.height
+    optimize=True 且安装了 Pillow 时：最长边超过 max_size 的图片缩小重新压缩，
+    local_path 改为压缩后的文件，原路径保存在 source_path
+    返回 preprocess_result.json 的内容
+    """
+    max_size = max_size or get_max_size()
+    quality = quality or get_quality()
+    start_time = time.time()
+
+    print(f"[feishu-image-preprocessor] Optimize: {'on' if optimize else 'off'}"
+          f"{f' (max {max_size}px, quality {quality})' if optimize else ''}")
+
+    if optimize and not pillow_available():
+        print("[feishu-image-preprocessor] [WARN] Pillow 未安装，只读取图片尺寸，不压缩（pip install Pillow）")
+        optimize = False
+
+    images = []
+    jobs = []
+    errors = []
+    warnings = []
+    for block in blocks:
+        if block.get("block_type") != 27:
+            continue
+        image_path = block.get("local_path")
+        if not image_path or not Path(image_path).exists():
+            continue
+
+        record = {"source": image_path, "resized": False}
+        images.append(record)
+        try:
+            record["bytes_before"] = record["bytes_after"] = os.path.getsize(image_path)
+            probed = probe_image(image_path)
+        except OSError as e:
+            errors.append(f"{image_path}: {e}")
+            print(f"  [FAIL] {image_path}: {e}")
+            continue
+        if probed is None:
+            print(f"  [SKIP] 无法识别的图片格式: {image_path}")
+            continue
+
+        image_format, width, height = probed
+        record.update({"format": image_format, "width": width, "height": height})
+        block.setdefault("image", {}).update({"width": width, "height": height})
+
+        if optimize and max(width, height) > max_size:
+            target = output_path(docx_blocks.hash_file(image_path), image_format, max_size, quality)
+            jobs.append((block, record, target))
+
+    # 压缩：已有相同输入的压缩结果时直接复用，其余在进程池中处理
+    pending = []
+    for block, record, target in jobs:
+        if target.exists():
+            os.utime(target)
+            probed = probe_image(target)
+            if probed:
+                apply_result(block, record, target, (probed[1], probed[2], target.stat().st_size))
+                print(f"  [CACHE] {record['source']} -> {target.name}")
+                continue
+        pending.append((block, record, target))
+
+    if pending:
+        get_cache_dir().mkdir(parents=True, exist_ok=True)
+        # 文档中重复出现的同一图片只压缩一次
+        sources = {}
+        for _, record, target in pending:
+            sources.setdefault(target, record["source"])
+        args = [(source, str(target), max_size, quality) for target, source in sources.items()]
+        if len(args) == 1:
+            outcomes = [_run_safely(*args[0])]
+        else:
+            with ProcessPoolExecutor(max_workers=min(workers or get_workers(), len(args))) as executor:
+                outcomes = list(executor.map(_run_safely, *zip(*args)))
+        outcomes = dict(zip(sources, outcomes))
+
+        for block, record, target in pending:
+            compressed, error = outcomes[target]
+            if error:
+                warnings.append(f"{record['source']}: {error}")
+                print(f"  [WARN] 压缩失败，使用原图: {record['source']}: {error[:80]}")
+            elif compressed is None:
+                print(f"  [SKIP] 压缩后没有变小，使用原图: {record['source']}")
+            else:
+                apply_result(block, record, target, compressed)
+                print(f"  [OK] {record['source']}: {record['bytes_before'] // 1024} KB -> "
+                      f"{record['bytes_after'] // 1024} KB ({record['width']}x{record['height']})")
+
+    if optimize:
+        prune_cache()
+
+    bytes_before = sum(record.get("bytes_before", 0) for record in images)
+    bytes_after = sum(record.get("bytes_after", 0) for record in images)
+    duration = time.time() - start_time
+    resized = sum(1 for record in images if record["resized"])
+
+    print(f"[feishu-image-preprocessor] Images: {len(images)}, resized: {resized}, "
+          f"bytes: {bytes_before // 1024} KB -> {bytes_after // 1024} KB, {duration:.2f}s")
+
+    return {
+        "success": not errors,
+        "optimize": optimize,
+        "max_size": max_size,
+        "quality": quality,
+        "total_images": len(images),
+        "resized": resized,
+        "bytes_before": bytes_before,
+        "bytes_after": bytes_after,
+        "images": images,
+        "errors": errors,
+        "warnings": warnings,
+        "duration_seconds": round(duration, 2),
+        "completed_at": datetime.now().isoformat()
+    }
+
+
+def _run_safely(source, target, max_size, quality):
+    """进程池任务：返回 (压缩结果, 错误信息)，异常不会中断其他图片"""
+    try:
+        return recompress_image(source, target, max_size, quality), None
+    except Exception as e:
+        return None, str(e)
+
+
+def apply_result(block, record, target, compressed):
+    """把压缩结果写回图片块和统计记录"""
+    width, height, size = compressed
+    block["source_path"] = record["source"]
+    block["local_path"] = str(target)
+    block["image"].update({"width": width, "height": height})
+    record.update({"resized": True, "output": str(target), "width": width, "height": height,
+                   "bytes_after": size})
+
+
+def get_option(name, default=None):
+    """读取 --name value 形式的命令行参数"""
+    if name in sys.argv:
+        index = sys.argv.index(name)
+        if index + 1 < len(sys.argv):
+            return sys.argv[index + 1]
+    return default
+
+
+def main():
+    """
+    主函数
+
+    读取 blocks.json，预处理后把更新的块写入输出目录的 blocks.json（可以与输入为同一目录）
+    """
+    args = []
+    skip_next = False
+    for arg in sys.argv[1:]:
+        if skip_next:
+            skip_next = False
+        elif arg in ("--max-size", "--quality"):
+            skip_next = True
+        elif not arg.startswith("--"):
+            args.append(arg)
+
+    if len(args) < 1:
+        print("Usage: python image_preprocessor.py <blocks.json> [output_dir] [--optimize] [--max-size N] [--quality Q]")
+        sys.exit(1)
+
+    blocks_file = Path(args[0])
+    output_dir = Path(args[1]) if len(args) >= 2 else blocks_file.parent
+    optimize = "--optimize" in sys.argv
+    max_size = int(get_option("--max-size", get_max_size()))
+    quality = int(get_option("--quality", get_quality()))
+
+    print(f"[feishu-image-preprocessor] Loading blocks from: {blocks_file}")
+    with open(blocks_file, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    result = preprocess_blocks(data["blocks"], optimize=optimize, max_size=max_size, quality=quality)
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    token_cache.write_json_file(output_dir / "blocks.json", data)
+    result_file = output_dir / "preprocess_result.json"
+    with open(result_file, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"[feishu-image-preprocessor] Output: {output_dir / 'blocks.json'}")
+    print(f"\n[OUTPUT] {result_file}")
+
+    if not result["success"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,8 +2,8 @@
 # -*- coding: utf-8 -*-
 """
 日志记录器 - 子技能6
-汇总所有步骤结果，记录到日志文件
-输出：CREATED_DOCS.md, created_docs.json
+汇总所有步骤结果，追加到运行日志数据库
+输出：run_log.db（CREATED_DOCS.md 用 --report 按需生成）
 """
 
 import sys
@@ -11,6 +11,12 @@ import json
 from pathlib import Path
 from datetime import datetime
 
+import run_log
+
+
+# 编排器（子进程模式）写入工作流目录的各步骤耗时
+STEP_TIMINGS_FILE = "step_timings.json"
+
 
 def load_json(file_path):
     """加载 JSON 文件"""
@@ -20,30 +26,52 @@ def load_json(file_path):
     return {}
 
 
-def main():
-    """主函数"""
-    if len(sys.argv) < 2:
-        print("Usage: python logger.py <workflow_dir> [output_dir]")
-        sys.exit(1)
-
-    workflow_dir = Path(sys.argv[1])
+def build_step_metrics(step_timings, add_result, verify_result):
+    """
+    各步骤的耗时和计数：{步骤: {"duration_seconds", ...}}
+
+    step_timings 为编排器记录的 {步骤: 耗时秒数}；没有时用块添加和验证结果中自带的耗时。
+    add_blocks 另记请求数、重试次数和块数，verify 记请求数，total 为整个运行的汇总
+    """
+    step_timings = dict(step_timings or {})
+    if "add_blocks" not in step_timings and "duration_seconds" in add_result:
+        step_timings["add_blocks"] = add_result["duration_seconds"]
+    if "verify" not in step_timings and "duration_seconds" in verify_result:
+        step_timings["verify"] = verify_result["duration_seconds"]
+
+    steps = {step: {"duration_seconds": duration}
+             for step, duration in step_timings.items() if step != "total"}
+
+    blocks = add_result.get("total_blocks", 0)
+    request_count = add_result.get("request_count", 0) + verify_result.get("request_count", 0)
+    retries = add_result.get("retries", 0)
+    if "add_blocks" in steps:
+        steps["add_blocks"].update({
+            "request_count": add_result.get("request_count", 0),
+            "retries": retries,
+            "blocks": blocks
+        })
+    if "verify" in steps:
+        steps["verify"]["request_count"] = verify_result.get("request_count", 0)
+
+    total = step_timings.get("total")
+    if total is None:
+        total = round(sum(step["duration_seconds"] for step in steps.values()), 3)
+    steps["total"] = {
+        "duration_seconds": total,
+        "request_count": request_count,
+        "retries": retries,
+        "blocks": blocks
+    }
+    return steps
 
-    if len(sys.argv) >= 3:
-        output_dir = Path(sys.argv[2])
-    else:
-        # 默认输出到父目录（通常是主技能目录）
-        output_dir = Path(__file__).parent.parent  # feishu-doc-orchestrator
 
-    output_dir.mkdir(parents=True, exist_ok=True)
-
-    # 加载所有结果文件
-    print(f"[feishu-logger] Loading results from: {workflow_dir}")
-
-    blocks_data = load_json(workflow_dir / "step1_parse" / "blocks.json")
-    doc_info = load_json(workflow_dir / "step2_create_with_permission" / "doc_with_permission.json")
-    add_result = load_json(workflow_dir / "step3_add_blocks" / "add_result.json")
-    verify_result = load_json(workflow_dir / "step4_verify" / "verify_result.json")
+def build_log_entry(blocks_data, doc_info, add_result, verify_result, source_file="", step_timings=None):
+    """
+    汇总各步骤结果为一条日志记录
 
+    step_timings 为编排器记录的各步骤耗时（秒），写入记录的 steps 中
+    """
     # 汇总信息
     doc_id = doc_info.get("document_id", "")
     doc_url = doc_info.get("document_url", "")
@@ -53,77 +81,107 @@ def main():
     # 从 doc_with_permission.json 获取权限信息
     permission = doc_info.get("permission", {})
 
-    # 解析元数据
-    metadata = blocks_data.get("metadata", {})
-
-    # 汇总日志条目
-    log_entry = {
+    return {
         "title": title,
         "time": created_at or datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
         "document_id": doc_id,
         "url": doc_url,
-        "source_file": "",  # 可以从输入参数传入
+        "source_file": source_file,
         "collaborator_added": permission.get("collaborator_added", False),
         "owner_transferred": permission.get("owner_transferred", False),
         "user_has_full_control": permission.get("user_has_full_control", False),
         "document_verified": verify_result.get("success", False),
         "tables_created": add_result.get("tables_created", 0),
-        "blocks_created": add_result.get("total_blocks", 0)
+        "blocks_created": add_result.get("total_blocks", 0),
+        "failed_blocks": len(add_result.get("failed_blocks", [])),
+        "steps": build_step_metrics(step_timings, add_result, verify_result)
     }
 
-    # 更新 JSON 日志
-    json_log_file = output_dir / "created_docs.json"
-    json_logs = []
 
-    if json_log_file.exists():
-        with open(json_log_file, 'r', encoding='utf-8') as f:
-            json_logs = json.load(f)
+def append_log_entry(log_entry, output_dir):
+    """追加日志记录到运行日志数据库，返回数据库文件路径"""
+    return run_log.append_entry(output_dir, log_entry)
 
-    json_logs.append(log_entry)
 
-    with open(json_log_file, 'w', encoding='utf-8') as f:
-        json.dump(json_logs, f, ensure_ascii=False, indent=2)
+def print_log_summary(log_entry, db_file):
+    """打印日志摘要"""
+    print(f"\n[feishu-logger] Log entry created")
+    print(f"[feishu-logger] Title: {log_entry['title']}")
+    print(f"[feishu-logger] URL: {log_entry['url']}")
+    print(f"[feishu-logger] Permissions: collaborator={log_entry['collaborator_added']}, owner={log_entry['owner_transferred']}")
+    print(f"[feishu-logger] Verified: {log_entry['document_verified']}")
+    print(f"[feishu-logger] Tables: {log_entry['tables_created']}, Blocks: {log_entry['blocks_created']}")
+    steps = log_entry.get("steps", {})
+    if steps:
+        durations = ", ".join(f"{step}={metrics['duration_seconds']:.2f}s" for step, metrics in steps.items())
+        print(f"[feishu-logger] Steps: {durations}")
+    print(f"\n[feishu-logger] Run log: {db_file}")
 
-    # 更新 Markdown 日志
-    md_log_file = output_dir / "CREATED_DOCS.md"
 
-    md_entry = f"""
-### {title}
+def default_output_dir():
+    """默认输出到父目录（通常是主技能目录）"""
+    return Path(__file__).parent.parent
 
-- **时间**: {log_entry['time']}
-- **文档ID**: `{doc_id}`
-- **URL**: [{doc_url}]({doc_url})
-- **collaborator_added**: {log_entry['collaborator_added']}
-- **owner_transferred**: {log_entry['owner_transferred']}
-- **user_has_full_control**: {log_entry['user_has_full_control']}
-- **document_verified**: {log_entry['document_verified']}
-- **tables_created**: {log_entry['tables_created']}
-- **blocks_created**: {log_entry['blocks_created']}
-"""
 
-    if md_log_file.exists():
-        with open(md_log_file, 'r', encoding='utf-8') as f:
-            md_content = f.read()
-        # 在文档列表后面追加
-        if "## 文档列表" in md_content:
-            md_content = md_content.replace("## 文档列表", f"## 文档列表{md_entry}")
-        else:
-            md_content = f"# 飞书文档创建日志\n\n## 文档列表{md_entry}"
+def main():
+    """
+    主函数
+
+        logger.py <workflow_dir> [output_dir]     汇总工作流目录中的结果，追加一条记录
+        logger.py --report [output_dir]           从数据库生成 CREATED_DOCS.md
+        logger.py --find <标题或文档ID> [output_dir]  查询记录
+    """
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+
+    if "--report" in sys.argv:
+        output_dir = Path(args[0]) if args else default_output_dir()
+        md_file = run_log.export_markdown(output_dir)
+        print(f"[feishu-logger] {run_log.count_entries(output_dir)} entries")
+        print(f"[feishu-logger] Markdown log: {md_file}")
+        return
+
+    if "--find" in sys.argv:
+        if not args:
+            print("Usage: python logger.py --find <标题或文档ID> [output_dir]")
+            sys.exit(1)
+        output_dir = Path(args[1]) if len(args) >= 2 else default_output_dir()
+        entries = (run_log.query_entries(output_dir, document_id=args[0])
+                   or run_log.query_entries(output_dir, title=args[0]))
+        for entry in entries:
+            print(f"{entry.get('time', '')}  {entry.get('document_id', '')}  {entry.get('title', '')}  {entry.get('url', '')}")
+        print(f"[feishu-logger] {len(entries)} entries found")
+        return
+
+    if len(args) < 1:
+        print("Usage: python logger.py <workflow_dir> [output_dir]")
+        print("       python logger.py --report [output_dir]")
+        print("       python logger.py --find <标题或文档ID> [output_dir]")
+        sys.exit(1)
+
+    workflow_dir = Path(args[0])
+
+    if len(args) >= 2:
+        output_dir = Path(args[1])
     else:
-        md_content = f"# 飞书文档创建日志\n\n## 文档列表{md_entry}"
+        output_dir = default_output_dir()
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    # 加载所有结果文件
+    print(f"[feishu-logger] Loading results from: {workflow_dir}")
 
-    with open(md_log_file, 'w', encoding='utf-8') as f:
-        f.write(md_content)
+    blocks_data = load_json(workflow_dir / "step1_parse" / "blocks.json")
+    doc_info = load_json(workflow_dir / "step2_create_with_permission" / "doc_with_permission.json")
+    add_result = load_json(workflow_dir / "step3_add_blocks" / "add_result.json")
+    verify_result = load_json(workflow_dir / "step4_verify" / "verify_result.json")
+    step_timings = load_json(workflow_dir / STEP_TIMINGS_FILE)
+
+    # 汇总日志条目
+    log_entry = build_log_entry(blocks_data, doc_info, add_result, verify_result, step_timings=step_timings)
+    db_file = append_log_entry(log_entry, output_dir)
 
     # 打印摘要
-    print(f"\n[feishu-logger] Log entry created")
-    print(f"[feishu-logger] Title: {title}")
-    print(f"[feishu-logger] URL: {doc_url}")
-    print(f"[feishu-logger] Permissions: collaborator={log_entry['collaborator_added']}, owner={log_entry['owner_transferred']}")
-    print(f"[feishu-logger] Verified: {log_entry['document_verified']}")
-    print(f"[feishu-logger] Tables: {log_entry['tables_created']}, Blocks: {log_entry['blocks_created']}")
-    print(f"\n[feishu-logger] JSON log: {json_log_file}")
-    print(f"[feishu-logger] Markdown log: {md_log_file}")
+    print_log_summary(log_entry, db_file)
 
 
 if __name__ == "__main__":
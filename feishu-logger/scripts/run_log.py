@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+运行日志存储
+所有文档创建记录保存在日志目录的 SQLite 数据库 run_log.db 中（WAL 模式）：
+
+    runs(id, time, title, document_id, url, source_file, entry)
+    entry 为完整的日志记录（JSON），title / document_id / time 建有索引
+    run_steps(run_id, time, step, duration_seconds, request_count, retries, blocks)
+    每次运行的各步骤耗时和计数（含汇总行 step = 'total'），(step, time) 建有索引
+
+每次运行在一个事务中插入一行 runs 和若干行 run_steps，耗时与历史记录数无关；多个进程、线程同时写入由 SQLite 的锁串行化。
+旧版本的 created_docs.json 在第一次打开数据库时导入一次（原文件保留）。
+CREATED_DOCS.md 不再每次运行重写，需要时用 export_markdown() 从数据库生成。
+"""
+
+import os
+import json
+import sqlite3
+from pathlib import Path
+from datetime import datetime
+
+
+DB_FILE_NAME = "run_log.db"
+LEGACY_JSON_NAME = "created_docs.json"
+MARKDOWN_NAME = "CREATED_DOCS.md"
+
+# 等待其他进程释放写锁的最长时间（秒）
+BUSY_TIMEOUT_SECONDS = 30
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    time TEXT NOT NULL,
+    title TEXT NOT NULL,
+    document_id TEXT NOT NULL,
+    url TEXT NOT NULL DEFAULT '',
+    source_file TEXT NOT NULL DEFAULT '',
+    entry TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_runs_title ON runs(title);
+CREATE INDEX IF NOT EXISTS idx_runs_document_id ON runs(document_id);
+CREATE INDEX IF NOT EXISTS idx_runs_time ON runs(time);
+CREATE TABLE IF NOT EXISTS run_steps (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    time TEXT NOT NULL,
+    step TEXT NOT NULL,
+    duration_seconds REAL NOT NULL,
+    request_count INTEGER NOT NULL DEFAULT 0,
+    retries INTEGER NOT NULL DEFAULT 0,
+    blocks INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_run_steps_step_time ON run_steps(step, time);
+CREATE INDEX IF NOT EXISTS idx_run_steps_run_id ON run_steps(run_id);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+INSERT_SQL = "INSERT INTO runs (time, title, document_id, url, source_file, entry) VALUES (?, ?, ?, ?, ?, ?)"
+
+INSERT_STEP_SQL = ("INSERT INTO run_steps (run_id, time, step, duration_seconds, request_count, retries, blocks) "
+                   "VALUES (?, ?, ?, ?, ?, ?, ?)")
+
+
+def get_db_path(output_dir):
+    """日志目录中的数据库文件"""
+    return Path(output_dir) / DB_FILE_NAME
+
+
+def normalize_time(value):
+    """
+    统一为 "YYYY-MM-DD HH:MM:SS"，按字符串排序即按时间排序
+
+    文档创建时间可能是 ISO 格式（带 T、微秒），为空时使用当前时间
+    """
+    if not value:
+        return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    return str(value).replace("T", " ")[:19]
+
+
+def entry_row(entry):
+    """日志记录 -> runs 表的一行"""
+    return (
+        normalize_time(entry.get("time")),
+        entry.get("title", ""),
+        entry.get("document_id", ""),
+        entry.get("url", ""),
+        entry.get("source_file", ""),
+        json.dumps(entry, ensure_ascii=False)
+    )
+
+
+def step_rows(run_id, time, entry):
+    """日志记录中的 steps -> run_steps 表的行（旧记录没有 steps 时为空）"""
+    return [
+        (run_id, time, step, float(metrics.get("duration_seconds", 0.0)),
+         int(metrics.get("request_count", 0)), int(metrics.get("retries", 0)), int(metrics.get("blocks", 0)))
+        for step, metrics in (entry.get("steps") or {}).items()
+    ]
+
+
+def insert_entry(conn, entry):
+    """在当前事务中插入一条日志记录及其步骤指标"""
+    row = entry_row(entry)
+    run_id = conn.execute(INSERT_SQL, row).lastrowid
+    conn.executemany(INSERT_STEP_SQL, step_rows(run_id, row[0], entry))
+
+
+def connect(output_dir):
+    """
+    打开日志数据库（不存在时创建），首次打开时导入旧的 created_docs.json
+
+    连接为自动提交模式，写操作显式使用事务；每个线程使用自己的连接
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(get_db_path(output_dir)), timeout=BUSY_TIMEOUT_SECONDS, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    import_legacy_json(conn, output_dir)
+    return conn
+
+
+def import_legacy_json(conn, output_dir):
+    """
+    把旧版本的 created_docs.json 导入数据库（只导入一次，记录在 meta 表中）
+
+    返回导入的记录数
+    """
+    legacy_file = Path(output_dir) / LEGACY_JSON_NAME
+    if not legacy_file.exists():
+        return 0
+    if conn.execute("SELECT 1 FROM meta WHERE key = 'legacy_imported'").fetchone():
+        return 0
+
+    # 写锁内再检查一次：多个进程同时首次打开时只有一个导入
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if conn.execute("SELECT 1 FROM meta WHERE key = 'legacy_imported'").fetchone():
+            conn.execute("ROLLBACK")
+            return 0
+        try:
+            with open(legacy_file, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except ValueError:
+            print(f"[feishu-logger] [WARN] 无法解析旧日志，跳过导入: {legacy_file}")
+            entries = []
+        for entry in entries:
+            if isinstance(entry, dict):
+                insert_entry(conn, entry)
+        conn.execute("INSERT INTO meta (key, value) VALUES ('legacy_imported', ?)", (datetime.now().isoformat(),))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+    if entries:
+        print(f"[feishu-logger] [INFO] 已从 {legacy_file.name} 导入 {len(entries)} 条历史记录")
+    return len(entries)
+
+
+def append_entry(output_dir, entry):
+    """追加一条日志记录，返回数据库文件路径"""
+    conn = connect(output_dir)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            insert_entry(conn, entry)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+    return get_db_path(output_dir)
+
+
+def time_conditions(column, since, until):
+    """时间范围的 SQL 条件和参数（包含 since，不包含 until）"""
+    conditions = []
+    params = []
+    if since is not None:
+        conditions.append(f"{column} >= ?")
+        params.append(normalize_time(since))
+    if until is not None:
+        conditions.append(f"{column} < ?")
+        params.append(normalize_time(until))
+    return conditions, params
+
+
+def query_entries(output_dir, title=None, document_id=None, since=None, until=None, limit=None):
+    """
+    按标题、文档 ID、时间范围查询日志记录，最新的在前
+
+    since / until 为时间字符串（"YYYY-MM-DD" 或 "YYYY-MM-DD HH:MM:SS"），包含 since，不包含 until
+    """
+    conditions = []
+    params = []
+    if title is not None:
+        conditions.append("title = ?")
+        params.append(title)
+    if document_id is not None:
+        conditions.append("document_id = ?")
+        params.append(document_id)
+    time_sql, time_params = time_conditions("time", since, until)
+    conditions += time_sql
+    params += time_params
+
+    sql = "SELECT entry FROM runs"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += " ORDER BY time DESC, id DESC"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(int(limit))
+
+    conn = connect(output_dir)
+    try:
+        return [json.loads(row[0]) for row in conn.execute(sql, params)]
+    finally:
+        conn.close()
+
+
+def query_step_metrics(output_dir, step=None, since=None, until=None):
+    """
+    按步骤、时间范围查询步骤指标，按时间排序
+
+    返回 [{"run_id", "time", "step", "duration_seconds", "request_count", "retries", "blocks"}]
+    """
+    conditions, params = time_conditions("time", since, until)
+    if step is not None:
+        conditions.insert(0, "step = ?")
+        params.insert(0, step)
+
+    sql = "SELECT run_id, time, step, duration_seconds, request_count, retries, blocks FROM run_steps"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += " ORDER BY time, run_id"
+
+    conn = connect(output_dir)
+    try:
+        conn.row_factory = sqlite3.Row
+        return [dict(row) for row in conn.execute(sql, params)]
+    finally:
+        conn.close()
+
+
+def query_slowest_runs(output_dir, since=None, until=None, limit=10):
+    """
+    整个运行耗时最长的文档（按 total 步骤），最慢的在前
+
+    返回 [{"time", "title", "document_id", "url", "duration_seconds", "request_count", "retries", "blocks"}]
+    """
+    conditions, params = time_conditions("s.time", since, until)
+    sql = ("SELECT r.time, r.title, r.document_id, r.url, s.duration_seconds, s.request_count, s.retries, s.blocks "
+           "FROM run_steps s JOIN runs r ON r.id = s.run_id WHERE s.step = 'total'")
+    if conditions:
+        sql += " AND " + " AND ".join(conditions)
+    sql += " ORDER BY s.duration_seconds DESC LIMIT ?"
+    params.append(int(limit))
+
+    conn = connect(output_dir)
+    try:
+        conn.row_factory = sqlite3.Row
+        return [dict(row) for row in conn.execute(sql, params)]
+    finally:
+        conn.close()
+
+
+def count_entries(output_dir):
+    """日志记录总数"""
+    conn = connect(output_dir)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM runs").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def format_markdown_entry(entry):
+    """一条日志记录的 Markdown"""
+    return f"""
+### {entry.get('title', '')}
+
+- **时间**: {entry.get('time', '')}
+- **文档ID**: `{entry.get('document_id', '')}`
+- **URL**: [{entry.get('url', '')}]({entry.get('url', '')})
+- **collaborator_added**: {entry.get('collaborator_added', False)}
+- **owner_transferred**: {entry.get('owner_transferred', False)}
+- **user_has_full_control**: {entry.get('user_has_full_control', False)}
+- **document_verified**: {entry.get('document_verified', False)}
+- **tables_created**: {entry.get('tables_created', 0)}
+- **blocks_created**: {entry.get('blocks_created', 0)}
+"""
+
+
+def export_markdown(output_dir, path=None, limit=None):
+    """
+    从数据库生成 CREATED_DOCS.md（最新的在前），返回文件路径
+
+    逐行写入临时文件后替换，生成过程中不占用写锁，也不会留下写了一半的报告
+    """
+    md_file = Path(path) if path else Path(output_dir) / MARKDOWN_NAME
+    tmp_file = md_file.with_name(md_file.name + ".tmp")
+
+    sql = "SELECT entry FROM runs ORDER BY time DESC, id DESC"
+    params = []
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(int(limit))
+
+    conn = connect(output_dir)
+    try:
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            f.write("# 飞书文档创建日志\n\n## 文档列表")
+            for (entry,) in conn.execute(sql, params):
+                f.write(format_markdown_entry(json.loads(entry)))
+    finally:
+        conn.close()
+    os.replace(tmp_file, md_file)
+    return md_file
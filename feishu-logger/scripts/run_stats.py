@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+运行历史统计 - 日志记录子技能的查询工具
+从运行日志数据库（run_steps 表）统计一段时间内：
+- 各步骤耗时的 p50 / p95 / p99、平均值和最大值
+- 按天或按周的吞吐趋势（文档数、块数、块/秒、每个文档的请求数、重试次数）
+- 耗时最长的文档
+"""
+
+import sys
+import json
+import unicodedata
+from pathlib import Path
+from datetime import datetime, timedelta
+
+import run_log
+
+
+# 步骤的显示顺序（其他步骤排在后面）
+STEP_ORDER = ["parse", "create", "preprocess", "permissions", "add_blocks", "transfer", "verify", "total"]
+
+PERCENTILES = (50, 95, 99)
+
+DEFAULT_TOP = 10
+
+# 带值的命令行参数
+VALUE_OPTIONS = {"--since", "--until", "--days", "--step", "--top", "--interval"}
+
+
+def percentile(sorted_values, pct):
+    """已排序数值的百分位数（线性插值）"""
+    if not sorted_values:
+        return 0.0
+    rank = (len(sorted_values) - 1) * pct / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (rank - lower)
+
+
+def summarize_durations(durations):
+    """一组耗时的统计：count / p50 / p95 / p99 / mean / max"""
+    values = sorted(durations)
+    summary = {"count": len(values)}
+    for pct in PERCENTILES:
+        summary[f"p{pct}"] = round(percentile(values, pct), 3)
+    summary["mean"] = round(sum(values) / len(values), 3) if values else 0.0
+    summary["max"] = round(values[-1], 3) if values else 0.0
+    return summary
+
+
+def step_sort_key(step):
+    return (STEP_ORDER.index(step) if step in STEP_ORDER else len(STEP_ORDER), step)
+
+
+def step_percentiles(metrics):
+    """按步骤统计耗时：{步骤: summarize_durations(...)}"""
+    durations = {}
+    for row in metrics:
+        durations.setdefault(row["step"], []).append(row["duration_seconds"])
+    return {step: summarize_durations(durations[step]) for step in sorted(durations, key=step_sort_key)}
+
+
+def period_key(time, interval):
+    """记录时间所属的统计周期：按天为日期，按周为该周周一的日期"""
+    day = time[:10]
+    if interval == "week":
+        date = datetime.strptime(day, "%Y-%m-%d")
+        return (date - timedelta(days=date.weekday())).strftime("%Y-%m-%d")
+    return day
+
+
+def throughput_trend(total_metrics, interval="day"):
+    """
+    按周期汇总整个运行（total 步骤）的吞吐
+
+    blocks_per_second 为该周期内块数之和除以运行耗时之和
+    """
+    periods = {}
+    for row in total_metrics:
+        periods.setdefault(period_key(row["time"], interval), []).append(row)
+
+    trend = []
+    for period in sorted(periods):
+        rows = periods[period]
+        duration = sum(row["duration_seconds"] for row in rows)
+        blocks = sum(row["blocks"] for row in rows)
+        trend.append({
+            "period": period,
+            "documents": len(rows),
+            "blocks": blocks,
+            "duration_seconds": round(duration, 3),
+            "blocks_per_second": round(blocks / duration, 2) if duration > 0 else 0.0,
+            "requests_per_document": round(sum(row["request_count"] for row in rows) / len(rows), 1),
+            "retries": sum(row["retries"] for row in rows),
+            "p95_seconds": round(percentile(sorted(row["duration_seconds"] for row in rows), 95), 3)
+        })
+    return trend
+
+
+def build_report(output_dir, since=None, until=None, step=None, top=DEFAULT_TOP, interval="day"):
+    """
+    生成统计报告（字典），供命令行打印或输出 JSON
+
+    step 不为空时只统计该步骤的耗时；趋势和最慢文档始终按整个运行（total）统计
+    """
+    metrics = run_log.query_step_metrics(output_dir, step=step, since=since, until=until)
+    total_metrics = (metrics if step == "total"
+                     else run_log.query_step_metrics(output_dir, step="total", since=since, until=until))
+    return {
+        "since": since,
+        "until": until,
+        "interval": interval,
+        "runs": len(total_metrics),
+        "steps": step_percentiles(metrics),
+        "trend": throughput_trend(total_metrics, interval),
+        "slowest": run_log.query_slowest_runs(output_dir, since=since, until=until, limit=top)
+    }
+
+
+def pad(text, width, left=False):
+    """按显示宽度补齐（中文字符占两列）"""
+    text = str(text)
+    display_width = sum(2 if unicodedata.east_asian_width(char) in "WF" else 1 for char in text)
+    padding = " " * max(0, width - display_width)
+    return text + padding if left else padding + text
+
+
+def print_report(report):
+    """以表格形式打印统计报告"""
+    window = f"{report['since'] or '最早'} ~ {report['until'] or '现在'}"
+    print(f"[feishu-logger] 运行统计: {window}，共 {report['runs']} 次运行")
+
+    if not report["steps"]:
+        print("[INFO] 时间范围内没有步骤耗时记录")
+        return
+
+    print("\n## 步骤耗时（秒）")
+    print(pad("步骤", 16, left=True) + "".join(pad(header, width) for header, width in
+          [("次数", 6), ("p50", 10), ("p95", 10), ("p99", 10), ("平均", 10), ("最大", 10)]))
+    for step, summary in report["steps"].items():
+        print(f"{pad(step, 16, left=True)}{summary['count']:>6}{summary['p50']:>10.2f}{summary['p95']:>10.2f}"
+              f"{summary['p99']:>10.2f}{summary['mean']:>10.2f}{summary['max']:>10.2f}")
+
+    if report["trend"]:
+        print(f"\n## 吞吐趋势（按{'周' if report['interval'] == 'week' else '天'}）")
+        print(pad("周期", 14, left=True) + "".join(pad(header, width) for header, width in
+              [("文档", 6), ("块数", 8), ("块/秒", 9), ("请求/文档", 12), ("重试", 6), ("p95(s)", 9)]))
+        for row in report["trend"]:
+            print(f"{row['period']:<14}{row['documents']:>6}{row['blocks']:>8}{row['blocks_per_second']:>9.1f}"
+                  f"{row['requests_per_document']:>12.1f}{row['retries']:>6}{row['p95_seconds']:>9.2f}")
+
+    if report["slowest"]:
+        print(f"\n## 最慢的 {len(report['slowest'])} 个文档")
+        for row in report["slowest"]:
+            print(f"  {row['duration_seconds']:>8.2f}s  {row['blocks']:>5} 块  {row['request_count']:>4} 请求  "
+                  f"{row['time']}  {row['title']}  {row['document_id']}")
+
+
+def get_option(name, default=None):
+    """读取 --name value 形式的命令行参数"""
+    if name in sys.argv:
+        index = sys.argv.index(name)
+        if index + 1 < len(sys.argv):
+            return sys.argv[index + 1]
+    return default
+
+
+def get_positional_args():
+    """位置参数（跳过 --flag 及带值参数的值）"""
+    args = []
+    skip_next = False
+    for arg in sys.argv[1:]:
+        if skip_next:
+            skip_next = False
+            continue
+        if arg in VALUE_OPTIONS:
+            skip_next = True
+            continue
+        if arg.startswith("--"):
+            continue
+        args.append(arg)
+    return args
+
+
+def main():
+    """
+    主函数
+
+        run_stats.py [output_dir] [--since 日期] [--until 日期] [--days N]
+                     [--step 步骤] [--top N] [--interval day|week] [--json]
+
+    --days N 统计最近 N 天（与 --since 同时给出时以 --since 为准）
+    """
+    args = get_positional_args()
+    output_dir = Path(args[0]) if args else Path(__file__).parent.parent
+
+    since = get_option("--since")
+    until = get_option("--until")
+    days = get_option("--days")
+    if since is None and days is not None:
+        since = (datetime.now() - timedelta(days=float(days))).strftime("%Y-%m-%d %H:%M:%S")
+
+    interval = get_option("--interval", "day")
+    if interval not in ("day", "week"):
+        print("错误: --interval 只能是 day 或 week")
+        sys.exit(1)
+
+    if not run_log.get_db_path(output_dir).exists():
+        print(f"[FAIL] 没有运行日志: {run_log.get_db_path(output_dir)}")
+        sys.exit(1)
+
+    report = build_report(output_dir, since=since, until=until, step=get_option("--step"),
+                          top=int(get_option("--top", DEFAULT_TOP)), interval=interval)
+
+    if "--json" in sys.argv:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
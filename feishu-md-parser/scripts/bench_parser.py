@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Markdown 解析器性能测试
+生成合成语料（默认 50MB），测量解析吞吐量（行/秒）
+
+可以用 --baseline 指定另一个版本的 md_parser.py 做前后对比，例如：
+    git show <旧版本>:feishu-md-parser/scripts/md_parser.py > /tmp/md_parser_old.py
+    python bench_parser.py --baseline /tmp/md_parser_old.py
+"""
+
+import io
+import sys
+import time
+import random
+import importlib.util
+from collections import deque
+from pathlib import Path
+
+
+DEFAULT_SIZE_MB = 50
+DEFAULT_REPEAT = 3
+
+# 合成语料的行模板及权重：以普通段落为主，接近真实文档的分布
+LINE_TEMPLATES = [
+    (40, "这是一段普通的正文内容，包含 **粗体** 文字和一些说明 {n}。"),
+    (15, "Plain paragraph line {n} with some words, a `code span` and a [link](https://example.com/{n})."),
+    (5, "## 第 {n} 节"),
+    (2, "### Section {n}"),
+    (8, "- 列表项 {n}"),
+    (3, "- **重点** 列表项 {n}"),
+    (5, "{n}. 有序列表项"),
+    (3, "- [ ] 待办事项 {n}"),
+    (1, "- [x] 已完成事项 {n}"),
+    (3, "> 引用内容 {n}"),
+    (1, "---"),
+    (1, "![图片 {n}](https://example.com/{n}.png)"),
+]
+
+# 多行结构
+TABLE_SNIPPET = "| 列1 | 列2 | 列3 |\n|-----|-----|-----|\n| a{n} | b{n} | c{n} |\n| d{n} | e{n} | f{n} |"
+CODE_SNIPPET = "```python\ndef func_{n}():\n    return {n}\n```"
+CALLOUT_SNIPPET = ":::tip\n提示内容 {n}\n:::"
+
+
+def load_parser(path):
+    """按文件路径加载一个 md_parser 模块"""
+    spec = importlib.util.spec_from_file_location(f"md_parser_bench_{abs(hash(str(path)))}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def generate_corpus(size_mb, seed=42):
+    """生成约 size_mb MB 的合成 Markdown 语料"""
+    rng = random.Random(seed)
+    weights = [w for w, _ in LINE_TEMPLATES]
+    templates = [t for _, t in LINE_TEMPLATES]
+    target = size_mb * 1024 * 1024
+
+    parts = []
+    size = 0
+    n = 0
+    while size < target:
+        n += 1
+        roll = rng.random()
+        if roll < 0.01:
+            chunk = TABLE_SNIPPET.format(n=n)
+        elif roll < 0.02:
+            chunk = CODE_SNIPPET.format(n=n)
+        elif roll < 0.025:
+            chunk = CALLOUT_SNIPPET.format(n=n)
+        else:
+            chunk = rng.choices(templates, weights)[0].format(n=n)
+        if rng.random() < 0.2:
+            chunk += "\n"
+        parts.append(chunk)
+        size += len(chunk.encode('utf-8')) + 1
+
+    return "\n".join(parts) + "\n"
+
+
+def run_parser(module, corpus):
+    """完整解析一遍语料，返回块数量"""
+    if hasattr(module, "iter_blocks"):
+        counter = deque(enumerate(module.iter_blocks(io.StringIO(corpus)), 1), maxlen=1)
+        return counter[0][0] if counter else 0
+    return len(module.parse_markdown_to_blocks(corpus)["blocks"])
+
+
+def bench(module, corpus, line_count, repeat):
+    """多次运行取最快的一次，返回 (秒, 块数, 行/秒)"""
+    best = None
+    blocks = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        blocks = run_parser(module, corpus)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, blocks, line_count / best
+
+
+def get_option(name, default=None):
+    """读取 --name value 形式的命令行参数"""
+    if name in sys.argv:
+        index = sys.argv.index(name)
+        if index + 1 < len(sys.argv):
+            return sys.argv[index + 1]
+    return default
+
+
+def main():
+    """主函数"""
+    if "--help" in sys.argv or "-h" in sys.argv:
+        print("用法: python bench_parser.py [--size-mb N] [--repeat N] [--corpus file.md] [--baseline old_md_parser.py]")
+        sys.exit(0)
+
+    size_mb = int(get_option("--size-mb", DEFAULT_SIZE_MB))
+    repeat = int(get_option("--repeat", DEFAULT_REPEAT))
+    corpus_file = get_option("--corpus")
+    baseline_file = get_option("--baseline")
+
+    if corpus_file:
+        with open(corpus_file, 'r', encoding='utf-8') as f:
+            corpus = f.read()
+        source = corpus_file
+    else:
+        corpus = generate_corpus(size_mb)
+        source = f"合成语料 {size_mb}MB"
+
+    line_count = corpus.count("\n") + 1
+
+    print("=" * 70)
+    print("Markdown Parser Benchmark")
+    print("=" * 70)
+    print(f"语料: {source}")
+    print(f"大小: {len(corpus.encode('utf-8')) / 1024 / 1024:.1f} MB, {line_count} 行")
+    print(f"重复: {repeat} 次（取最快）")
+    print()
+
+    candidates = []
+    if baseline_file:
+        candidates.append(("baseline", Path(baseline_file)))
+    candidates.append(("current", Path(__file__).parent / "md_parser.py"))
+
+    results = {}
+    for name, path in candidates:
+        module = load_parser(path)
+        elapsed, blocks, lines_per_sec = bench(module, corpus, line_count, repeat)
+        results[name] = lines_per_sec
+        print(f"[{name}] {path}")
+        print(f"  耗时: {elapsed:.2f}s, 块数: {blocks}")
+        print(f"  吞吐: {lines_per_sec:,.0f} 行/秒, {len(corpus) / elapsed / 1024 / 1024:.1f} M字符/秒")
+        print()
+
+    if "baseline" in results:
+        print(f"加速比: {results['current'] / results['baseline']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
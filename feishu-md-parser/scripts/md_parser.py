@@ -7,12 +7,24 @@ Markdown 解析器 - 子技能1（增强版）
 输出：blocks.json
 """
 
+import io
 import sys
 import json
 import re
+import string
 import time
 from pathlib import Path
-from typing import List, Dict, Any
+from urllib.parse import quote
+from typing import List, Dict, Any, Optional, Iterable, Iterator
+
+import parse_cache
+
+
+# 零宽字符：零宽空格、零宽非连字符、零宽连字符、零宽非断空格，用一次 str.translate 全部删除
+ZERO_WIDTH_TABLE = str.maketrans('', '', '\u200b\u200c\u200d\ufeff')
+ZERO_WIDTH_RE = re.compile('[\u200b\u200c\u200d\ufeff]')
+
+CELL_BOLD_RE = re.compile(r'\*\*(.+?)\*\*')
 
 
 def clean_cell_content(content: str) -> str:
@@ -21,15 +33,12 @@ def clean_cell_content(content: str) -> str:
         return ""
 
     content = str(content).strip()
-
-    # 移除零宽字符
-    content = content.replace('\u200b', '')  # 零宽空格
-    content = content.replace('\u200c', '')  # 零宽非连字符
-    content = content.replace('\u200d', '')  # 零宽连字符
-    content = content.replace('\ufeff', '')  # 零宽非断空格
+    if not content.isascii():
+        content = content.translate(ZERO_WIDTH_TABLE)
 
     # 移除 ** 粗体标记
-    content = re.sub(r'\*\*(.+?)\*\*', r'\1', content)
+    if '**' in content:
+        content = CELL_BOLD_RE.sub(r'\1', content)
 
     # 如果有换行，只取第一行
     if '\n' in content:
@@ -38,37 +47,277 @@ def clean_cell_content(content: str) -> str:
     return content
 
 
-def make_text_run(text: str, bold: bool = False) -> Dict[str, Any]:
+def make_text_run(text: str, bold: bool = False,
+                  style: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     """创建文本运行元素 - 自动清理零宽字符"""
-    # 清理零宽字符
-    text = text.replace('\u200b', '')
-    text = text.replace('\u200c', '')
-    text = text.replace('\u200d', '')
-    text = text.replace('\ufeff', '')
+    if ZERO_WIDTH_RE.search(text):
+        text = text.translate(ZERO_WIDTH_TABLE)
     result = {"text_run": {"content": text}}
     if bold:
-        result["text_run"]["text_element_style"] = {"bold": True}
+        style = {**(style or {}), "bold": True}
+    if style:
+        result["text_run"]["text_element_style"] = style
     return result
 
 
+# ==================== 行内格式 ====================
+# 一次正则扫描切分出文本、转义字符、行内代码、链接和强调分隔符，
+# 再用每种样式一个“待闭合开始符”的方式配对分隔符。
+# 链接的 label 不含 '['、url 不含 ']'，从每个 '[' 或 '](' 开始的尝试最多扫描到下一个括号，
+# 互不重叠，未闭合的括号不会各自扫描到行尾，整体是线性时间。
+# 行内代码按 CommonMark 只由等长的反引号串闭合：各长度的反引号串位置预先算好，
+# 查找结束符的游标只向后移动，未闭合的反引号同样不会重复扫描
+
+# 每个分支都以固定字符开头，正则引擎可以按首字符集合快速跳过普通文本；
+# 词法分析按匹配到的第一个字符区分类型
+INLINE_TOKEN_RE = re.compile(
+    r'\\[\\`*~\[\]()]'                      # 转义字符，按原样输出
+    r'|`+'                                  # 行内代码的开始反引号串
+    r'|\[([^\[\]\n]*)\]\(([^\])\s]+)\)'     # 链接 [label](url)
+    r'|\*\*?|~~'                            # 粗体 / 斜体 / 删除线分隔符
+)
+
+# 除 * 以外的行内标记字符和零宽字符；都不含时只需处理 **（最常见的写法），走 split 快速路径
+INLINE_SPECIAL_RE = re.compile('[\\\\`~\\[\u200b\u200c\u200d\ufeff]')
+
+DELIMITER_STYLES = {'**': 'bold', '*': 'italic', '~~': 'strikethrough'}
+
+# 与 quote(url, safe='') 相同的 ASCII 编码表：字母、数字和 _.-~ 保持不变，其余编码为 %XX
+URL_SAFE_CHARS = frozenset(string.ascii_letters + string.digits + '_.-~')
+URL_QUOTE_TABLE = [chr(code) if chr(code) in URL_SAFE_CHARS else f'%{code:02X}' for code in range(128)]
+
+
+def quote_url(url: str) -> str:
+    """飞书要求链接地址经过 URL 编码；纯 ASCII 地址直接查表（比 quote 快），结果相同"""
+    if url.isascii():
+        return url.translate(URL_QUOTE_TABLE)
+    return quote(url, safe='')
+
+
+BACKTICK_RUN_RE = re.compile(r'`+')
+
+
+def _backtick_runs(text: str) -> Dict[int, list]:
+    """行内所有反引号串的起始位置，按长度分组：{长度: [位置列表, 游标]}"""
+    runs = {}
+    for match in BACKTICK_RUN_RE.finditer(text):
+        runs.setdefault(match.end() - match.start(), [[], 0])[0].append(match.start())
+    return runs
+
+
+def _find_closing_run(runs: Dict[int, list], size: int, after: int) -> Optional[int]:
+    """after 之后第一个长度为 size 的反引号串的位置，没有时返回 None（after 单调递增，游标只前进）"""
+    entry = runs.get(size)
+    if entry is None:
+        return None
+    positions, cursor = entry
+    while cursor < len(positions) and positions[cursor] < after:
+        cursor += 1
+    entry[1] = cursor
+    return positions[cursor] if cursor < len(positions) else None
+
+
+def _tokenize_inline(text: str) -> List[tuple]:
+    """
+    切分行内标记，返回 [(类型, 值, 能否作为开始, 能否作为结束)]
+
+    分隔符后面紧跟非空白才能作为开始，前面紧跟非空白才能作为结束，
+    这样 "2 * 3" 中的星号不会被当成斜体；! 开头的链接是图片语法，按原文保留。
+    行内代码从开始反引号串到下一个等长的反引号串，没有时反引号按原文保留
+    """
+    tokens = []
+    append = tokens.append
+    length = len(text)
+    backtick_runs = None
+    pos = 0   # 已输出到的位置
+    scan = 0  # finditer 的起点：行内代码闭合后从结束符之后重新扫描（很少发生）
+    while scan is not None:
+        resume, scan = scan, None
+        for match in INLINE_TOKEN_RE.finditer(text, resume):
+            start, end = match.span()
+            token = match.group()
+            first = token[0]
+            if first == '`':
+                size = end - start
+                # 常见情况：之后第一处 size 个反引号就是一个完整的反引号串（开始串是最长匹配，
+                # 找到的位置一定是某个串的开头），即结束符。没找到或落在更长的串中时改用位置表，
+                # 位置表只计算一次，未闭合的反引号不会重复扫描到行尾
+                close = text.find(token, end) if backtick_runs is None else -1
+                if close == -1 or text[close + size:close + size + 1] == '`':
+                    if backtick_runs is None:
+                        backtick_runs = _backtick_runs(text)
+                    close = _find_closing_run(backtick_runs, size, end)
+                    if close is None:
+                        # 没有等长的结束符：反引号留在普通文本中
+                        continue
+                if start > pos:
+                    append(("text", text[pos:start], False, False))
+                append(("code", text[end:close], False, False))
+                pos = scan = close + size
+                break
+            if start > pos:
+                append(("text", text[pos:start], False, False))
+            pos = end
+            if first == '*' or first == '~':
+                can_open = end < length and not text[end].isspace()
+                can_close = start > 0 and not text[start - 1].isspace()
+                append(("delim", token, can_open, can_close))
+            elif first == '[':
+                if start > 0 and text[start - 1] == '!':
+                    append(("text", token, False, False))
+                else:
+                    append(("link", match.groups(), False, False))
+            else:
+                append(("escape", token[1], False, False))
+    if pos < length:
+        append(("text", text[pos:], False, False))
+    return tokens
+
+
+def _match_delimiters(tokens: List[tuple]) -> None:
+    """
+    为分隔符配对：成对的分隔符原地替换为 ("style", 样式名) token，
+    未配对的保留为 delim，按普通文本输出
+    """
+    openers = {}
+    for index, (kind, value, can_open, can_close) in enumerate(tokens):
+        if kind != "delim":
+            continue
+        if value in openers and can_close:
+            style_token = ("style", DELIMITER_STYLES[value], False, False)
+            tokens[openers.pop(value)] = style_token
+            tokens[index] = style_token
+        elif can_open:
+            openers[value] = index
+
+
+def _build_text_run(content: str, style: Dict[str, Any]) -> Dict[str, Any]:
+    """创建 text_run 元素（内容已清理过零宽字符）"""
+    if style:
+        return {"text_run": {"content": content, "text_element_style": style}}
+    return {"text_run": {"content": content}}
+
+
+def _parse_bold_only(parts: List[str]) -> List[Dict[str, Any]]:
+    """
+    只含 ** 分隔符的文本（parts 为 text.split('**')），结果与完整的词法分析相同
+
+    第 k 个分隔符位于 parts[k] 和 parts[k + 1] 之间，开始/结束的判定和配对规则
+    与 _tokenize_inline / _match_delimiters 一致，但不需要正则扫描和 token 列表
+    """
+    last = len(parts) - 1
+    middle = parts[1]
+    if last == 2 and middle and not middle[0].isspace() and not middle[-1].isspace():
+        # 最常见的情况：一行中只有一对 **粗体**
+        elements = [{"text_run": {"content": parts[0]}}] if parts[0] else []
+        elements.append({"text_run": {"content": middle, "text_element_style": {"bold": True}}})
+        if parts[2]:
+            elements.append({"text_run": {"content": parts[2]}})
+        return elements
+
+    matched = set()
+    opener = None
+    for k in range(last):
+        before, after = parts[k], parts[k + 1]
+        can_close = not before[-1].isspace() if before else k > 0
+        if opener is not None and can_close:
+            matched.add(opener)
+            matched.add(k)
+            opener = None
+        elif (not after[0].isspace() if after else k + 1 < last):
+            opener = k
+
+    runs = []  # [[内容片段], 是否粗体]，最后再拼接，避免反复拼接长字符串
+    bold = False
+    for k, part in enumerate(parts):
+        if k:
+            if k - 1 in matched:
+                bold = not bold
+            else:
+                part = '**' + part
+        if not part:
+            continue
+        if runs and runs[-1][1] == bold:
+            runs[-1][0].append(part)
+        else:
+            runs.append([[part], bold])
+    return [_build_text_run(''.join(pieces), {"bold": True} if bold else None) for pieces, bold in runs]
+
+
 def parse_markdown_text(content: str) -> List[Dict[str, Any]]:
-    """解析 Markdown 文本，转换 **粗体** 为飞书样式"""
+    """
+    解析行内 Markdown，生成带样式的 text_run 元素
+
+    支持 **粗体**、*斜体*、~~删除线~~、`行内代码`、[链接](url)，可以嵌套；
+    样式相同的相邻文本合并为一个 text_run
+    """
     if not content:
         return [{"text_run": {"content": ""}}]
 
+    text = content.strip()
+    if not INLINE_SPECIAL_RE.search(text):
+        if '*' not in text:
+            return [{"text_run": {"content": text}}] if text else [make_text_run(content)]
+        parts = text.split('**')
+        if text.count('*') == 2 * (len(parts) - 1):
+            return _parse_bold_only(parts) or [make_text_run(content)]
+    elif not text.isascii() and ZERO_WIDTH_RE.search(text):
+        text = text.translate(ZERO_WIDTH_TABLE)
+
+    tokens = _tokenize_inline(text)
+    if '*' in text or '~' in text:
+        _match_delimiters(tokens)
+
     elements = []
-    parts = content.split('**')
+    active = {}        # 当前生效的强调样式，切换时整体替换
+    style = None       # 上一个 text_run 的样式
+    text_run = None
+    pieces = None      # 相邻同样式文本的片段，最后再拼接，避免反复拼接长字符串
+    for kind, value, _, _ in tokens:
+        if kind == "style":
+            if value in active:
+                active = {name: True for name in active if name != value}
+            else:
+                active = {**active, value: True}
+            continue
 
-    for idx, part in enumerate(parts):
-        if part:
-            is_bold = (idx % 2 == 1)
-            part = part.replace('*', '').strip()
-            if part:
-                elements.append(make_text_run(part, bold=is_bold))
+        if kind == "code":
+            run_style = {**active, "inline_code": True}
+        elif kind == "link":
+            value, url = value
+            run_style = {**active, "link": {"url": quote_url(url)}}
+        else:
+            run_style = active
 
+        if not value:
+            continue
+        if text_run is not None and run_style == style:
+            if pieces is None:
+                pieces = [text_run["content"]]
+            pieces.append(value)
+            continue
+        if pieces is not None:
+            text_run["content"] = ''.join(pieces)
+            pieces = None
+        text_run = {"content": value, "text_element_style": dict(run_style)} if run_style else {"content": value}
+        elements.append({"text_run": text_run})
+        style = run_style
+
+    if pieces is not None:
+        text_run["content"] = ''.join(pieces)
     return elements if elements else [make_text_run(content)]
 
 
+def parse_cell_elements(content: str) -> List[Dict[str, Any]]:
+    """表格单元格的行内格式：只取第一行"""
+    content = str(content).strip()
+    if not content.isascii():
+        content = content.translate(ZERO_WIDTH_TABLE)
+    if '\n' in content:
+        content = content.split('\n')[0].strip()
+    return parse_markdown_text(content)
+
+
 def get_callout_style(style_name: str) -> Dict[str, Any]:
     """
     获取 callout 样式配置
@@ -99,24 +348,260 @@ def get_callout_style(style_name: str) -> Dict[str, Any]:
     return styles.get(style_name.lower(), styles["info"])
 
 
-def parse_markdown_to_blocks(markdown_text: str, include_first_title: bool = False) -> Dict[str, Any]:
+# ==================== 行分类（词法分析） ====================
+# 每行只按第一个有效字符分派一次，正则全部预编译；
+# 普通段落（最常见的情况）只需要一次字典查找和一次 '|' 检查
+
+HEADING_RE = re.compile(r'^(#{1,9})\s')
+TODO_RE = re.compile(r'^-\s+\[([ x])\]\s*(.*)')
+ORDERED_RE = re.compile(r'^\d+\.\s')
+IMAGE_RE = re.compile(r'^!\[([^\]]*)\]\(([^\)]+)\)$')
+TABLE_SEPARATOR_RE = re.compile(r'^\|?\s*:?-+:?\s*\|')
+
+# 行的类型
+TOKEN_HEADING = "heading"
+TOKEN_DIVIDER = "divider"
+TOKEN_QUOTE = "quote"
+TOKEN_TODO = "todo"
+TOKEN_BULLET = "bullet"
+TOKEN_ORDERED = "ordered"
+TOKEN_IMAGE = "image"
+TOKEN_TABLE = "table"
+TOKEN_CODE_FENCE = "code_fence"
+TOKEN_TEXT = "text"
+
+
+def _classify_plain(line: str, stripped: str):
+    """没有专门前缀的行：表格行、代码块起始或普通文本"""
+    if '|' in line:
+        return TOKEN_TABLE, None
+    if stripped.startswith('```'):
+        return TOKEN_CODE_FENCE, None
+    return TOKEN_TEXT, line
+
+
+def _classify_hash(line: str, stripped: str):
+    # 标题必须从行首开始（不允许缩进）
+    if line[0] == '#':
+        match = HEADING_RE.match(line)
+        if match:
+            return TOKEN_HEADING, (len(match.group(1)), line.lstrip('#').strip())
+    return _classify_plain(line, stripped)
+
+
+def _classify_dash(line: str, stripped: str):
+    if stripped == '---':
+        return TOKEN_DIVIDER, None
+    match = TODO_RE.match(stripped)
+    if match:
+        return TOKEN_TODO, (match.group(1).lower() == 'x', match.group(2).strip())
+    if stripped.startswith('- '):
+        return TOKEN_BULLET, stripped[2:]
+    return _classify_plain(line, stripped)
+
+
+def _classify_quote(line: str, stripped: str):
+    return TOKEN_QUOTE, stripped[1:].strip()
+
+
+def _classify_bang(line: str, stripped: str):
+    match = IMAGE_RE.match(stripped)
+    if match:
+        return TOKEN_IMAGE, (match.group(1), match.group(2))
+    return _classify_plain(line, stripped)
+
+
+def _classify_digit(line: str, stripped: str):
+    match = ORDERED_RE.match(stripped)
+    if match:
+        return TOKEN_ORDERED, stripped[match.end():]
+    return _classify_plain(line, stripped)
+
+
+LINE_DISPATCH = {
+    '#': _classify_hash,
+    '-': _classify_dash,
+    '>': _classify_quote,
+    '!': _classify_bang,
+}
+
+
+def classify_line(line: str):
     """
-    将 Markdown 转换为飞书块
-    支持 25 种飞书文档块类型
+    对一行（已去掉行尾空白、非空）分类，返回 (类型, 内容)
 
-    返回格式：
-    {
-        "blocks": [...],
-        "metadata": {...}
+    按第一个有效字符分派，与原先逐个 startswith / re.match 尝试的判定顺序和结果一致
+    """
+    stripped = line.lstrip()
+    first_char = stripped[0]
+    classifier = LINE_DISPATCH.get(first_char)
+    if classifier is not None:
+        return classifier(line, stripped)
+    if first_char.isdecimal():  # 与正则 \d 相同（Unicode Nd 类别）
+        return _classify_digit(line, stripped)
+    return _classify_plain(line, stripped)
+
+
+# ==================== 块构建 ====================
+
+def build_heading_block(level: int, content: str) -> Dict[str, Any]:
+    # 支持 heading1-9 (block_type 3-11)
+    return {
+        "block_type": 2 + level,
+        f"heading{level}": {
+            "elements": parse_markdown_text(content),
+            "style": {}
+        }
     }
+
+
+def build_divider_block(_) -> Dict[str, Any]:
+    return {"block_type": 22, "divider": {}}
+
+
+def build_quote_block(content: str) -> Dict[str, Any]:
+    return {
+        "block_type": 15,
+        "quote": {
+            "elements": parse_markdown_text(content),
+            "style": {}
+        }
+    }
+
+
+def build_todo_block(value) -> Dict[str, Any]:
+    # 格式：- [ ] 或 - [x]
+    done, content = value
+    return {
+        "block_type": 17,
+        "todo": {
+            "elements": parse_markdown_text(content),
+            "style": {}
+        },
+        "done": done
+    }
+
+
+def build_bullet_block(content: str) -> Dict[str, Any]:
+    return {
+        "block_type": 12,
+        "bullet": {
+            "elements": parse_markdown_text(content)
+        }
+    }
+
+
+def build_ordered_block(content: str) -> Dict[str, Any]:
+    return {
+        "block_type": 13,
+        "ordered": {
+            "elements": parse_markdown_text(content)
+        }
+    }
+
+
+def build_text_block(line: str) -> Dict[str, Any]:
+    return {
+        "block_type": 2,
+        "text": {
+            "elements": parse_markdown_text(line),
+            "style": {}
+        }
+    }
+
+
+def resolve_image_candidate(url: str, base_dir: Optional[Path]) -> Optional[Path]:
+    """图片地址对应的本地文件路径（不检查是否存在）；网络图片返回 None"""
+    # 判断是否是本地路径（相对路径或绝对路径）
+    if url.startswith('http://') or url.startswith('https://'):
+        return None
+    # 是本地路径，尝试解析
+    md_dir = base_dir
+    if md_dir is None and len(sys.argv) > 1:
+        md_dir = Path(sys.argv[1]).parent
+    if md_dir is None:
+        return None
+    # 尝试将相对路径转换为绝对路径
+    return md_dir / url if not Path(url).is_absolute() else Path(url)
+
+
+def build_image_block(alt: str, url: str, base_dir: Optional[Path]) -> Dict[str, Any]:
+    """图片块：格式 ![alt](url)，本地图片记录 local_path 以便上传"""
+    local_path = None
+    test_path = resolve_image_candidate(url, base_dir)
+    if test_path is not None and test_path.exists():
+        local_path = str(test_path)
+    return {
+        "block_type": 27,
+        "image": {
+            "token": url,
+            "width": 0,
+            "height": 0
+        },
+        "local_path": local_path  # 添加本地路径字段
+    }
+
+
+def build_table_block(table_lines: List[str]) -> Optional[Dict[str, Any]]:
     """
-    lines = markdown_text.split('\n')
-    blocks = []
-    i = 0
-    first_title_skipped = not include_first_title
+    表格块：跳过分隔行，清理单元格；少于两行时不生成表格
+
+    data 为清理后的纯文本，cell_elements 与 data 一一对应，保存单元格的行内格式
+    """
+    table_data = []
+    cell_elements = []
+    for table_line in table_lines:
+        if '|---' in table_line or TABLE_SEPARATOR_RE.match(table_line):
+            continue
+        cells = table_line.split('|')
+        if cells and cells[0].strip() == '':
+            cells.pop(0)
+        if cells and cells[-1].strip() == '':
+            cells.pop()
+        processed_cells = []
+        processed_elements = []
+        for cell in cells:
+            cleaned = clean_cell_content(cell)
+            if cleaned:
+                processed_cells.append(cleaned)
+                processed_elements.append(parse_cell_elements(cell))
+        if processed_cells:
+            table_data.append(processed_cells)
+            cell_elements.append(processed_elements)
+
+    if table_data and len(table_data) > 1:
+        return {
+            "type": "table",
+            "data": table_data,
+            "cell_elements": cell_elements
+        }
+    return None
+
+
+def build_code_block(code_lines: List[str]) -> Dict[str, Any]:
+    return {
+        "block_type": 14,
+        "code": {
+            "elements": [{"text_run": {"content": '\n'.join(code_lines)}}],
+            "style": {"language": 1}
+        }
+    }
+
+
+# 单行块：类型 -> (构建函数, 元数据计数字段)
+LINE_BLOCK_BUILDERS = {
+    TOKEN_DIVIDER: (build_divider_block, None),
+    TOKEN_QUOTE: (build_quote_block, None),
+    TOKEN_TODO: (build_todo_block, "todo_count"),
+    TOKEN_BULLET: (build_bullet_block, "list_count"),
+    TOKEN_ORDERED: (build_ordered_block, "list_count"),
+    TOKEN_TEXT: (build_text_block, None),
+}
+
 
-    # 元数据统计
-    metadata = {
+def new_metadata() -> Dict[str, int]:
+    """创建空的元数据统计"""
+    return {
         "heading_count": 0,
         "table_count": 0,
         "list_count": 0,
@@ -127,13 +612,56 @@ def parse_markdown_to_blocks(markdown_text: str, include_first_title: bool = Fal
         "total_blocks": 0
     }
 
+
+def iter_lines(stream: Iterable[str]) -> Iterator[str]:
+    """
+    逐行读取文本流，去掉行尾换行符
+
+    与 text.split('\n') 的结果一致：文本以换行结尾（或为空）时，最后多出一个空行
+    """
+    for line in stream:
+        if not line.endswith('\n'):
+            yield line
+            return
+        yield line[:-1]
+    yield ''
+
+
+def iter_blocks(stream: Iterable[str], include_first_title: bool = False,
+                base_dir: Optional[Path] = None,
+                metadata: Optional[Dict[str, int]] = None) -> Iterator[Dict[str, Any]]:
+    """
+    流式解析 Markdown：从文件对象逐行读取，每个结构结束时立即产出对应的块
+
+    表格在遇到第一个非表格行时产出，代码块和 :::callout 在结束标记处产出，
+    内存占用与文档大小无关（只缓存当前尚未结束的结构）。
+    传入 metadata 时按产出的块实时更新其中的计数。
+    """
+    if metadata is None:
+        metadata = new_metadata()
+    for block in _iter_blocks(stream, include_first_title, base_dir, metadata):
+        metadata["total_blocks"] += 1
+        yield block
+
+
+def _iter_blocks(stream, include_first_title, base_dir, metadata):
+    lines = iter_lines(stream)
+    pending = None  # 表格结束时多读的一行，留给下一轮处理
+    first_title_skipped = not include_first_title
+
     # 状态变量
     in_callout_block = False
     callout_content = []
     callout_type = 'info'
 
-    while i < len(lines):
-        line = lines[i].rstrip()
+    while True:
+        if pending is not None:
+            raw_line, pending = pending, None
+        else:
+            raw_line = next(lines, None)
+            if raw_line is None:
+                break
+        line = raw_line.rstrip()
 
         # ========== 处理 Callout 块 (:::type 语法) ==========
         if line.startswith(':::'):
@@ -178,227 +706,96 @@ def parse_markdown_to_blocks(markdown_text: str, include_first_title: bool = Fal
                 # 1. 如果 API 返回的 callout 只有 emoji_id 而没有颜色，说明格式错误
                 # 2. 使用测试脚本单独验证 callout 格式
                 # =====================================================
-                blocks.append({
+                metadata["callout_count"] += 1
+                yield {
                     "block_type": 19,
                     "callout": {
-                        "elements": [{"text_run": {"content": callout_text}}],
+                        "elements": parse_markdown_text(callout_text),
                         **style  # 使用 Python 展开操作符，将 style 字段直接展开到 callout 对象下
                     }
-                })
-                metadata["callout_count"] += 1
+                }
                 in_callout_block = False
-            i += 1
             continue
 
         if in_callout_block:
             callout_content.append(line)
-            i += 1
             continue
 
         if not line:
-            i += 1
-            continue
-
-        # ========== 1. 标题 (heading1-9) ==========
-        if line.startswith('#'):
-            level_match = re.match(r'^(#{1,9})\s', line)
-            if level_match:
-                level = len(level_match.group(1))
-                content = line.lstrip('#').strip()
-                if first_title_skipped and level == 1:
-                    first_title_skipped = False
-                    i += 1
-                    continue
-                elements = parse_markdown_text(content)
-                # 支持 heading1-9 (block_type 3-11)
-                blocks.append({
-                    "block_type": 2 + level,
-                    f"heading{level}": {
-                        "elements": elements,
-                        "style": {}
-                    }
-                })
-                metadata["heading_count"] += 1
-                i += 1
-                continue
-
-        # ========== 2. 分割线 ==========
-        if line.strip() == '---':
-            blocks.append({"block_type": 22, "divider": {}})
-            i += 1
-            continue
-
-        # ========== 3. 引用块 (quote) ==========
-        if line.strip().startswith('>'):
-            content = line.strip()[1:].strip()
-            elements = parse_markdown_text(content)
-            blocks.append({
-                "block_type": 15,
-                "quote": {
-                    "elements": elements,
-                    "style": {}
-                }
-            })
-            i += 1
             continue
 
-        # ========== 5. 待办事项 (todo) ==========
-        # 格式：- [ ] 或 - [x]
-        todo_match = re.match(r'^-\s+\[([ x])\]\s*(.*)', line.strip())
-        if todo_match:
-            done = todo_match.group(1).lower() == 'x'
-            content = todo_match.group(2).strip()
-            elements = parse_markdown_text(content)
-            blocks.append({
-                "block_type": 17,
-                "todo": {
-                    "elements": elements,
-                    "style": {}
-                },
-                "done": done
-            })
-            metadata["todo_count"] += 1
-            i += 1
-            continue
-
-        # ========== 6. 粗体列表项 ==========
-        if line.strip().startswith('- **'):
-            content = line.strip()[3:]
-            content = re.sub(r'\*\*', '', content).strip()
-            blocks.append({
-                "block_type": 12,
-                "bullet": {
-                    "elements": [{"text_run": {"content": content, "text_element_style": {"bold": True}}}]
-                }
-            })
-            metadata["list_count"] += 1
-            i += 1
-            continue
+        kind, value = classify_line(line)
 
-        # ========== 7. 普通无序列表 (bullet) ==========
-        if line.strip().startswith('- '):
-            content = line.strip()[2:]
-            blocks.append({
-                "block_type": 12,
-                "bullet": {
-                    "elements": [{"text_run": {"content": content}}]
-                }
-            })
-            metadata["list_count"] += 1
-            i += 1
+        # ========== 单行块：分割线、引用、待办、列表、普通文本 ==========
+        builder = LINE_BLOCK_BUILDERS.get(kind)
+        if builder is not None:
+            build, counter = builder
+            if counter:
+                metadata[counter] += 1
+            yield build(value)
             continue
 
-        # ========== 8. 有序列表 (ordered) ==========
-        if re.match(r'^\d+\.\s', line.strip()):
-            content = re.sub(r'^\d+\.\s', '', line.strip())
-            blocks.append({
-                "block_type": 13,
-                "ordered": {
-                    "elements": [{"text_run": {"content": content}}]
-                }
-            })
-            metadata["list_count"] += 1
-            i += 1
+        # ========== 标题 (heading1-9) ==========
+        if kind == TOKEN_HEADING:
+            level, content = value
+            if first_title_skipped and level == 1:
+                first_title_skipped = False
+                continue
+            metadata["heading_count"] += 1
+            yield build_heading_block(level, content)
             continue
 
-        # ========== 9. 图片 (image) ==========
-        # 格式：![alt](url)
-        image_match = re.match(r'^!\[([^\]]*)\]\(([^\)]+)\)$', line.strip())
-        if image_match:
-            alt = image_match.group(1)
-            url = image_match.group(2)
-            # 保存本地路径以便上传
-            local_path = None
-            # 判断是否是本地路径（相对路径或绝对路径）
-            if not url.startswith('http://') and not url.startswith('https://'):
-                # 是本地路径，尝试解析
-                md_file = sys.argv[1] if len(sys.argv) > 1 else None
-                if md_file:
-                    md_dir = Path(md_file).parent
-                    # 尝试将相对路径转换为绝对路径
-                    test_path = md_dir / url if not Path(url).is_absolute() else Path(url)
-                    if test_path.exists():
-                        local_path = str(test_path)
-            blocks.append({
-                "block_type": 27,
-                "image": {
-                    "token": url,
-                    "width": 0,
-                    "height": 0
-                },
-                "local_path": local_path  # 添加本地路径字段
-            })
+        # ========== 图片 (image) ==========
+        if kind == TOKEN_IMAGE:
+            alt, url = value
             metadata["image_count"] += 1
-            i += 1
+            yield build_image_block(alt, url, base_dir)
             continue
 
-        # ========== 10. 表格 (table) ==========
-        if '|' in line and line.strip():
+        # ========== 表格 (table) ==========
+        if kind == TOKEN_TABLE:
             table_lines = [line]
-            i += 1
-            while i < len(lines) and '|' in lines[i]:
-                table_lines.append(lines[i])
-                i += 1
-
-            # 解析表格
-            table_data = []
-            for table_line in table_lines:
-                if '|---' in table_line or re.match(r'^\|?\s*:?-+:?\s*\|', table_line):
-                    continue
-                cells = table_line.split('|')
-                if cells and cells[0].strip() == '':
-                    cells.pop(0)
-                if cells and cells[-1].strip() == '':
-                    cells.pop()
-                processed_cells = []
-                for cell in cells:
-                    cell = clean_cell_content(cell)
-                    if cell:
-                        processed_cells.append(cell)
-                if processed_cells:
-                    table_data.append(processed_cells)
-
-            if table_data and len(table_data) > 1:
-                blocks.append({
-                    "type": "table",
-                    "data": table_data
-                })
+            for next_line in lines:
+                if '|' not in next_line:
+                    pending = next_line
+                    break
+                table_lines.append(next_line)
+
+            table_block = build_table_block(table_lines)
+            if table_block:
                 metadata["table_count"] += 1
+                yield table_block
             continue
 
-        # ========== 11. 代码块 (code) ==========
-        if line.strip().startswith('```'):
+        # ========== 代码块 (code) ==========
+        if kind == TOKEN_CODE_FENCE:
             code_lines = []
-            i += 1
-            while i < len(lines) and not lines[i].strip().startswith('```'):
-                code_lines.append(lines[i])
-                i += 1
-            code_content = '\n'.join(code_lines)
-            blocks.append({
-                "block_type": 14,
-                "code": {
-                    "elements": [{"text_run": {"content": code_content}}],
-                    "style": {"language": 1}
-                }
-            })
+            for code_line in lines:
+                if code_line.strip().startswith('```'):
+                    break
+                code_lines.append(code_line)
             metadata["code_count"] += 1
-            i += 1
-            continue
+            yield build_code_block(code_lines)
 
-        # ========== 12. 普通文本 (text) ==========
-        if line.strip():
-            elements = parse_markdown_text(line)
-            blocks.append({
-                "block_type": 2,
-                "text": {
-                    "elements": elements,
-                    "style": {}
-                }
-            })
 
-        i += 1
+def parse_markdown_to_blocks(markdown_text: str, include_first_title: bool = False,
+                             base_dir: Optional[Path] = None) -> Dict[str, Any]:
+    """
+    将 Markdown 转换为飞书块
+    支持 25 种飞书文档块类型
 
-    metadata["total_blocks"] = len(blocks)
+    base_dir 用于解析图片的相对路径（通常是 Markdown 文件所在目录），
+    未指定时使用命令行参数中 Markdown 文件的目录
+
+    返回格式：
+    {
+        "blocks": [...],
+        "metadata": {...}
+    }
+    """
+    metadata = new_metadata()
+    blocks = list(iter_blocks(io.StringIO(markdown_text), include_first_title=include_first_title,
+                              base_dir=base_dir, metadata=metadata))
 
     return {
         "blocks": blocks,
@@ -406,12 +803,164 @@ def parse_markdown_to_blocks(markdown_text: str, include_first_title: bool = Fal
     }
 
 
+# ==================== 解析缓存 ====================
+
+_parser_version = None
+
+
+def get_parser_version() -> str:
+    """解析器版本：本文件源码的哈希，解析逻辑有任何修改都会使旧缓存失效"""
+    global _parser_version
+    if _parser_version is None:
+        _parser_version = parse_cache.hash_file(__file__)
+    return _parser_version
+
+
+def get_cache_key(md_file: Path, include_first_title: bool) -> str:
+    """Markdown 文件的缓存键：内容哈希 + 解析器版本 + 解析选项 + 所在目录"""
+    return parse_cache.make_key(
+        parse_cache.hash_file(md_file),
+        get_parser_version(),
+        {"include_first_title": include_first_title},
+        md_file.parent
+    )
+
+
+def image_fingerprint(block: Dict[str, Any], base_dir: Optional[Path]) -> Optional[Dict[str, Any]]:
+    """图片块对应本地文件的指纹（路径 + mtime），用于命中缓存时校验 local_path"""
+    if block.get("block_type") != 27:
+        return None
+    candidate = resolve_image_candidate(block["image"]["token"], base_dir)
+    if candidate is None:
+        return None
+    return parse_cache.file_fingerprint(candidate)
+
+
+def parse_markdown_file(md_file, include_first_title: bool = False,
+                        use_cache: bool = True) -> Dict[str, Any]:
+    """
+    读取并解析 Markdown 文件，图片相对路径相对于文件所在目录解析
+
+    use_cache=True 时内容未变化的文件直接返回缓存的解析结果
+    """
+    md_file = Path(md_file)
+
+    cache_key = None
+    if use_cache:
+        cache_key = get_cache_key(md_file, include_first_title)
+        cached = parse_cache.lookup(cache_key)
+        result = parse_cache.load(cached) if cached is not None else None
+        if result is not None:
+            return result
+
+    with open(md_file, 'r', encoding='utf-8') as f:
+        markdown_content = f.read()
+    result = parse_markdown_to_blocks(markdown_content, include_first_title=include_first_title,
+                                      base_dir=md_file.parent)
+
+    if cache_key is not None:
+        images = [image_fingerprint(block, md_file.parent) for block in result["blocks"]]
+        parse_cache.store_result(cache_key, result, [image for image in images if image])
+
+    return result
+
+
+def write_parse_output(result: Dict[str, Any], output_dir) -> Path:
+    """保存解析结果到 blocks.json 和 metadata.json，返回 blocks.json 路径"""
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    blocks_file = output_dir / "blocks.json"
+    with open(blocks_file, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+    metadata_file = output_dir / "metadata.json"
+    with open(metadata_file, 'w', encoding='utf-8') as f:
+        json.dump(result["metadata"], f, ensure_ascii=False, indent=2)
+
+    return blocks_file
+
+
+def write_blocks_stream(blocks: Iterable[Dict[str, Any]], output_dir,
+                        metadata: Dict[str, int]) -> Path:
+    """
+    边解析边写入 blocks.json，不在内存中保留块列表
+
+    格式与 write_parse_output 相同（"metadata" 在 "blocks" 之后写入，
+    此时计数已完整），随后写 metadata.json。返回 blocks.json 路径
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    blocks_file = output_dir / "blocks.json"
+    with open(blocks_file, 'w', encoding='utf-8') as f:
+        f.write('{\n  "blocks": [')
+        separator = '\n'
+        for block in blocks:
+            block_json = json.dumps(block, ensure_ascii=False, indent=2)
+            f.write(separator + '\n'.join('    ' + line for line in block_json.split('\n')))
+            separator = ',\n'
+        f.write('\n  ],\n  "metadata": ' if separator == ',\n' else '],\n  "metadata": ')
+        f.write(json.dumps(metadata, ensure_ascii=False, indent=2).replace('\n', '\n  '))
+        f.write('\n}')
+
+    metadata_file = output_dir / "metadata.json"
+    with open(metadata_file, 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, ensure_ascii=False, indent=2)
+
+    return blocks_file
+
+
+def stream_markdown_file(md_file, output_dir, include_first_title: bool = False,
+                         use_cache: bool = True):
+    """
+    流式解析 Markdown 文件并写入 blocks.json，内存占用与文件大小无关
+
+    use_cache=True 时先查解析缓存，命中则直接复制缓存的 blocks.json / metadata.json。
+    返回 (元数据统计, 是否命中缓存)
+    """
+    md_file = Path(md_file)
+
+    cache_key = None
+    if use_cache:
+        cache_key = get_cache_key(md_file, include_first_title)
+        cached = parse_cache.lookup(cache_key)
+        metadata = parse_cache.copy_to(cached, output_dir) if cached is not None else None
+        if metadata is not None:
+            return metadata, True
+
+    metadata = new_metadata()
+    images = []
+
+    def record_images(blocks):
+        for block in blocks:
+            fingerprint = image_fingerprint(block, md_file.parent)
+            if fingerprint:
+                images.append(fingerprint)
+            yield block
+
+    with open(md_file, 'r', encoding='utf-8') as f:
+        blocks = iter_blocks(f, include_first_title=include_first_title,
+                             base_dir=md_file.parent, metadata=metadata)
+        blocks_file = write_blocks_stream(record_images(blocks), output_dir, metadata)
+
+    if cache_key is not None:
+        parse_cache.store_files(cache_key, blocks_file, Path(output_dir) / "metadata.json", images)
+
+    return metadata, False
+
+
 def main():
     """主函数 - 命令行入口"""
-    if len(sys.argv) < 2:
-        print("Usage: python md_parser.py <markdown_file> [output_dir]")
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    use_cache = "--no-cache" not in sys.argv
+
+    if len(args) < 1:
+        print("Usage: python md_parser.py <markdown_file> [output_dir] [--no-cache]")
         print("Example: python md_parser.py input.md workflow/step1_parse")
         print()
+        print("  --no-cache  不使用解析缓存（默认内容未变化的文件直接使用缓存结果）")
+        print()
         print("支持的块类型：25 种飞书文档块")
         print("  - 文本块：text, heading1-9")
         print("  - 列表：bullet, ordered, todo")
@@ -419,46 +968,41 @@ def main():
         print("  - 高级：table, bitable, grid, sheet, board")
         sys.exit(1)
 
-    md_file = Path(sys.argv[1])
+    md_file = Path(args[0])
     if not md_file.exists():
         print(f"Error: Markdown file not found: {md_file}")
         sys.exit(1)
 
     # 输出目录
-    if len(sys.argv) >= 3:
-        output_dir = Path(sys.argv[2])
+    if len(args) >= 2:
+        output_dir = Path(args[1])
     else:
         output_dir = Path("output")
 
     output_dir.mkdir(parents=True, exist_ok=True)
 
-    # 读取 Markdown 文件
-    with open(md_file, 'r', encoding='utf-8') as f:
-        markdown_content = f.read()
-
     print("=" * 70)
     print("Markdown Parser - Support 25 Feishu Block Types")
     print("=" * 70)
     print(f"Input file: {md_file}")
-    print(f"Content length: {len(markdown_content)} characters")
+    print(f"File size: {md_file.stat().st_size} bytes")
     print()
 
-    # 解析 Markdown
+    # 流式解析 Markdown，边解析边写入 JSON 文件
     start_time = time.time()
-    result = parse_markdown_to_blocks(markdown_content, include_first_title=False)
+    metadata, cache_hit = stream_markdown_file(md_file, output_dir, include_first_title=False,
+                                               use_cache=use_cache)
     parse_time = time.time() - start_time
+    result = {"metadata": metadata}
 
-    # 输出 JSON 文件
     blocks_file = output_dir / "blocks.json"
-    with open(blocks_file, 'w', encoding='utf-8') as f:
-        json.dump(result, f, ensure_ascii=False, indent=2)
-
     metadata_file = output_dir / "metadata.json"
-    with open(metadata_file, 'w', encoding='utf-8') as f:
-        json.dump(result["metadata"], f, ensure_ascii=False, indent=2)
 
     # 打印结果
-    print(f"[OK] Parse completed in {parse_time:.2f}s")
+    if cache_hit:
+        print(f"[CACHE] 内容未变化，使用缓存的解析结果 ({parse_time:.2f}s)")
+    else:
+        print(f"[OK] Parse completed in {parse_time:.2f}s")
     print(f"[OUTPUT] {blocks_file}")
     print(f"[METADATA] {metadata_file}")
     print()
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Markdown 解析缓存
+按内容寻址的磁盘缓存：键为文件内容哈希 + 解析器版本 + 解析选项，
+命中时直接返回保存的 blocks.json / metadata.json，无需重新解析
+
+每个缓存条目是一个目录：
+    <缓存目录>/<键前两位>/<键>/
+        blocks.json      解析结果（与 md_parser 输出格式相同）
+        metadata.json    元数据
+        images.json      图片本地路径及其 mtime，命中时用于快速校验 local_path 是否仍然有效
+
+总大小超过上限时按最近使用时间（条目目录的 mtime，命中时刷新）淘汰最旧的条目。
+淘汰需要遍历整个缓存目录，写入时不会每次都执行：距上次淘汰超过 EVICT_INTERVAL 秒
+（以缓存目录下的 .last_evict 文件为准，多个进程共享），或本进程写入的数据量达到上限的
+1/EVICT_WRITE_FRACTION 时才执行。
+
+条目缺失或损坏（被其他进程淘汰、手动删除、磁盘写坏）时按未命中处理，调用方重新解析。
+"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+from pathlib import Path
+
+
+# 缓存条目格式版本，格式变化时递增，旧条目自动失效
+CACHE_FORMAT_VERSION = 1
+
+# 默认缓存上限（MB），可通过环境变量 FEISHU_PARSE_CACHE_MAX_MB 修改
+DEFAULT_MAX_MB = 256
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# 两次淘汰之间的最短间隔（秒）
+EVICT_INTERVAL = 300
+
+# 本进程写入的数据量达到上限的 1/EVICT_WRITE_FRACTION 时，不等间隔到期就执行淘汰
+EVICT_WRITE_FRACTION = 10
+
+EVICT_STAMP_NAME = ".last_evict"
+
+# 本进程自上次淘汰以来写入的字节数
+_bytes_since_evict = 0
+_evict_lock = threading.Lock()
+
+
+def get_cache_dir():
+    """缓存目录：环境变量 FEISHU_PARSE_CACHE_DIR，默认为项目 .claude/feishu-parse-cache"""
+    env_dir = os.environ.get("FEISHU_PARSE_CACHE_DIR")
+    if env_dir:
+        return Path(env_dir)
+    project_root = Path(__file__).parent.parent.parent.parent.parent
+    claude_dir = project_root / ".claude"
+    if not claude_dir.exists():
+        claude_dir = Path(".claude")
+    return claude_dir / "feishu-parse-cache"
+
+
+def get_max_bytes():
+    """缓存总大小上限（字节）"""
+    try:
+        max_mb = float(os.environ.get("FEISHU_PARSE_CACHE_MAX_MB", DEFAULT_MAX_MB))
+    except ValueError:
+        max_mb = DEFAULT_MAX_MB
+    return int(max_mb * 1024 * 1024)
+
+
+def hash_file(path):
+    """分块计算文件内容的 sha256，内存占用与文件大小无关"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_key(content_hash, parser_version, options, base_dir):
+    """
+    缓存键：内容哈希 + 解析器版本 + 解析选项 + 图片相对路径的基准目录
+
+    基准目录决定相对图片路径解析到哪里，同一内容放在不同目录下结果可能不同
+    """
+    key_data = {
+        "format": CACHE_FORMAT_VERSION,
+        "content": content_hash,
+        "parser": parser_version,
+        "options": options,
+        "base_dir": str(Path(base_dir).resolve()) if base_dir is not None else None,
+    }
+    encoded = json.dumps(key_data, sort_keys=True, ensure_ascii=False).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def entry_dir(key, cache_dir=None):
+    """缓存条目目录"""
+    cache_dir = Path(cache_dir) if cache_dir else get_cache_dir()
+    return cache_dir / key[:2] / key
+
+
+def file_fingerprint(path):
+    """图片文件指纹：路径和 mtime（纳秒），文件不存在时 mtime 为 None"""
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except OSError:
+        mtime_ns = None
+    return {"path": str(path), "mtime_ns": mtime_ns}
+
+
+def images_unchanged(images):
+    """校验缓存中记录的图片文件是否都没有变化（只 stat，不读内容）"""
+    return all(file_fingerprint(image["path"]) == image for image in images)
+
+
+def lookup(key, cache_dir=None):
+    """
+    查找缓存条目
+
+    命中且图片未变化时返回条目目录（并刷新其最近使用时间），否则返回 None
+    """
+    directory = entry_dir(key, cache_dir)
+    try:
+        with open(directory / "images.json", 'r', encoding='utf-8') as f:
+            images = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if not images_unchanged(images):
+        return None
+
+    try:
+        os.utime(directory)
+    except OSError:
+        return None
+    return directory
+
+
+def load(directory):
+    """
+    读取缓存条目中的解析结果 {"blocks", "metadata"}
+
+    条目在 lookup 之后被删除或文件损坏时返回 None，调用方按未命中处理
+    """
+    try:
+        with open(Path(directory) / "blocks.json", 'r', encoding='utf-8') as f:
+            result = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(result, dict) or "blocks" not in result or "metadata" not in result:
+        return None
+    return result
+
+
+def copy_to(directory, output_dir):
+    """
+    把缓存条目中的 blocks.json / metadata.json 复制到输出目录，返回元数据
+
+    条目缺失或 metadata.json 损坏时返回 None，调用方按未命中处理（重新解析会覆盖输出目录）
+    """
+    directory = Path(directory)
+    output_dir = Path(output_dir)
+    try:
+        with open(directory / "metadata.json", 'r', encoding='utf-8') as f:
+            metadata = json.load(f)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(directory / "blocks.json", output_dir / "blocks.json")
+        shutil.copyfile(directory / "metadata.json", output_dir / "metadata.json")
+    except (OSError, ValueError):
+        return None
+    return metadata
+
+
+def _store(key, write_entry, images, cache_dir=None, max_bytes=None):
+    """
+    写入缓存条目：write_entry(tmp_dir) 负责写 blocks.json / metadata.json
+
+    先写入临时目录再整体改名，其他进程不会读到写了一半的条目。写入后按需淘汰旧条目
+    """
+    cache_dir = Path(cache_dir) if cache_dir else get_cache_dir()
+    max_bytes = get_max_bytes() if max_bytes is None else max_bytes
+
+    directory = entry_dir(key, cache_dir)
+    try:
+        directory.parent.mkdir(parents=True, exist_ok=True)
+        tmp_dir = Path(tempfile.mkdtemp(prefix=f".{key[:8]}-", dir=directory.parent))
+    except OSError:
+        return None
+
+    try:
+        write_entry(tmp_dir)
+        with open(tmp_dir / "images.json", 'w', encoding='utf-8') as f:
+            json.dump(images, f, ensure_ascii=False)
+        size = _entry_size(tmp_dir)
+        if size > max_bytes:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return None
+        if directory.exists():
+            shutil.rmtree(directory, ignore_errors=True)
+        os.rename(tmp_dir, directory)
+    except OSError:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return None
+
+    maybe_evict(cache_dir, max_bytes, size)
+    return directory
+
+
+def store_files(key, blocks_file, metadata_file, images, cache_dir=None, max_bytes=None):
+    """把已写好的 blocks.json / metadata.json 保存到缓存（流式解析使用）"""
+    def write_entry(tmp_dir):
+        shutil.copyfile(blocks_file, tmp_dir / "blocks.json")
+        shutil.copyfile(metadata_file, tmp_dir / "metadata.json")
+    return _store(key, write_entry, images, cache_dir, max_bytes)
+
+
+def store_result(key, result, images, cache_dir=None, max_bytes=None):
+    """把内存中的解析结果 {"blocks", "metadata"} 保存到缓存"""
+    def write_entry(tmp_dir):
+        with open(tmp_dir / "blocks.json", 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        with open(tmp_dir / "metadata.json", 'w', encoding='utf-8') as f:
+            json.dump(result["metadata"], f, ensure_ascii=False, indent=2)
+    return _store(key, write_entry, images, cache_dir, max_bytes)
+
+
+def _entry_size(directory):
+    total = 0
+    for name in ("blocks.json", "metadata.json", "images.json"):
+        try:
+            total += os.path.getsize(directory / name)
+        except OSError:
+            pass
+    return total
+
+
+def maybe_evict(cache_dir, max_bytes, written=0):
+    """
+    按需淘汰：距上次淘汰超过 EVICT_INTERVAL 秒，或本进程自上次淘汰以来写入的数据量
+    达到上限的 1/EVICT_WRITE_FRACTION 时执行 evict，返回删除的条目数（未执行时为 0）
+    """
+    global _bytes_since_evict
+    stamp = Path(cache_dir) / EVICT_STAMP_NAME
+    with _evict_lock:
+        _bytes_since_evict += written
+        try:
+            due = time.time() - stamp.stat().st_mtime >= EVICT_INTERVAL
+        except OSError:
+            due = True
+        if not due and _bytes_since_evict * EVICT_WRITE_FRACTION < max_bytes:
+            return 0
+        _bytes_since_evict = 0
+        try:
+            stamp.touch()
+        except OSError:
+            pass
+    return evict(cache_dir, max_bytes)
+
+
+def evict(cache_dir=None, max_bytes=None):
+    """总大小超过上限时，按最近使用时间从旧到新删除条目，返回删除的条目数"""
+    cache_dir = Path(cache_dir) if cache_dir else get_cache_dir()
+    max_bytes = get_max_bytes() if max_bytes is None else max_bytes
+    if not cache_dir.exists():
+        return 0
+
+    entries = []
+    total = 0
+    for shard in cache_dir.iterdir():
+        if not shard.is_dir():
+            continue
+        for directory in shard.iterdir():
+            if directory.name.startswith('.'):
+                # 未完成的临时目录：超过一小时视为遗留，顺便清理
+                try:
+                    if time.time() - directory.stat().st_mtime > 3600:
+                        shutil.rmtree(directory, ignore_errors=True)
+                except OSError:
+                    pass
+                continue
+            try:
+                last_used = directory.stat().st_mtime
+            except OSError:
+                continue
+            size = _entry_size(directory)
+            entries.append((last_used, size, directory))
+            total += size
+
+    removed = 0
+    for last_used, size, directory in sorted(entries, key=lambda entry: entry[0]):
+        if total <= max_bytes:
+            break
+        shutil.rmtree(directory, ignore_errors=True)
+        total -= size
+        removed += 1
+    return removed
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""md_parser 行内格式解析的测试"""
+
+import time
+
+import pytest
+
+from md_parser import parse_markdown_text, parse_cell_elements
+
+
+def run(content, style=None):
+    if style:
+        return {"text_run": {"content": content, "text_element_style": style}}
+    return {"text_run": {"content": content}}
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("普通文本", [run("普通文本")]),
+    ("  前后空白  ", [run("前后空白")]),
+    ("包含 **粗体** 文字", [run("包含 "), run("粗体", {"bold": True}), run(" 文字")]),
+    ("**a** b **c**", [run("a", {"bold": True}), run(" b "), run("c", {"bold": True})]),
+    ("**未闭合", [run("**未闭合")]),
+    ("a ** b ** c", [run("a ** b ** c")]),
+    ("****", [run("****")]),
+])
+def test_bold_only(text, expected):
+    assert parse_markdown_text(text) == expected
+
+
+def test_nested_styles():
+    assert parse_markdown_text("**粗 *斜* 体**") == [
+        run("粗 ", {"bold": True}),
+        run("斜", {"bold": True, "italic": True}),
+        run(" 体", {"bold": True}),
+    ]
+    assert parse_markdown_text("~~删除~~ 和 *斜体*") == [
+        run("删除", {"strikethrough": True}),
+        run(" 和 "),
+        run("斜体", {"italic": True}),
+    ]
+
+
+def test_unmatched_delimiters_stay_literal():
+    assert parse_markdown_text("2 * 3 = 6") == [run("2 * 3 = 6")]
+    assert parse_markdown_text("a *b") == [run("a *b")]
+
+
+def test_inline_code_and_escape():
+    assert parse_markdown_text("调用 `foo()` 即可") == [
+        run("调用 "), run("foo()", {"inline_code": True}), run(" 即可")
+    ]
+    assert parse_markdown_text(r"\*不是斜体\*") == [run("*不是斜体*")]
+    assert parse_markdown_text("`a``b`") == [run("a``b", {"inline_code": True})]
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("``a`b``", [run("a`b", {"inline_code": True})]),
+    ("`a` `b`", [run("a", {"inline_code": True}), run(" "), run("b", {"inline_code": True})]),
+    ("``a`", [run("``a`")]),
+    ("`a``", [run("`a``")]),
+    ("x `` y", [run("x `` y")]),
+    ("`**不是粗体**`", [run("**不是粗体**", {"inline_code": True})]),
+    ("`a\\`b", [run("a\\", {"inline_code": True}), run("b")]),
+    ("\\``a`", [run("`"), run("a", {"inline_code": True})]),
+    ("``` `a` ```", [run(" `a` ", {"inline_code": True})]),
+])
+def test_code_span_closed_by_same_length_run(text, expected):
+    """反引号串只由等长的反引号串闭合（CommonMark）"""
+    assert parse_markdown_text(text) == expected
+
+
+def test_link_url_is_encoded():
+    assert parse_markdown_text("见 [文档](https://a.com/x?y=1)") == [
+        run("见 "),
+        run("文档", {"link": {"url": "https%3A%2F%2Fa.com%2Fx%3Fy%3D1"}}),
+    ]
+    assert parse_markdown_text("[中文](https://a.com/路径)")[0]["text_run"]["text_element_style"] == {
+        "link": {"url": "https%3A%2F%2Fa.com%2F%E8%B7%AF%E5%BE%84"}
+    }
+
+
+def test_link_inside_bold():
+    assert parse_markdown_text("**[a](u)**") == [run("a", {"bold": True, "link": {"url": "u"}})]
+
+
+@pytest.mark.parametrize("text", [
+    "![图片](a.png)",
+    "[a](有 空格)",
+    "[a]()",
+    "[a] (u)",
+    "[未闭合](u",
+])
+def test_not_links(text):
+    assert parse_markdown_text(text) == [run(text)]
+
+
+def test_nested_brackets_use_innermost_link():
+    assert parse_markdown_text("[a[b](u)") == [run("[a"), run("b", {"link": {"url": "u"}})]
+
+
+def test_zero_width_characters_removed():
+    assert parse_markdown_text("a​b **c﻿**") == [run("ab "), run("c", {"bold": True})]
+    assert parse_cell_elements("​ **x**\n第二行") == [run("x", {"bold": True})]
+
+
+def test_empty_input():
+    assert parse_markdown_text("") == [run("")]
+    assert parse_markdown_text("   ") == [run("   ")]
+
+
+@pytest.mark.parametrize("unit", ["[a](", "[", "![", "](", "`a", "``a`", "`a``b", "**a ", "\\"])
+def test_unclosed_markup_is_linear(unit):
+    """未闭合的括号、反引号不能让每个开始符都重新扫描到行尾（原来 n=16000 时需要十几秒）"""
+    text = unit * 20000
+    start = time.perf_counter()
+    elements = parse_markdown_text(text)
+    assert time.perf_counter() - start < 2
+    assert ''.join(e["text_run"]["content"] for e in elements)
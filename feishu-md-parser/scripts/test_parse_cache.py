@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""parse_cache 缓存读取容错与淘汰节流的测试"""
+
+import os
+import time
+
+import pytest
+
+import parse_cache
+from md_parser import get_cache_key, parse_markdown_file, stream_markdown_file
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    directory = tmp_path / "cache"
+    monkeypatch.setenv("FEISHU_PARSE_CACHE_DIR", str(directory))
+    monkeypatch.setattr(parse_cache, "_bytes_since_evict", 0)
+    return directory
+
+
+@pytest.fixture
+def md_file(tmp_path):
+    path = tmp_path / "doc.md"
+    path.write_text("# 标题\n\n正文 **粗体**\n", encoding='utf-8')
+    return path
+
+
+def cached_entry(md_file):
+    return parse_cache.entry_dir(get_cache_key(md_file, False))
+
+
+def test_cache_hit_returns_same_result(cache_dir, md_file):
+    first = parse_markdown_file(md_file)
+    assert cached_entry(md_file).exists()
+    assert parse_markdown_file(md_file) == first
+
+
+@pytest.mark.parametrize("damage", ["delete", "truncate", "wrong_shape"])
+def test_broken_entry_falls_back_to_parsing(cache_dir, md_file, damage):
+    expected = parse_markdown_file(md_file)
+    blocks_file = cached_entry(md_file) / "blocks.json"
+    if damage == "delete":
+        blocks_file.unlink()
+    elif damage == "truncate":
+        blocks_file.write_text('{"blocks": [', encoding='utf-8')
+    else:
+        blocks_file.write_text('[]', encoding='utf-8')
+
+    assert parse_cache.load(cached_entry(md_file)) is None
+    assert parse_markdown_file(md_file) == expected
+    # 重新解析后条目被覆盖，下次正常命中
+    assert parse_cache.load(cached_entry(md_file)) == expected
+
+
+def test_stream_falls_back_when_metadata_is_broken(cache_dir, md_file, tmp_path):
+    metadata, hit = stream_markdown_file(md_file, tmp_path / "out1")
+    assert not hit
+    (cached_entry(md_file) / "metadata.json").write_text("{", encoding='utf-8')
+
+    assert stream_markdown_file(md_file, tmp_path / "out2") == (metadata, False)
+    assert stream_markdown_file(md_file, tmp_path / "out3") == (metadata, True)
+
+
+def store(key, size, max_bytes):
+    result = {"blocks": [{"text": "x" * size}], "metadata": {}}
+    return parse_cache.store_result(key, result, [], max_bytes=max_bytes)
+
+
+def count_entries(cache_dir):
+    return sum(1 for shard in cache_dir.iterdir() if shard.is_dir() for entry in shard.iterdir()
+               if not entry.name.startswith('.'))
+
+
+def test_eviction_is_throttled(cache_dir, monkeypatch):
+    max_bytes = 100000
+    # 第一次写入时还没有 .last_evict，执行一次淘汰并写入时间戳
+    store("a" * 64, 1000, max_bytes)
+    assert (cache_dir / parse_cache.EVICT_STAMP_NAME).exists()
+
+    calls = []
+    real_evict = parse_cache.evict
+    monkeypatch.setattr(parse_cache, "evict", lambda *args: calls.append(args) or real_evict(*args))
+
+    # 写入量不到上限的 1/10：不淘汰
+    for idx in range(5):
+        store(f"{idx:02d}" + "b" * 62, 1000, max_bytes)
+    assert calls == []
+
+    # 累计写入达到上限的 1/10：淘汰一次
+    store("c" * 64, 6000, max_bytes)
+    assert len(calls) == 1
+
+    # 距上次淘汰超过间隔：下一次写入即淘汰
+    old = time.time() - parse_cache.EVICT_INTERVAL - 1
+    os.utime(cache_dir / parse_cache.EVICT_STAMP_NAME, (old, old))
+    store("d" * 64, 10, max_bytes)
+    assert len(calls) == 2
+
+
+def test_throttled_eviction_still_enforces_limit(cache_dir):
+    max_bytes = 20000
+    for idx in range(20):
+        store(f"{idx:02d}" + "e" * 62, 1000, max_bytes)
+    assert count_entries(cache_dir) < 20
+    assert sum(parse_cache._entry_size(entry) for shard in cache_dir.iterdir() if shard.is_dir()
+               for entry in shard.iterdir()) <= max_bytes + max_bytes // parse_cache.EVICT_WRITE_FRACTION + 2000